@@ -30,6 +30,9 @@ type PhotoEntry = {
   id: number;
 };
 
+const REFINE_POLL_INTERVAL = 2000;
+const REFINE_POLL_ATTEMPTS = 30;
+
 export default function PhotoCatalogScreen() {
   const { token, logout } = useAuth();
   const { background, text, primary, border } = useThemeColors();
@@ -43,6 +46,34 @@ export default function PhotoCatalogScreen() {
     setPanelVisible((prev) => !prev);
   }, []);
 
+  const downloadPhoto = async (processedUri: string, photoId: number, version: number) => {
+    const localUri = FileSystem.cacheDirectory + `photo_${photoId}_v${version}.jpg`;
+    const downloadRes = await FileSystem.downloadAsync(processedUri, localUri);
+
+    if (downloadRes.status !== 200) {
+      throw new Error('Failed to download processed image.');
+    }
+    return downloadRes.uri;
+  };
+
+  // The upload returns a quick preview; poll until the full dewarp replaces it
+  const waitForRefinedPhoto = async (photoId: number, version: number) => {
+    for (let attempt = 0; attempt < REFINE_POLL_ATTEMPTS; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, REFINE_POLL_INTERVAL));
+      try {
+        const response = await api.get(`/photos/status/${photoId}/`);
+        if (response.data.version !== version) {
+          const refinedUri = await downloadPhoto(response.data.processed_url, photoId, response.data.version);
+          setPhotos((prev) => prev.map((photo) => (photo.id === photoId ? { ...photo, uri: refinedUri } : photo)));
+          return;
+        }
+      } catch (error: any) {
+        console.error(error.response || error.message);
+        return;
+      }
+    }
+  };
+
   const handleUploadPhoto = async (uri:string) => {
 
     const filename = uri.split('/').pop();
@@ -55,6 +86,7 @@ export default function PhotoCatalogScreen() {
       name: filename,
       type,
     } as any);
+    formData.append('progressive', 'true');
 
     try {
       const response = await api.post('/photos/upload-photo/', formData, {
@@ -69,18 +101,14 @@ export default function PhotoCatalogScreen() {
         text2: 'Processed photo received.',
       });
       
-      const processedUri = response.data.processed_url;
-      const localFileName = `photo_${response.data.photo_id}.jpg`;
-
-      const localUri = FileSystem.cacheDirectory + localFileName;
+      const { processed_url, photo_id, version, is_preview } = response.data;
+      const localUri = await downloadPhoto(processed_url, photo_id, version);
 
-      const downloadRes = await FileSystem.downloadAsync(processedUri, localUri);
+      setPhotos((prev) => [...prev, { uri: localUri, id: photo_id }]);
 
-      if (downloadRes.status !== 200) {
-        throw new Error('Failed to download processed image.');
+      if (is_preview) {
+        waitForRefinedPhoto(photo_id, version);
       }
-
-      setPhotos((prev) => [...prev, { uri: downloadRes.uri, id: response.data.photo_id }]);
     } catch (error: any) {
       const errorMessage = error.response || error.message;
       console.error(errorMessage);
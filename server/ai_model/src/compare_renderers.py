@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: compare_renderers.py
+Date: 2026-10-19
+Description: Equivalence check of the generator's page renderers. Renders the same random documents with
+             LibreOffice and with the in-process PageRenderer and compares the distributions of ink density,
+             text line height and line spacing of the pages, together with the rendering times. The in-process
+             renderer should only replace LibreOffice as the default once this check passes.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from data_generator import DocumentImageGenerator
+
+METRICS = ("ink_density", "line_height", "line_spacing")
+
+
+def page_metrics(page: np.ndarray, image_scale: float) -> dict:
+    """
+    Measures a flat page.
+
+    Params:
+        page (np.ndarray): Grayscale uint8 page (white paper, black text).
+        image_scale (float): Scale the page was rendered at, lengths are reported at scale 1 (200 dpi).
+
+    Returns:
+        dict: "ink_density" (fraction of dark pixels) and the lists "line_height" (height of each text
+              line) and "line_spacing" (distance between the bottoms of consecutive lines) in pixels.
+    """
+    ink = page < 128
+    ink_rows = ink.any(axis=1)
+
+    # Text lines are the runs of rows with ink
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], ink_rows.astype(np.int8), [0]])))
+    starts, ends = edges[0::2], edges[1::2]
+
+    return {
+        "ink_density": [float(ink.mean())],
+        "line_height": list((ends - starts) / image_scale),
+        "line_spacing": list(np.diff(ends) / image_scale),
+    }
+
+
+def summarize(values) -> dict:
+    """Mean and 10th, 50th and 90th percentile of a list of values."""
+    if not values:
+        return {"count": 0, "mean": float("nan"), "p10": float("nan"), "p50": float("nan"), "p90": float("nan")}
+    p10, p50, p90 = np.percentile(values, [10, 50, 90])
+    return {"count": len(values), "mean": float(np.mean(values)), "p10": float(p10), "p50": float(p50), "p90": float(p90)}
+
+
+def compare_renderers(file_path: str, documents: int = 10, image_scale: float = 0.45, seed: int = 0,
+                      renderers=("libreoffice", "numpy")) -> dict:
+    """
+    Renders the same random documents with every renderer and measures the pages.
+
+    Params:
+        file_path (str): Word list of the generator.
+        documents (int): Number of random documents.
+        image_scale (float): Scale of the pages.
+        seed (int): Seed of the random documents.
+        renderers (tuple): Renderers to compare, the first is the reference.
+
+    Returns:
+        dict: Per renderer the number of pages, the seconds per document and per page, and a summary
+              (see summarize()) of every metric over all pages.
+    """
+    generators = {renderer: DocumentImageGenerator(file_path, renderer) for renderer in renderers}
+    # The rows come from a generator of their own, so every renderer gets the same documents
+    source = DocumentImageGenerator(file_path, renderers[0])
+    source.set_seed(seed)
+
+    values = {renderer: {metric: [] for metric in METRICS} for renderer in renderers}
+    seconds = dict.fromkeys(renderers, 0.0)
+    pages = dict.fromkeys(renderers, 0)
+
+    for _ in range(documents):
+        rows = source._generate_random_rows()
+        for renderer, generator in generators.items():
+            start = time.perf_counter()
+            rendered = generator._render_pages(image_scale, rows)
+            seconds[renderer] += time.perf_counter() - start
+            pages[renderer] += len(rendered)
+            for page in rendered:
+                for metric, page_values in page_metrics(page, image_scale).items():
+                    values[renderer][metric].extend(page_values)
+
+    return {
+        renderer: {
+            "pages": pages[renderer],
+            "seconds_per_document": seconds[renderer] / documents,
+            "seconds_per_page": seconds[renderer] / max(1, pages[renderer]),
+            "truetype": generators[renderer]._page_renderer.uses_truetype if renderer == "numpy" else True,
+            **{metric: summarize(values[renderer][metric]) for metric in METRICS},
+        }
+        for renderer in renderers
+    }
+
+
+def differences(report: dict, reference: str = "libreoffice") -> dict:
+    """Relative difference of the median of every metric and of the page count to the reference renderer."""
+    result = {}
+    for renderer, stats in report.items():
+        if renderer == reference:
+            continue
+        result[renderer] = {"pages": stats["pages"] / max(1, report[reference]["pages"]) - 1}
+        for metric in METRICS:
+            expected = report[reference][metric]["p50"]
+            result[renderer][metric] = stats[metric]["p50"] / expected - 1 if expected else float("nan")
+    return result
+
+
+def format_report(report: dict) -> str:
+    """Formats compare_renderers() as a text table."""
+    lines = [f"{'renderer':<12} {'metric':<14} {'mean':>8} {'p10':>8} {'p50':>8} {'p90':>8}"]
+    for renderer, stats in report.items():
+        for metric in METRICS:
+            summary = stats[metric]
+            lines.append(f"{renderer:<12} {metric:<14} {summary['mean']:>8.4g} {summary['p10']:>8.4g} "
+                         f"{summary['p50']:>8.4g} {summary['p90']:>8.4g}")
+        lines.append(f"{renderer:<12} {stats['pages']} pages, {stats['seconds_per_document']:.3f} s/document, "
+                     f"{stats['seconds_per_page'] * 1000:.1f} ms/page"
+                     + ("" if stats["truetype"] else ", Hershey fonts (diacritics dropped)"))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the in-process page renderer with LibreOffice.")
+    parser.add_argument("--text", default="assets/text.txt", help="Word list for the generator.")
+    parser.add_argument("--documents", type=int, default=10, help="Number of random documents.")
+    parser.add_argument("--image-scale", type=float, default=0.45)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-difference", type=float, default=0.1,
+                        help="Largest accepted relative difference of a median (and of the page count).")
+    args = parser.parse_args()
+
+    report = compare_renderers(args.text, args.documents, args.image_scale, args.seed)
+    print(format_report(report))
+
+    failed = False
+    for renderer, metrics in differences(report).items():
+        for metric, difference in metrics.items():
+            ok = abs(difference) <= args.max_difference
+            failed |= not ok
+            print(f"{renderer} {metric}: {difference:+.1%} {'ok' if ok else 'FAIL'}")
+    if not report["numpy"]["truetype"]:
+        print("numpy: Liberation Sans not found, text is drawn without diacritics FAIL")
+        failed = True
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
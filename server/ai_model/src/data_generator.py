@@ -13,24 +13,40 @@ from odf.style import Style, TextProperties
 from odf.table import Table, TableRow, TableCell
 from odf.text import P
 import random
-from numpy.random import choice
 import subprocess
 import os
+import tempfile
 from pdf2image import convert_from_path
 import cv2
 import numpy as np
-import math
+
+from deformation import DeformationParams, GridDescriptor, deformation_maps, expand_grid, remap_batch
+from page_renderer import Cell, PageRenderer
+
+RENDERERS = ("numpy", "libreoffice")
 
 class DocumentImageGenerator():
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, renderer: str = "libreoffice"):
         """
         Initializes the data generator with a list of words from a text file.
 
         Params:
             file_path (str): Path to a text file containing a list of words.
+            renderer (str): "libreoffice" converts an ODS file with LibreOffice and pdf2image (needs libreoffice
+                            and poppler-utils), "numpy" renders the pages in-process (PageRenderer). Check the
+                            in-process pages against LibreOffice with compare_renderers.py before switching.
         """
+        if renderer not in RENDERERS:
+            raise ValueError(f"Unknown renderer {renderer!r}, expected one of {', '.join(RENDERERS)}.")
+
         self._images = []
-        self._grids = []
+        self._descriptors = []  # GridDescriptor per image, expanded into dense grids on demand
+        self._renderer = renderer
+        self._page_renderer = PageRenderer()
+
+        # Own random streams, so instances in DataLoader workers can be seeded independently
+        self._random = random.Random()
+        self._np_random = np.random.RandomState()
         
         with open(file_path, "r", encoding="utf-8") as file:
             self._text = file.read().split()
@@ -42,40 +58,38 @@ class DocumentImageGenerator():
         return len(self._images)
     
     def __getitem__(self, index):
-        return self._images[index], self._grids[index]
+        return self._images[index], expand_grid(self._descriptors[index])
     
-    def _generate_random_font_style(self):
-        """Generate a random font style for table cells."""
-        style = Style(name=f"Style_{random.randint(1, 1_000_000)}", family="table-cell")
-        
-        font_size = choice(["12pt", "14pt", "17pt", "21pt", "26pt"],
-                        p=[0.8, 0.05, 0.05, 0.05, 0.05])
-        bold = choice(["bold", "normal"], p=[0.05, 0.95])
-        italic = choice(["italic", "normal"], p=[0.05, 0.95])
-        
-        style.addElement(TextProperties(fontstyle=italic, fontweight=bold, fontsize=font_size))
+    def _generate_random_cell_style(self):
+        """Generate a random font size (pt), bold and italic flag for a table cell."""
+        font_size = self._np_random.choice([12, 14, 17, 21, 26], p=[0.8, 0.05, 0.05, 0.05, 0.05])
+        bold = self._np_random.choice([True, False], p=[0.05, 0.95])
+        italic = self._np_random.choice([True, False], p=[0.05, 0.95])
+        return int(font_size), bool(bold), bool(italic)
+
+    def _generate_random_font_style(self, font_size, bold, italic):
+        """Create an ODS table cell style for the given font size and styles."""
+        style = Style(name=f"Style_{self._random.randint(1, 1_000_000)}", family="table-cell")
+        style.addElement(TextProperties(fontstyle="italic" if italic else "normal",
+                                        fontweight="bold" if bold else "normal",
+                                        fontsize=f"{font_size}pt"))
         return style
 
-    def _generate_random_file_content(self):
-        """Generate an OpenDocument spreadsheet with random text formatting."""
+    def _generate_random_rows(self):
+        """Generate rows of table cells with random words, tabs, dashes, stars and font styles."""
         # Prepare data
-        random.shuffle(self._text)
-        words = self._text[random.randint(0, 101):random.randint(102, len(self._text))]
+        self._random.shuffle(self._text)
+        words = self._text[self._random.randint(0, 101):self._random.randint(102, len(self._text))]
         num_of_words = len(words)
 
-        
-        # Create a new spreadsheet document
-        doc = OpenDocumentSpreadsheet()
-        table = Table(name="Table")
-        file_content = []
-        
         # Generate table content
+        file_content = []
         i = 0
         while i < num_of_words:
-            line_length = random.randint(1, 10)
-            tab_adding = choice([True, False], p=[0.05, 0.95])
-            dash_adding = choice([True, False], p=[0.05, 0.95])
-            star_adding = choice([True, False], p=[0.05, 0.95])
+            line_length = self._random.randint(1, 10)
+            tab_adding = self._np_random.choice([True, False], p=[0.05, 0.95])
+            dash_adding = self._np_random.choice([True, False], p=[0.05, 0.95])
+            star_adding = self._np_random.choice([True, False], p=[0.05, 0.95])
             
             row_data = []
             if tab_adding:
@@ -97,15 +111,25 @@ class DocumentImageGenerator():
                     i += 1
             
             file_content.append(row_data)
+
+        # Style every cell
+        return [[Cell(cell_data, *self._generate_random_cell_style()) for cell_data in row_data]
+                for row_data in file_content]
+
+    def _generate_random_file_content(self, rows, directory):
+        """Generate an OpenDocument spreadsheet from rows of table cells in the given directory."""
+        # Create a new spreadsheet document
+        doc = OpenDocumentSpreadsheet()
+        table = Table(name="Table")
         
         # Add rows and cells to the table
-        for row_data in file_content:
+        for row_data in rows:
             row = TableRow()
             for cell_data in row_data:
-                font_style = self._generate_random_font_style()
+                font_style = self._generate_random_font_style(cell_data.font_size, cell_data.bold, cell_data.italic)
                 doc.automaticstyles.addElement(font_style)
                 cell = TableCell(stylename=font_style)
-                cell.addElement(P(text=cell_data))
+                cell.addElement(P(text=cell_data.text))
                 row.addElement(cell)
             table.addElement(row)
         
@@ -113,85 +137,135 @@ class DocumentImageGenerator():
         doc.spreadsheet.addElement(table)
         
         # Save the document
-        doc.save("document.ods")
+        doc.save(os.path.join(directory, "document.ods"))
 
-    def _convert_ods_to_pdf(self):
+    def _convert_ods_to_pdf(self, directory):
         """Convert an ODS file to PDF using LibreOffice CLI."""
         try:
+            # A separate user profile, concurrent LibreOffice instances can't share one
             subprocess.run([
                 "libreoffice", "--headless", 
-                "--convert-to", "pdf", "document.ods", 
-                "--outdir", "."
+                f"-env:UserInstallation=file://{os.path.abspath(os.path.join(directory, 'profile'))}",
+                "--convert-to", "pdf", os.path.join(directory, "document.ods"), 
+                "--outdir", directory
             ], check=True)
-            os.remove("document.ods")
         except subprocess.CalledProcessError as e:
             print(f"Error during conversion: {e}")
 
-    def _convert_pdf_to_jpeg(self):
-        """Convert all pages of a PDF file to JPEG using pdf2image."""
+    def _convert_pdf_to_jpeg(self, directory):
+        """Convert all pages of a PDF file to JPEG using pdf2image and return them."""
+        pages = []
         try:
-            images = convert_from_path("document.pdf")
+            images = convert_from_path(os.path.join(directory, "document.pdf"))
             for i, image in enumerate(images):
-                image.save(f"document_page_{i + 1}.jpg", "JPEG")
-                self._images.append(cv2.imread(f"document_page_{i + 1}.jpg"))
-                os.remove(f"document_page_{i + 1}.jpg")
-            os.remove("document.pdf")
+                page_path = os.path.join(directory, f"document_page_{i + 1}.jpg")
+                image.save(page_path, "JPEG")
+                pages.append(cv2.imread(page_path))
         except Exception as e:
             print(f"Error during conversion: {e}")
+        return pages
+
+    def _render_pages(self, image_scale, rows=None):
+        """
+        Renders a new random document into flat pages at image_scale.
+
+        Params:
+            image_scale (float): Scale factor of the pages relative to 200 dpi.
+            rows (list[list[Cell]]): Rows to render instead of a new random document.
+
+        Returns:
+            list[np.ndarray]: Grayscale uint8 pages, without padding.
+        """
+        if rows is None:
+            rows = self._generate_random_rows()
+
+        if self._renderer == "libreoffice":
+            # Intermediate files go to a private directory, so generators can run concurrently
+            with tempfile.TemporaryDirectory(prefix="document_generator_") as directory:
+                self._generate_random_file_content(rows, directory)
+                self._convert_ods_to_pdf(directory)
+                pages = self._convert_pdf_to_jpeg(directory)
+            return [cv2.cvtColor(cv2.resize(page, dsize=None, fx=image_scale, fy=image_scale, interpolation=cv2.INTER_LINEAR),
+                                 cv2.COLOR_BGR2GRAY)
+                    for page in pages]
+
+        # Pages are rendered directly at the target scale
+        return self._page_renderer.render(rows, image_scale)
 
     def _add_padding(self, image, padding):
         """Adds padding to an image to prevent cropping after warping."""
-        h, w, c = image.shape
+        h, w = image.shape[:2]
         new_h, new_w = h + 2 * padding, w + 2 * padding
-        padded_image = np.zeros((new_h, new_w, c), dtype=np.uint8)
+        padded_image = np.zeros((new_h, new_w) + image.shape[2:], dtype=np.uint8)
         padded_image[padding:padding+h, padding:padding+w] = image
         return padded_image
     
-    def _get_rotation_matrix(self, angle_x, angle_y, angle_z):
-        """Compute 3D rotation matrix from given angles in degrees."""
-        ax, ay, az = map(math.radians, [angle_x, angle_y, angle_z])
-        
-        rot_x = np.array([[1, 0, 0], [0, math.cos(ax), -math.sin(ax)], [0, math.sin(ax), math.cos(ax)]], dtype=np.float32)
-        rot_y = np.array([[math.cos(ay), 0, math.sin(ay)], [0, 1, 0], [-math.sin(ay), 0, math.cos(ay)]], dtype=np.float32)
-        rot_z = np.array([[math.cos(az), -math.sin(az), 0], [math.sin(az), math.cos(az), 0], [0, 0, 1]], dtype=np.float32)
-        
-        rot_matrix = np.eye(4, dtype=np.float32)
-        rot_matrix[:3, :3] = rot_z @ rot_y @ rot_x  # Combine rotations
-        return rot_matrix
-    
-    def _generate_mesh_grid(self, width, height):
-        """Generate a mesh grid for remapping transformation."""
-        x_map, y_map = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
-        mesh_3d = np.stack([x_map, y_map, np.zeros_like(x_map), np.ones_like(x_map)], axis=-1)  # (H, W, 4)
-        return mesh_3d
-    
-    def _apply_transformations(self, mesh, rotation_matrix, amplitude, frequency):
-        """Apply both wavy distortion and 3D rotation to the transformation mesh."""
-        h, w, _ = mesh.shape
-        flat_mesh = mesh.reshape(-1, 4).T  # Shape: (4, H*W)
+    def _generate_random_deformation(self, width):
+        """Draw the parameters of a random wave and 3D rotation for a padded page of the given width."""
+        amplitude = self._random.randint(0, 100)  # Pixel displacement
+        frequency = self._random.uniform(0.5, 3.0) * np.pi / width # Frequency relative to width
+        angle_x, angle_y, angle_z = self._random.randint(-10, 10), self._random.randint(-10, 10), self._random.randint(-5, 5)
 
-        low_val = random.uniform(-1.0, 1.0)
-        high_low = random.uniform(low_val, 1.0)
+        # Wave amplitude ramps from low to high over the page
+        low_val = self._random.uniform(-1.0, 1.0)
+        high_val = self._random.uniform(low_val, 1.0)
+        phase = self._random.randint(0, 1000)
 
-        # Generate a vector with values ranging from -1 to 1
-        vector = np.linspace(low_val, high_low, flat_mesh.shape[1])
-        
-        # Apply wavy transformation
-        flat_mesh[1] += amplitude * np.sin(frequency * flat_mesh[0] + random.randint(0, 1000)) * vector
-        
-        # Apply 3D rotation
-        transformed_mesh = rotation_matrix @ flat_mesh
-        x_new, y_new = transformed_mesh[0], transformed_mesh[1]  # Ignore Z-axis
-        
-        return x_new.reshape(h, w).astype(np.float32), y_new.reshape(h, w).astype(np.float32)
+        return DeformationParams(amplitude, frequency, phase, low_val, high_val, angle_x, angle_y, angle_z)
+
+    def _deform_page_variants(self, page, image_scale, count):
+        """
+        Pads a flat page and warps it with `count` random waves and 3D rotations in one batch.
+
+        Params:
+            page (np.ndarray): Grayscale uint8 page at image_scale.
+            image_scale (float): Scale factor of the page, the padding is scaled with it.
+            count (int): Number of deformed variants.
+
+        Returns:
+            tuple: List of warped float32 images in [0, 1] and list of their GridDescriptors.
+        """
+        # Add padding to prevent cropping
+        padding = round(self._random.randint(400, 550) * image_scale)
+        scaled_image = self._add_padding(page, padding)
+        height, width = scaled_image.shape[:2]
+
+        # Deformation grids and warped pages, written into one buffer each for all variants
+        params = [self._generate_random_deformation(width) for _ in range(count)]
+        x_maps, y_maps = deformation_maps(params, height, width)
+        warped_images = remap_batch(scaled_image, x_maps, y_maps)
+        images = np.multiply(warped_images, np.float32(1 / 255.0), dtype=np.float32)
+
+        # The dense maps are dropped, the descriptors reproduce them
+        descriptors = [GridDescriptor(*p, height=height, width=width, padding=padding, image_scale=float(image_scale))
+                       for p in params]
+        return list(images), descriptors
+
+    def _deform_page(self, page, image_scale):
+        """
+        Pads a flat page and warps it with a random wave and 3D rotation.
+
+        Params:
+            page (np.ndarray): Grayscale uint8 page at image_scale.
+            image_scale (float): Scale factor of the page, the padding is scaled with it.
+
+        Returns:
+            tuple: Warped float32 image in [0, 1] and its GridDescriptor.
+        """
+        images, descriptors = self._deform_page_variants(page, image_scale, 1)
+        return images[0], descriptors[0]
 
     def get_images(self):
         """Returns images generated by the data generator."""
         return self._images
     
     def get_grids(self):
-        """Returns deformation grids generated by the data generator."""
-        return self._grids
+        """Returns deformation grids generated by the data generator, as (x_map, y_map) float32 arrays."""
+        return [expand_grid(descriptor) for descriptor in self._descriptors]
+
+    def get_descriptors(self):
+        """Returns the GridDescriptors of the generated images, see deformation.expand_grid()."""
+        return self._descriptors
     
     def delete_images(self):
         """Deletes all images generated by the data generator."""
@@ -199,7 +273,7 @@ class DocumentImageGenerator():
 
     def delete_grids(self):
         """Deletes all deformation grids generated by the data generator."""
-        self._grids = []
+        self._descriptors = []
 
     def set_seed(self, seed: int):
         """
@@ -208,8 +282,8 @@ class DocumentImageGenerator():
         Params:
             seed (int): Seed for the random number generators.
         """
-        random.seed(seed)
-        np.random.seed(seed)
+        self._random.seed(seed)
+        self._np_random.seed(seed)
 
     def set_text_from_file_path(self, file_path: str):
         """
@@ -228,48 +302,10 @@ class DocumentImageGenerator():
         Params:
             image_scale (float): Scale factor for resizing images.
         """
-        self._generate_random_file_content()
-        self._convert_ods_to_pdf()
-        self._convert_pdf_to_jpeg()
-
-        for i in range(len(self._images)):
-
-            # Add padding to prevent cropping
-            padding = random.randint(400, 550)
-            scaled_image = self._add_padding(self._images[i], padding)
-
-            # Resize image
-            scaled_image = cv2.resize(scaled_image, dsize=None, fx=image_scale, fy=image_scale, interpolation=cv2.INTER_LINEAR)
-
-            # Get new dimensions
-            height, width = scaled_image.shape[:2]
-
-            # Generate mesh grid
-            mesh_3d = self._generate_mesh_grid(width, height)
-
-            # Define transformations
-            amplitude = random.randint(0, 100)  # Pixel displacement
-            frequency = random.uniform(0.5, 3.0) * np.pi / width # Frequency relative to width
-            rotation_matrix = self._get_rotation_matrix(random.randint(-10, 10),
-                                                random.randint(-10, 10),
-                                                random.randint(-5, 5))
-            
-            # Apply combined transformations
-            x_map_final, y_map_final = self._apply_transformations(mesh_3d, rotation_matrix, amplitude, frequency)
-            
-            # Ensure correct data type for remap
-            x_map_final = x_map_final.astype(np.float32)
-            y_map_final = y_map_final.astype(np.float32)
-
-            # Remap image using the transformed mesh
-            self._images[i] = cv2.cvtColor(cv2.remap(scaled_image, 
-                                                    x_map_final, 
-                                                    y_map_final, 
-                                                    interpolation=cv2.INTER_LINEAR, 
-                                                    borderMode=cv2.BORDER_CONSTANT),
-                                            cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
-    
-            self._grids.append((x_map_final, y_map_final))
+        for page in self._render_pages(image_scale):
+            image, descriptor = self._deform_page(page, image_scale)
+            self._images.append(image)
+            self._descriptors.append(descriptor)
 
     def regenerate_data(self, image_scale: float = 0.45):
         """Regenerates images and deformation grids using the data generator."""
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: deformation.py
+Date: 2026-10-19
+Description: Batched synthesis of the generator's page deformations (sine wave with a linear amplitude ramp
+             followed by a 3D rotation). K deformation grids of one page size are computed in closed form into
+             preallocated float32 buffers, and the page is warped with them in parallel threads. A sample's
+             deformation is described by a GridDescriptor, which expand_grid() turns into the dense grid at any
+             resolution, in NumPy or torch.
+"""
+
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Parameters of one deformation:
+#   amplitude (px), frequency (rad/px) and phase (rad) of the sine wave along x,
+#   low and high: the wave is scaled by a ramp from low (first pixel) to high (last pixel) in row-major order,
+#   angle_x, angle_y, angle_z: rotation angles in degrees
+DeformationParams = namedtuple("DeformationParams",
+                               ["amplitude", "frequency", "phase", "low", "high", "angle_x", "angle_y", "angle_z"])
+
+# Compact description of a sample's deformation grid: the deformation, the size of the padded page it was
+# computed for, the padding in pixels and the generator image scale (a few dozen bytes instead of two float32
+# maps). A flat tuple of numbers, so it crosses process boundaries and JSON unchanged.
+GridDescriptor = namedtuple("GridDescriptor", DeformationParams._fields + ("height", "width", "padding", "image_scale"))
+
+
+def rotation_matrix(angle_x, angle_y, angle_z) -> np.ndarray:
+    """3x3 rotation rot_z @ rot_y @ rot_x for angles in degrees."""
+    ax, ay, az = map(math.radians, [angle_x, angle_y, angle_z])
+    rot_x = np.array([[1, 0, 0], [0, math.cos(ax), -math.sin(ax)], [0, math.sin(ax), math.cos(ax)]])
+    rot_y = np.array([[math.cos(ay), 0, math.sin(ay)], [0, 1, 0], [-math.sin(ay), 0, math.cos(ay)]])
+    rot_z = np.array([[math.cos(az), -math.sin(az), 0], [math.sin(az), math.cos(az), 0], [0, 0, 1]])
+    return rot_z @ rot_y @ rot_x
+
+
+def allocate_maps(count: int, height: int, width: int):
+    """Allocates x and y map buffers for `count` deformations of a height x width page."""
+    return np.empty((count, height, width), dtype=np.float32), np.empty((count, height, width), dtype=np.float32)
+
+
+def deformation_maps(params, height: int, width: int, out_x: np.ndarray = None, out_y: np.ndarray = None,
+                     xs: np.ndarray = None, ys: np.ndarray = None):
+    """
+    Computes the sampling maps of several deformations of a height x width page in one vectorized pass.
+
+    The page lies in the z=0 plane, so only the top-left 2x2 block R of the rotation matters:
+        y_def = y + A * sin(f * x + phi) * (low + (high - low) * (y * W + x) / (H * W - 1))
+        x' = R00 * x + R01 * y_def
+        y' = R10 * x + R11 * y_def
+    The ramp is separable into a per-row and a per-column term, so no (H, W, 4) mesh is built.
+
+    Params:
+        params (list[DeformationParams]): One entry per deformation (GridDescriptors work too).
+        height (int): Page height in pixels.
+        width (int): Page width in pixels.
+        out_x, out_y (np.ndarray): Optional float32 (K, len(ys), len(xs)) buffers to write into (see allocate_maps()).
+        xs, ys (np.ndarray): Coordinates to evaluate the maps at (default: every pixel, arange(width) and arange(height)).
+
+    Returns:
+        tuple: (x_maps, y_maps), float32 arrays of shape (K, H, W) for cv2.remap.
+    """
+    count = len(params)
+    x = np.arange(width, dtype=np.float32) if xs is None else np.asarray(xs, dtype=np.float32)
+    y = np.arange(height, dtype=np.float32) if ys is None else np.asarray(ys, dtype=np.float32)
+    if out_x is None or out_y is None:
+        out_x, out_y = allocate_maps(count, len(y), len(x))
+
+    last = max(height * width - 1, 1)
+
+    amplitude, frequency, phase, low, high = (np.array([getattr(p, name) for p in params], dtype=np.float32)[:, None]
+                                              for name in ("amplitude", "frequency", "phase", "low", "high"))
+    rotations = np.array([rotation_matrix(p.angle_x, p.angle_y, p.angle_z)[:2, :2] for p in params], dtype=np.float32)
+    r00, r01, r10, r11 = (rotations[:, i, j, None, None] for i, j in ((0, 0), (0, 1), (1, 0), (1, 1)))
+
+    # Per-column wave (K, W) and the ramp split into per-row (K, H) and per-column (K, W) terms
+    wave = amplitude * np.sin(frequency * x + phase)
+    ramp_rows = low + (high - low) * (y * width / last)
+    ramp_columns = (high - low) * (x / last)
+
+    # y_def, built in place in out_y
+    np.add(ramp_rows[:, :, None], ramp_columns[:, None, :], out=out_y)
+    np.multiply(out_y, wave[:, None, :], out=out_y)
+    np.add(out_y, y[None, :, None], out=out_y)
+
+    # Rotation: out_x needs y_def before out_y is overwritten
+    np.multiply(out_y, r01, out=out_x)
+    np.add(out_x, r00 * x, out=out_x)
+    np.multiply(out_y, r11, out=out_y)
+    np.add(out_y, r10 * x, out=out_y)
+
+    return out_x, out_y
+
+
+def remap_batch(image: np.ndarray, x_maps: np.ndarray, y_maps: np.ndarray, out: np.ndarray = None, workers: int = None) -> np.ndarray:
+    """
+    Warps one image with every pair of maps, in parallel threads (cv2.remap releases the GIL).
+
+    Params:
+        image (np.ndarray): Source image (uint8, black outside the page).
+        x_maps, y_maps (np.ndarray): Float32 (K, H, W) maps from deformation_maps().
+        out (np.ndarray): Optional (K, H, W) buffer of the image's dtype to write into.
+        workers (int): Number of threads (default: number of CPUs, at most K).
+
+    Returns:
+        np.ndarray: The warped images, shape (K, H, W).
+    """
+    count = len(x_maps)
+    if out is None:
+        out = np.empty(x_maps.shape, dtype=image.dtype)
+
+    def warp(k):
+        cv2.remap(image, x_maps[k], y_maps[k], interpolation=cv2.INTER_LINEAR,
+                  dst=out[k], borderMode=cv2.BORDER_CONSTANT)
+
+    workers = min(workers or os.cpu_count() or 1, count)
+    if workers <= 1:
+        for k in range(count):
+            warp(k)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(warp, range(count)))
+    return out
+
+
+def _sample_coordinates(descriptor, height: int, width: int):
+    """
+    Coordinates in the descriptor's page of the pixel centers of a height x width grid (the cv2.resize
+    convention), and the scale factors from the page to that grid.
+    """
+    scale_x, scale_y = width / descriptor.width, height / descriptor.height
+    xs = (np.arange(width, dtype=np.float64) + 0.5) / scale_x - 0.5
+    ys = (np.arange(height, dtype=np.float64) + 0.5) / scale_y - 0.5
+    return xs, ys, scale_x, scale_y
+
+
+def _deformation_maps_torch(descriptor, xs, ys):
+    """deformation_maps() of a single deformation for torch coordinate vectors."""
+    import torch
+
+    rotation = rotation_matrix(descriptor.angle_x, descriptor.angle_y, descriptor.angle_z)
+    last = max(descriptor.height * descriptor.width - 1, 1)
+
+    wave = descriptor.amplitude * torch.sin(descriptor.frequency * xs + descriptor.phase)
+    ramp = descriptor.low + (descriptor.high - descriptor.low) * ((ys[:, None] * descriptor.width + xs[None, :]) / last)
+    y_def = ys[:, None] + wave[None, :] * ramp
+    x_map = float(rotation[0, 0]) * xs[None, :] + float(rotation[0, 1]) * y_def
+    y_map = float(rotation[1, 0]) * xs[None, :] + float(rotation[1, 1]) * y_def
+    return x_map, y_map
+
+
+def expand_grid(descriptor, height: int = None, width: int = None, backend: str = "numpy", device=None):
+    """
+    Expands a GridDescriptor into its dense deformation grid.
+
+    At the descriptor's own size this is the grid the image was warped with. At another size it is the grid
+    of the image resized to height x width with cv2.resize: the maps are evaluated at the resized pixels'
+    positions in the page and the resulting coordinates are scaled to the resized image.
+
+    Params:
+        descriptor (GridDescriptor): The sample's deformation.
+        height, width (int): Size of the grid (default: the descriptor's size).
+        backend (str): "numpy" or "torch".
+        device: Torch device of the grid (torch backend only).
+
+    Returns:
+        tuple: (x_map, y_map) float32 (height, width) NumPy arrays or torch tensors.
+    """
+    height = height or descriptor.height
+    width = width or descriptor.width
+    native = (height, width) == (descriptor.height, descriptor.width)
+
+    if backend == "numpy":
+        if native:
+            x_maps, y_maps = deformation_maps([descriptor], height, width)
+        else:
+            xs, ys, scale_x, scale_y = _sample_coordinates(descriptor, height, width)
+            x_maps, y_maps = deformation_maps([descriptor], descriptor.height, descriptor.width, xs=xs, ys=ys)
+            x_maps += 0.5
+            x_maps *= scale_x
+            x_maps -= 0.5
+            y_maps += 0.5
+            y_maps *= scale_y
+            y_maps -= 0.5
+        return x_maps[0], y_maps[0]
+
+    if backend == "torch":
+        import torch
+
+        if native:
+            xs = torch.arange(width, dtype=torch.float32, device=device)
+            ys = torch.arange(height, dtype=torch.float32, device=device)
+            return _deformation_maps_torch(descriptor, xs, ys)
+        xs, ys, scale_x, scale_y = _sample_coordinates(descriptor, height, width)
+        x_map, y_map = _deformation_maps_torch(descriptor, torch.as_tensor(xs, dtype=torch.float32, device=device),
+                                               torch.as_tensor(ys, dtype=torch.float32, device=device))
+        return (x_map + 0.5) * scale_x - 0.5, (y_map + 0.5) * scale_y - 0.5
+
+    raise ValueError(f"Unknown backend {backend!r}, expected 'numpy' or 'torch'.")
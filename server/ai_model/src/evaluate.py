@@ -1,4 +1,6 @@
 import torch
+from generator_dataset import to_target
+from offline_dataset import OfflineDataset
 
 def evaluate_model(model, generator, device, criterion, num_val_batches, image_scale: float = 0.45):
     """
@@ -6,7 +8,8 @@ def evaluate_model(model, generator, device, criterion, num_val_batches, image_s
     
     Params:
         model: The neural network model to evaluate
-        generator: DocumentImageGenerator instance for creating evaluation data
+        generator: DocumentImageGenerator instance for creating evaluation data, or an OfflineDataset
+                   (read in order, from the samples at the nearest image scale)
         device: The device to run evaluation on (CPU or GPU)
         criterion: Loss function
         num_val_batches: Number of mini batches to evaluate on
@@ -18,31 +21,39 @@ def evaluate_model(model, generator, device, criterion, num_val_batches, image_s
 
     model.eval()
     total_val_loss = 0.0
-    generator.set_seed(42)
     image_scale = 0.45
+    if isinstance(generator, OfflineDataset):
+        batches = generator.iter_batches(image_scale, shuffle=False, endless=False)
+    else:
+        generator.set_seed(42)
 
     with open("../logs/evaluate.log", "w") as file_log, torch.no_grad():
         for batch_idx in range(num_val_batches):
 
-            # Generate new batch of validation data
-            generator.regenerate_data(image_scale=image_scale)
-            
-            # Get images and grids
-            images = generator.get_images()
-            grids = generator.get_grids()
+            if isinstance(generator, OfflineDataset):
+                # Read the next batch of validation data
+                images, grids = next(batches, (None, None))
+                if images is None:
+                    # Fewer samples than requested batches
+                    num_val_batches = batch_idx
+                    break
+            else:
+                # Generate new batch of validation data
+                generator.regenerate_data(image_scale=image_scale)
+                
+                # Get images and grid descriptors
+                images = generator.get_images()
+                grids = generator.get_descriptors()
             
             batch_loss = 0.0
             
             # Process each image in the batch
-            for img, (x_grid, y_grid) in zip(images, grids):
+            for img, grid in zip(images, grids):
                 # Convert numpy arrays to PyTorch tensors
                 img_tensor = torch.from_numpy(img).unsqueeze(0).unsqueeze(0).float().to(device)
                 
-                x_grid_tensor = torch.from_numpy(x_grid).unsqueeze(0).unsqueeze(0).to(device)
-                y_grid_tensor = torch.from_numpy(y_grid).unsqueeze(0).unsqueeze(0).to(device)
-                
-                # Combine into single target tensor
-                target_grid = torch.cat([x_grid_tensor, y_grid_tensor], dim=1)
+                # Target grid, expanded on the device from its descriptor
+                target_grid = to_target(grid, device)
                 
                 # Forward pass
                 predicted_offsets = model(img_tensor)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: generator_dataset.py
+Date: 2026-10-19
+Description: torch IterableDataset over a data generator, so mini batches can be generated in DataLoader
+             worker processes while the model trains.
+"""
+
+import multiprocessing
+
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from deformation import GridDescriptor, expand_grid
+from offline_dataset import OfflineDataset, ScaleBatchSampler, collate_batch
+
+
+class GeneratorDataset(IterableDataset):
+    def __init__(self, generator, image_scale, seed: int = None):
+        """
+        Endless stream of generator mini batches, each a tuple of a list of images and a list of
+        GridDescriptors (get_images() and get_descriptors() after regenerate_data()); the dense grids
+        are expanded by the consumer, see to_target().
+
+        Params:
+            generator: DocumentImageGenerator (or CachedPageGenerator) instance; every worker gets its own copy
+            image_scale: Generator image scale, a float or a multiprocessing.Value("d") shared with the
+                         workers so the training loop can change it while they run
+            seed: Base seed of the workers, worker i uses seed + i. None uses the seeds DataLoader
+                  gives its workers. Without workers the generator's own state is used.
+        """
+        super().__init__()
+        self._generator = generator
+        self._image_scale = image_scale
+        self._seed = seed
+
+    def _current_image_scale(self):
+        return self._image_scale.value if hasattr(self._image_scale, "value") else self._image_scale
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            # Workers start from copies of the same generator state, their streams must differ
+            seed = worker_info.seed if self._seed is None else self._seed + worker_info.id
+            self._generator.set_seed(seed % 2**32)
+
+        while True:
+            self._generator.regenerate_data(image_scale=self._current_image_scale())
+            yield list(self._generator.get_images()), list(self._generator.get_descriptors())
+
+
+def generator_batches(generator, image_scale, num_workers: int = 0, prefetch_factor: int = 2, seed: int = None):
+    """
+    Returns an endless iterator of mini batches (lists of images and of GridDescriptors or (x_map, y_map)
+    grids, both accepted by to_target()). With workers the
+    batches are generated (or read) in parallel processes and prefetched while the caller trains; generated
+    images and grids then arrive as tensors instead of NumPy arrays.
+
+    Params:
+        generator: DocumentImageGenerator instance, or an OfflineDataset whose samples are shuffled across shards
+        image_scale: Image scale, a float or a multiprocessing.Value("d") (see shared_image_scale())
+        num_workers: Number of worker processes, 0 generates in the calling process
+        prefetch_factor: Mini batches prepared in advance by each worker
+        seed: Base seed of the workers (see GeneratorDataset)
+
+    Returns:
+        Iterator of (images, grids)
+    """
+    if isinstance(generator, OfflineDataset):
+        if num_workers == 0:
+            return generator.iter_batches(image_scale, seed=seed)
+        loader = DataLoader(generator, batch_sampler=ScaleBatchSampler(generator, image_scale, seed=seed),
+                            collate_fn=collate_batch, num_workers=num_workers,
+                            prefetch_factor=prefetch_factor, persistent_workers=True)
+        return iter(loader)
+
+    dataset = GeneratorDataset(generator, image_scale, seed)
+    if num_workers == 0:
+        return iter(dataset)
+    # Mini batches differ in size, so DataLoader passes them through unbatched
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers,
+                        prefetch_factor=prefetch_factor, persistent_workers=True)
+    return iter(loader)
+
+
+def shared_image_scale(image_scale: float):
+    """Image scale that can be changed while DataLoader workers use it."""
+    return multiprocessing.Value("d", image_scale)
+
+
+def to_tensor(array, device) -> torch.Tensor:
+    """Converts an image or grid from a mini batch (NumPy array or tensor) to a 1x1xHxW float tensor."""
+    return torch.as_tensor(array).unsqueeze(0).unsqueeze(0).float().to(device)
+
+
+def to_target(grid, device) -> torch.Tensor:
+    """
+    Converts a mini batch grid to the 1x2xHxW target tensor: a GridDescriptor is expanded directly
+    on the device, an (x_map, y_map) pair is copied there.
+    """
+    if isinstance(grid, GridDescriptor):
+        x_map, y_map = expand_grid(grid, backend="torch", device=device)
+        return torch.stack([x_map, y_map]).unsqueeze(0)
+    x_grid, y_grid = grid
+    return torch.cat([to_tensor(x_grid, device), to_tensor(y_grid, device)], dim=1)
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: model_artifact.py
+Date: 2026-10-19
+Description: Self-describing model artifacts: tensors in the safetensors layout (no pickle) with a metadata
+             header naming the architecture and its configuration, loaded by memory-mapping the file.
+
+The file starts with the length of a JSON header (8 bytes, little endian), followed by the header and the raw
+tensor data. The header lists every tensor (dtype, shape and byte range in the data section) and holds the
+metadata under "__metadata__". Tensors are stored largest item size first and the data section starts at a
+64-byte boundary, so every tensor can be viewed in place from a memory map. The layout can be read by the
+safetensors library, but the library is not needed here.
+"""
+
+import argparse
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+ARTIFACT_EXTENSION = ".safetensors"
+FORMAT_NAME = "bookscanner-model"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+    "I64": np.int64,
+    "I32": np.int32,
+    "I16": np.int16,
+    "I8": np.int8,
+    "U8": np.uint8,
+    "BOOL": np.bool_,
+}
+_DTYPE_NAMES = {np.dtype(dtype): name for name, dtype in _DTYPES.items()}
+
+
+def _architectures():
+    # torch is only imported when a model is built, reading headers stays light
+    from unet_flexible import UNetFlexible
+    from unet_light import UNetLight
+    return {"UNetFlexible": UNetFlexible, "UNetLight": UNetLight}
+
+
+def is_artifact(path: str) -> bool:
+    """Checks by extension whether a model file is an artifact (otherwise a legacy .pth state_dict)."""
+    return str(path).endswith(ARTIFACT_EXTENSION)
+
+
+def read_header(path: str):
+    """
+    Reads the header of an artifact without touching the tensor data.
+
+    Params:
+        path: Path to the artifact
+
+    Returns:
+        The metadata (with config parsed and input_scale as float), the tensor table and the offset of the data section.
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+
+    raw = header.pop("__metadata__", {})
+    if raw.get("format") != FORMAT_NAME:
+        raise ValueError(f"{path} is not a {FORMAT_NAME} artifact.")
+    if int(raw["format_version"]) > FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {raw['format_version']}, newer than supported ({FORMAT_VERSION}).")
+
+    metadata = dict(raw)
+    metadata["config"] = json.loads(raw.get("config", "{}"))
+    metadata["input_scale"] = float(raw["input_scale"]) if raw.get("input_scale") else None
+    return metadata, header, 8 + header_size
+
+
+def save_artifact(model, path: str, input_scale: float = None, data_version: str = "", architecture: str = None, config: dict = None):
+    """
+    Writes a model to an artifact.
+
+    Params:
+        model: The model to save
+        path: Path of the artifact (should end with .safetensors)
+        input_scale: Generator image scale the model was trained at
+        data_version: Identifier of the training data, e.g. a generator revision or an offline dataset
+        architecture: Name of the model class, defaults to the class of the model
+        config: Constructor arguments of the model class, defaults to model.config
+
+    Returns:
+        The metadata written to the header
+    """
+    architecture = architecture or type(model).__name__
+    if architecture not in _architectures():
+        raise ValueError(f"Unknown architecture {architecture!r}, expected one of {', '.join(_architectures())}.")
+    config = config if config is not None else getattr(model, "config", {})
+
+    arrays = {}
+    for name, tensor in model.state_dict().items():
+        array = tensor.detach().cpu().contiguous().numpy()
+        if array.dtype not in _DTYPE_NAMES:
+            raise ValueError(f"Tensor {name} has unsupported dtype {array.dtype}.")
+        arrays[name] = array
+
+    # Largest item size first keeps every tensor aligned to its dtype
+    names = sorted(arrays, key=lambda name: (-arrays[name].dtype.itemsize, name))
+
+    tensors, offset = {}, 0
+    digest = hashlib.sha256()
+    for name in names:
+        array = arrays[name]
+        tensors[name] = {
+            "dtype": _DTYPE_NAMES[array.dtype],
+            "shape": list(array.shape),
+            "data_offsets": [offset, offset + array.nbytes],
+        }
+        digest.update(array.tobytes())
+        offset += array.nbytes
+
+    metadata = {
+        "format": FORMAT_NAME,
+        "format_version": str(FORMAT_VERSION),
+        "architecture": architecture,
+        "config": json.dumps(config, sort_keys=True),
+        "input_scale": "" if input_scale is None else repr(float(input_scale)),
+        "data_version": data_version,
+        "checksum": digest.hexdigest(),
+    }
+    header = json.dumps({"__metadata__": metadata, **tensors}, separators=(",", ":")).encode("utf-8")
+    # Pad the header with spaces so the data section starts at an aligned offset
+    header += b" " * (-(8 + len(header)) % ALIGNMENT)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name in names:
+            f.write(arrays[name].tobytes())
+
+    return metadata
+
+
+def verify_artifact(path: str) -> bool:
+    """Recomputes the checksum of the tensor data (reads the whole file)."""
+    metadata, tensors, data_start = read_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    digest = hashlib.sha256()
+    for name, info in sorted(tensors.items(), key=lambda item: item[1]["data_offsets"][0]):
+        start, end = info["data_offsets"]
+        digest.update(data[data_start + start:data_start + end])
+    return digest.hexdigest() == metadata["checksum"]
+
+
+def load_artifact(path: str, device="cpu", verify: bool = False):
+    """
+    Loads a model from an artifact. The file is memory-mapped and the parameters are views of the
+    mapping, so only the pages that are used are read (on CPU) and the weights are never copied or
+    initialized randomly first.
+
+    Params:
+        path: Path to the artifact
+        device: Device to move the model to
+        verify: Check the data checksum first (reads the whole file)
+
+    Returns:
+        The model in eval mode and the metadata of the artifact
+    """
+    import torch
+
+    metadata, tensors, data_start = read_header(path)
+    if verify and not verify_artifact(path):
+        raise ValueError(f"Checksum mismatch in {path}.")
+
+    architectures = _architectures()
+    if metadata["architecture"] not in architectures:
+        raise ValueError(f"Unknown architecture {metadata['architecture']!r} in {path}.")
+
+    # Copy-on-write mapping: tensors are writable for torch but the file is never modified
+    data = np.memmap(path, dtype=np.uint8, mode="c")
+    state_dict = {}
+    for name, info in tensors.items():
+        start, end = info["data_offsets"]
+        array = data[data_start + start:data_start + end].view(_DTYPES[info["dtype"]]).reshape(info["shape"])
+        state_dict[name] = torch.from_numpy(array)
+
+    with torch.device("meta"):
+        model = architectures[metadata["architecture"]](**metadata["config"])
+    model.load_state_dict(state_dict, assign=True)
+    model.to(device)
+    model.eval()
+    return model, metadata
+
+
+def load_model(path: str, device="cpu", base_model_class=None):
+    """
+    Loads a model from an artifact or from a legacy .pth file holding a state_dict (or a training
+    checkpoint). .pth files are loaded with weights_only=True, pickled modules are not accepted.
+
+    Params:
+        path: Path to the artifact or .pth file
+        device: Device to move the model to
+        base_model_class: Class instantiated for a .pth file, UNetFlexible by default
+
+    Returns:
+        The model in eval mode and its metadata (architecture and config only for .pth files)
+    """
+    if is_artifact(path):
+        return load_artifact(path, device)
+
+    import pickle
+    import torch
+
+    try:
+        state_dict = torch.load(path, map_location=device, weights_only=True)
+    except pickle.UnpicklingError as e:
+        raise TypeError(
+            f"{path} does not contain a plain state_dict. Pickled models are not loaded; "
+            f"save model.state_dict() or export an artifact instead."
+        ) from e
+    if not isinstance(state_dict, dict):
+        raise TypeError(f"Unknown object type in .pth file: {type(state_dict)}")
+    if "model_state_dict" in state_dict:
+        state_dict = state_dict["model_state_dict"]
+
+    model_class = base_model_class or _architectures()["UNetFlexible"]
+    model = model_class()
+    model.load_state_dict(state_dict)
+    model.to(device)
+    model.eval()
+    return model, {
+        "architecture": type(model).__name__,
+        "config": getattr(model, "config", {}),
+        "input_scale": None,
+        "data_version": "",
+        "checksum": "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a .pth state_dict into a model artifact, or inspect an artifact.")
+    parser.add_argument("source", help="A .pth state_dict or training checkpoint, or an artifact to inspect.")
+    parser.add_argument("output", nargs="?", help="Path of the artifact to write.")
+    parser.add_argument("--architecture", default="UNetFlexible")
+    parser.add_argument("--base-channels", type=int, default=64)
+    parser.add_argument("--input-scale", type=float, default=0.45, help="Generator image scale the model was trained at.")
+    parser.add_argument("--data-version", default="", help="Identifier of the training data.")
+    parser.add_argument("--verify", action="store_true", help="Check the data checksum of an artifact.")
+    args = parser.parse_args()
+
+    if args.output is None:
+        metadata, tensors, _ = read_header(args.source)
+        print(json.dumps({**metadata, "tensors": len(tensors)}, indent=2))
+        if args.verify:
+            print("checksum ok" if verify_artifact(args.source) else "checksum MISMATCH")
+        return
+
+    model_class = _architectures()[args.architecture]
+    model, _ = load_model(args.source, "cpu", lambda: model_class(base_channels=args.base_channels))
+    metadata = save_artifact(model, args.output, args.input_scale, args.data_version, architecture=args.architecture)
+    print(f"Artifact saved to {args.output} (checksum {metadata['checksum'][:16]})")
+
+
+if __name__ == "__main__":
+    main()
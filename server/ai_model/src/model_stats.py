@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: model_stats.py
+Date: 2026-10-19
+Description: Size, FLOP, latency and accuracy measurements of dewarp models, used to compare
+             architecture variants and pruned models.
+"""
+
+import argparse
+import math
+import time
+
+import torch
+import torch.nn as nn
+
+from evaluate import evaluate_model
+
+
+def count_parameters(model: nn.Module) -> int:
+    """Returns the number of parameters of a model."""
+    return sum(parameter.numel() for parameter in model.parameters())
+
+
+def count_flops(model: nn.Module, height: int, width: int) -> int:
+    """
+    Counts the floating-point operations of the convolutions (2 per multiply-accumulate) in one
+    forward pass on a single-channel image. Other layers are cheap in comparison and not counted.
+
+    Params:
+        model: The model
+        height: Input height in pixels
+        width: Input width in pixels
+
+    Returns:
+        Number of operations
+    """
+    flops = 0
+
+    def hook(module, inputs, output):
+        nonlocal flops
+        kernel_ops = (module.in_channels // module.groups) * module.kernel_size[0] * module.kernel_size[1]
+        flops += 2 * kernel_ops * output.numel()
+
+    handles = [module.register_forward_hook(hook) for module in model.modules() if isinstance(module, nn.Conv2d)]
+    try:
+        device = next(model.parameters()).device
+        model.eval()
+        with torch.no_grad():
+            model(torch.zeros(1, 1, height, width, device=device))
+    finally:
+        for handle in handles:
+            handle.remove()
+    return flops
+
+
+def measure_latency(model: nn.Module, height: int, width: int, device="cpu", repeats: int = 5) -> float:
+    """
+    Measures the median time of one forward pass on a single-channel image (after one warm-up pass).
+
+    Params:
+        model: The model
+        height: Input height in pixels
+        width: Input width in pixels
+        device: Device the model is on
+        repeats: Number of timed forward passes
+
+    Returns:
+        Seconds per forward pass
+    """
+    model.eval()
+    x = torch.rand(1, 1, height, width, device=device)
+    synchronize = torch.cuda.synchronize if str(device).startswith("cuda") else (lambda: None)
+    seconds = []
+    with torch.no_grad():
+        model(x)
+        for _ in range(repeats):
+            synchronize()
+            start = time.perf_counter()
+            model(x)
+            synchronize()
+            seconds.append(time.perf_counter() - start)
+    return sorted(seconds)[len(seconds) // 2]
+
+
+def variant_table(models: dict, generator, device, num_val_batches: int, height: int = 1024, width: int = 768, repeats: int = 5):
+    """
+    Builds the latency/accuracy table of several models for choosing a speed tier.
+
+    Params:
+        models: Dict of name -> model
+        generator: DocumentImageGenerator instance for the validation data
+        device: Device the models are on
+        num_val_batches: Number of validation mini batches
+        height: Input height for FLOPs and latency
+        width: Input width for FLOPs and latency
+        repeats: Timed forward passes per model
+
+    Returns:
+        List of dicts with name, parameters, GFLOPs, latency in ms, validation loss and RMS grid error in pixels
+    """
+    criterion = nn.MSELoss()
+    rows = []
+    for name, model in models.items():
+        val_loss = evaluate_model(model, generator, device, criterion, num_val_batches)
+        rows.append({
+            "name": name,
+            "parameters": count_parameters(model),
+            "gflops": count_flops(model, height, width) / 1e9,
+            "latency_ms": measure_latency(model, height, width, device, repeats) * 1000,
+            "val_loss": val_loss,
+            # The MSE averages both coordinates, the grid error is the RMS distance
+            "grid_error_px": math.sqrt(2 * val_loss),
+        })
+    return rows
+
+
+def format_table(rows) -> str:
+    """Formats the rows of variant_table() as a text table."""
+    lines = [f"{'model':<16} {'params':>10} {'GFLOPs':>8} {'latency':>10} {'val loss':>10} {'error':>8}"]
+    for row in rows:
+        lines.append(
+            f"{row['name']:<16} {row['parameters']:>10,} {row['gflops']:>8.2f} {row['latency_ms']:>8.1f}ms "
+            f"{row['val_loss']:>10.4f} {row['grid_error_px']:>6.2f}px"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    from data_generator import DocumentImageGenerator
+    from model_artifact import load_model
+
+    parser = argparse.ArgumentParser(description="Latency/accuracy table of dewarp models.")
+    parser.add_argument("models", nargs="+", help="Models as NAME=PATH (.safetensors artifact or .pth state_dict).")
+    parser.add_argument("--text", default="assets/text.txt", help="Word list for the generator.")
+    parser.add_argument("--batches", type=int, default=10, help="Number of validation mini batches.")
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--device", default="cpu", help="Serving is on CPU, so latency is measured there by default.")
+    parser.add_argument("--optimized", action="store_true", help="Measure the inference-optimized models (DEWARP_OPTIMIZE_MODEL).")
+    args = parser.parse_args()
+
+    models = {}
+    for entry in args.models:
+        name, _, path = entry.partition("=")
+        models[name], _ = load_model(path or name, args.device)
+        if args.optimized:
+            from unet_inference import optimize_for_inference
+            models[name] = optimize_for_inference(models[name])
+
+    generator = DocumentImageGenerator(args.text)
+    print(format_table(variant_table(models, generator, args.device, args.batches, args.height, args.width)))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,8 @@ Description: Class for handling the neural network model training and evaluation
 from data_generator import DocumentImageGenerator
 from train import train_model
 from evaluate import evaluate_model
+from model_artifact import load_model, save_artifact
+from offline_dataset import OfflineDataset
 import torch
 from functools import wraps
 
@@ -33,7 +35,11 @@ class NeuralNetHandler:
                  learning_rate: float=0.001,
                  num_batches: int=300, 
                  name: str="model",
-                 base_model_class=None):
+                 base_model_class=None,
+                 teacher=None,
+                 distillation_weight: float=0.5,
+                 num_workers: int=0,
+                 val_generator=None):
         """
         Initialize the NeuralNetHandler class.
         
@@ -45,7 +51,11 @@ class NeuralNetHandler:
             learning_rate: Learning rate for optimizer
             num_batches: Number of mini batches to train on
             name: Name of the model
-            base_model_class: Required if `model` is a path; class used to instantiate model before loading weights
+            base_model_class: Class used to instantiate a model loaded from a .pth file (UNetFlexible by default)
+            teacher: Optional trained model (or path) to distill from, e.g. the production UNetFlexible
+            distillation_weight: Weight of the teacher's prediction in the training loss
+            num_workers: DataLoader worker processes generating training data in parallel with training
+            val_generator: Validation data (DocumentImageGenerator or OfflineDataset), by default the training generator
         """
         self._device = torch.device(device)
         print(f"Using device: {self._device}")
@@ -54,14 +64,22 @@ class NeuralNetHandler:
         self._learning_rate = learning_rate
         self._num_batches = num_batches
         self._name = name
+        self._num_workers = num_workers
 
         self._generator = None
         self.set_generator(generator)
 
+        self._val_generator = None
+        self.set_val_generator(val_generator)
+
         self._optimizer = None
         self._model = None
         self.set_model(model, name, base_model_class)
 
+        self._teacher = None
+        self._distillation_weight = distillation_weight
+        self.set_teacher(teacher)
+
         self._criterion = torch.nn.MSELoss()
         self._train_losses = []
         self._val_losses = []
@@ -72,9 +90,9 @@ class NeuralNetHandler:
         Set the model to use for training and evaluation.
 
         Params:
-            model: Either a model instance (nn.Module) or path to a .pth file
+            model: Either a model instance (nn.Module), a path to a model artifact (.safetensors) or to a .pth file with a state_dict
             name: Name of the model
-            base_model_class: Required if `model` is a path and contains a state_dict
+            base_model_class: Class instantiated for a .pth file (UNetFlexible by default)
         """
         if model is None:
             print("Model is None. Please provide a valid model using set_model() method.")
@@ -85,42 +103,65 @@ class NeuralNetHandler:
             self._model = model.to(self._device)
 
         elif isinstance(model, str):
-            # Model path
-            loaded_obj = torch.load(model, map_location=self._device, weights_only=False)
-
-            if isinstance(loaded_obj, torch.nn.Module):
-                # Loaded full model
-                self._model = loaded_obj.to(self._device)
-
-            elif isinstance(loaded_obj, dict):
-                if base_model_class is None:
-                    raise ValueError("Must provide base_model_class when loading state_dict.")
-                instance = base_model_class()
-                instance.load_state_dict(loaded_obj)
-                self._model = instance.to(self._device)
-
-            else:
-                raise TypeError(f"Unknown object type in .pth file: {type(loaded_obj)}")
+            # Model artifact (architecture from its header) or .pth state_dict, never unpickled modules
+            loaded_model, _ = load_model(model, self._device, base_model_class)
+            self._model = loaded_model
 
         else:
-            raise ValueError("Invalid model input. Provide either an nn.Module or a path to a .pth file.")
+            raise ValueError("Invalid model input. Provide either an nn.Module or a path to a .safetensors or .pth file.")
 
         self._optimizer = torch.optim.Adam(self._model.parameters(), lr=self._learning_rate)
         self._name = name
 
 
+    def set_teacher(self, teacher, distillation_weight: float=None):
+        """
+        Set the model to distill from during training. None trains on the ground truth only.
+
+        Params:
+            teacher: Either a model instance (nn.Module) or a path to a model artifact or .pth file
+            distillation_weight: Weight of the teacher's prediction in the training loss (unchanged if None)
+        """
+        if distillation_weight is not None:
+            self._distillation_weight = distillation_weight
+
+        if teacher is None:
+            self._teacher = None
+        elif isinstance(teacher, torch.nn.Module):
+            self._teacher = teacher.to(self._device).eval()
+        elif isinstance(teacher, str):
+            self._teacher, _ = load_model(teacher, self._device)
+        else:
+            raise ValueError("Invalid teacher. Provide either an nn.Module or a path to a .safetensors or .pth file.")
+
+        if self._teacher is not None:
+            for parameter in self._teacher.parameters():
+                parameter.requires_grad_(False)
+
     def set_generator(self, generator):
         """
         Set the DocumentImageGenerator instance to use for creating training data.
         
         Params:
-            generator: DocumentImageGenerator instance
+            generator: DocumentImageGenerator instance, or an OfflineDataset of pre-generated samples
         """
-        if generator.__class__.__name__ == "DocumentImageGenerator":
+        if isinstance(generator, (DocumentImageGenerator, OfflineDataset)):
             self._generator = generator
         else:
             ValueError("Invalid generator type. Please provide a valid DocumentImageGenerator instance.")
 
+    def set_val_generator(self, generator):
+        """
+        Set the data to validate on. Required when training on an OfflineDataset, so the model is not
+        validated on its own training samples; e.g. a dataset written with another seed.
+
+        Params:
+            generator: DocumentImageGenerator instance or OfflineDataset, None validates on the training generator
+        """
+        if generator is not None and not isinstance(generator, (DocumentImageGenerator, OfflineDataset)):
+            raise ValueError("Invalid validation generator type. Please provide a DocumentImageGenerator or OfflineDataset.")
+        self._val_generator = generator
+
     @require_model_and_generator
     def set_generator_seed(self, seed: int):
         """
@@ -177,7 +218,11 @@ class NeuralNetHandler:
                                 self._optimizer, 
                                 self._num_batches,
                                 self._name,
-                                resume_from_checkpoint=resume_from_checkpoint)
+                                resume_from_checkpoint=resume_from_checkpoint,
+                                teacher=self._teacher,
+                                distillation_weight=self._distillation_weight,
+                                num_workers=self._num_workers,
+                                val_generator=self._val_generator)
         
         self._model = results[0]
         self._current_val_loss = results[1]
@@ -190,7 +235,7 @@ class NeuralNetHandler:
         Evaluate the model using the validation data.
         """
         self._current_val_loss = evaluate_model(self._model, 
-                                            self._generator, 
+                                            self._val_generator or self._generator, 
                                             self._device, 
                                             self._criterion, 
                                             self._num_batches)
@@ -204,4 +249,17 @@ class NeuralNetHandler:
             path: (str) Path to save the model to
         """
         torch.save(self._model.state_dict(), path)
-        print(f"Model saved to {path}")
\ No newline at end of file
+        print(f"Model saved to {path}")
+
+    @require_model_and_generator
+    def export_model(self, path: str, input_scale: float = 0.45, data_version: str = ""):
+        """
+        Export the model as a self-describing artifact loaded by the server (see model_artifact.py).
+
+        Params:
+            path: (str) Path to save the artifact to (.safetensors)
+            input_scale: (float) Generator image scale the model was trained at
+            data_version: (str) Identifier of the training data
+        """
+        metadata = save_artifact(self._model, path, input_scale, data_version)
+        print(f"Model exported to {path} (checksum {metadata['checksum'][:16]})")
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: offline_dataset.py
+Date: 2026-10-19
+Description: Offline datasets of generated samples: a writer that runs the data generator in bulk into shard
+             files, and a memory-mapped torch Dataset reading them with random access across shards.
+
+A dataset is a directory with shard files (shard_00000.bin, ...) and index.json. A shard is the raw
+concatenation of samples, each an uint8 image (H x W) followed by its encoded x and y grids (2 x H x W), every
+array starting at a 64-byte boundary. The index lists the shard, byte offsets, shape and image scale of every
+sample, the grid encoding and how the data was generated. By default only the sample's GridDescriptor is kept,
+in the index, and the grid is recomputed from it; dense grids are stored as displacements from the identity
+mapping (the pixel's own coordinates), which are small enough for 16 bits:
+    "params": no grid data, the GridDescriptor in the index (exact, a few dozen bytes per sample)
+    "fixed16": int16 in 1/16 px (error <= 1/32 px, displacements up to 2047 px)
+    "float16": float16 (error <= 0.25 px for displacements up to 512 px)
+    "float32": absolute float32 coordinates, lossless
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+
+import numpy as np
+from torch.utils.data import Dataset, Sampler
+
+from deformation import GridDescriptor, expand_grid
+
+FORMAT_NAME = "bookscanner-dataset"
+FORMAT_VERSION = 2
+INDEX_NAME = "index.json"
+ALIGNMENT = 64
+
+# Generator runs in a row that may produce no samples before writing gives up (as in page_corpus, which is not
+# imported here to keep the reader free of the generator's dependencies)
+MAX_EMPTY_RENDERS = 5
+
+GRID_ENCODINGS = {
+    # encoding -> (stored dtype, displacement from identity, units per pixel)
+    "params": (None, False, 1),
+    "fixed16": (np.int16, True, 16),
+    "float16": (np.float16, True, 1),
+    "float32": (np.float32, False, 1),
+}
+
+
+def _identity(height: int, width: int):
+    """Coordinates of the pixels themselves, as (1, W) and (H, 1) arrays."""
+    return np.arange(width, dtype=np.float32)[None, :], np.arange(height, dtype=np.float32)[:, None]
+
+
+def encode_grid(x_map: np.ndarray, y_map: np.ndarray, encoding: str) -> np.ndarray:
+    """
+    Encodes a deformation grid for storage.
+
+    Params:
+        x_map, y_map: Float32 (H, W) sampling maps
+        encoding: One of GRID_ENCODINGS
+
+    Returns:
+        (2, H, W) array of the encoding's dtype
+    """
+    dtype, displacement, units = GRID_ENCODINGS[encoding]
+    grid = np.stack([x_map, y_map]).astype(np.float32)
+    if displacement:
+        xs, ys = _identity(*x_map.shape)
+        grid[0] -= xs
+        grid[1] -= ys
+    grid *= units
+    if np.issubdtype(dtype, np.integer):
+        limit = np.iinfo(dtype).max
+        if np.abs(grid).max() > limit:
+            raise ValueError(f"Displacement exceeds the range of the {encoding!r} grid encoding, use 'float32'.")
+        grid = np.rint(grid)
+    return grid.astype(dtype)
+
+
+def decode_grid(stored: np.ndarray, encoding: str):
+    """
+    Decodes a stored (2, H, W) grid.
+
+    Returns:
+        (x_map, y_map) float32 (H, W) arrays
+    """
+    _, displacement, units = GRID_ENCODINGS[encoding]
+    grid = stored.astype(np.float32)
+    if units != 1:
+        grid *= np.float32(1 / units)
+    if displacement:
+        xs, ys = _identity(*grid.shape[1:])
+        grid[0] += xs
+        grid[1] += ys
+    return grid[0], grid[1]
+
+
+class ShardWriter:
+    def __init__(self, directory: str, grid_encoding: str = "params", shard_bytes: int = 1 << 30):
+        """
+        Writes samples into shard files of a dataset directory.
+
+        Params:
+            directory: Dataset directory (created if missing)
+            grid_encoding: One of GRID_ENCODINGS
+            shard_bytes: A new shard is started once a shard reaches this size
+        """
+        if grid_encoding not in GRID_ENCODINGS:
+            raise ValueError(f"Unknown grid encoding {grid_encoding!r}, expected one of {', '.join(GRID_ENCODINGS)}.")
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._grid_encoding = grid_encoding
+        self._shard_bytes = shard_bytes
+        self._shard = -1
+        self._file = None
+        self._offset = 0
+        self.samples = []
+
+    def _write_array(self, array: np.ndarray) -> int:
+        padding = -self._offset % ALIGNMENT
+        self._file.write(b"\0" * padding)
+        offset = self._offset + padding
+        self._file.write(np.ascontiguousarray(array).tobytes())
+        self._offset = offset + array.nbytes
+        return offset
+
+    def add(self, image: np.ndarray, grid, image_scale: float):
+        """
+        Appends a sample.
+
+        Params:
+            image: Float32 image in [0, 1] (as generated)
+            grid: GridDescriptor of the image, or its (x_map, y_map) (not with the "params" encoding)
+            image_scale: Generator image scale of the sample
+        """
+        if self._grid_encoding == "params" and not isinstance(grid, GridDescriptor):
+            raise ValueError("The 'params' grid encoding needs the samples' GridDescriptors.")
+        if self._file is None or self._offset >= self._shard_bytes:
+            self.close()
+            self._shard += 1
+            self._file = open(os.path.join(self._directory, f"shard_{self._shard:05d}.bin"), "wb")
+            self._offset = 0
+
+        height, width = image.shape
+        image_offset = self._write_array(np.clip(np.rint(image * 255), 0, 255).astype(np.uint8))
+        sample = {
+            "shard": self._shard,
+            "image_offset": image_offset,
+            "height": height,
+            "width": width,
+            "image_scale": image_scale,
+        }
+        if self._grid_encoding == "params":
+            sample["descriptor"] = grid._asdict()
+        else:
+            x_map, y_map = expand_grid(grid) if isinstance(grid, GridDescriptor) else grid
+            sample["grid_offset"] = self._write_array(encode_grid(x_map, y_map, self._grid_encoding))
+        self.samples.append(sample)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write_index(self, metadata: dict) -> dict:
+        """
+        Closes the last shard and writes index.json.
+
+        Params:
+            metadata: How the data was generated, stored with the index
+
+        Returns:
+            The index, including its "data_version" (a checksum of the sample list and metadata)
+        """
+        self.close()
+        index = {
+            "format": FORMAT_NAME,
+            "format_version": FORMAT_VERSION,
+            "grid_encoding": self._grid_encoding,
+            "shards": [f"shard_{shard:05d}.bin" for shard in range(self._shard + 1)],
+            "metadata": metadata,
+            "samples": self.samples,
+        }
+        index["data_version"] = hashlib.sha256(json.dumps(index, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        with open(os.path.join(self._directory, INDEX_NAME), "w", encoding="utf-8") as file:
+            json.dump(index, file)
+        return index
+
+
+def write_dataset(generator, directory: str, samples_per_scale: int, image_scales, seed: int = 0,
+                  grid_encoding: str = "params", shard_bytes: int = 1 << 30, metadata: dict = None) -> dict:
+    """
+    Generates samples in bulk and writes them as a dataset.
+
+    Params:
+        generator: DocumentImageGenerator (or CachedPageGenerator) instance
+        directory: Dataset directory
+        samples_per_scale: Number of samples generated at every image scale
+        image_scales: Generator image scales
+        seed: Generator seed, the dataset is reproducible from it
+        grid_encoding: One of GRID_ENCODINGS
+        shard_bytes: Approximate size of a shard file
+        metadata: Extra metadata stored in the index
+
+    Returns:
+        The index
+
+    Raises:
+        RuntimeError: If the generator produces no samples MAX_EMPTY_RENDERS times in a row
+    """
+    writer = ShardWriter(directory, grid_encoding, shard_bytes)
+    generator.set_seed(seed)
+    for image_scale in image_scales:
+        written = 0
+        empty_renders = 0
+        while written < samples_per_scale:
+            generator.regenerate_data(image_scale=image_scale)
+            samples = list(zip(generator.get_images(), generator.get_descriptors()))
+            if not samples:
+                empty_renders += 1
+                if empty_renders >= MAX_EMPTY_RENDERS:
+                    raise RuntimeError(f"The generator produced no samples {empty_renders} times in a row, "
+                                       f"{samples_per_scale - written} samples at scale {image_scale} are missing.")
+                continue
+            empty_renders = 0
+            for image, grid in samples[:samples_per_scale - written]:
+                writer.add(image, grid, image_scale)
+                written += 1
+    generator.delete_images()
+    generator.delete_grids()
+    return writer.write_index({"generator": str(generator), "seed": seed, "image_scales": list(image_scales),
+                               **(metadata or {})})
+
+
+class OfflineDataset(Dataset):
+    def __init__(self, directory: str, expand_grids: bool = False):
+        """
+        Memory-mapped dataset written by write_dataset(). Samples are (image, grid) with a float32 image in
+        [0, 1]; the grid is a float32 (x_map, y_map) pair, or the GridDescriptor with the "params" encoding
+        (training expands it on the device, see generator_dataset.to_target()). Shards are mapped on first
+        access in every process, so the dataset can be used from DataLoader workers.
+
+        Params:
+            directory: Dataset directory
+            expand_grids: Return (x_map, y_map) grids also for the "params" encoding
+        """
+        with open(os.path.join(directory, INDEX_NAME), "r", encoding="utf-8") as file:
+            index = json.load(file)
+        if index.get("format") != FORMAT_NAME:
+            raise ValueError(f"{directory} is not a {FORMAT_NAME} dataset.")
+        if index.get("format_version", 0) > FORMAT_VERSION:
+            raise ValueError(f"Dataset format version {index['format_version']} is newer than supported ({FORMAT_VERSION}).")
+
+        self._directory = directory
+        self._shards = index["shards"]
+        self._samples = index["samples"]
+        self.grid_encoding = index["grid_encoding"]
+        self.metadata = index["metadata"]
+        self.data_version = index["data_version"]
+        self._expand_grids = expand_grids
+        self._maps = {}
+
+    def __str__(self):
+        return "OfflineDataset"
+
+    def __len__(self):
+        return len(self._samples)
+
+    def __getstate__(self):
+        # Memory maps are not sent to worker processes, every process maps the shards itself
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def _shard(self, shard: int) -> np.memmap:
+        if shard not in self._maps:
+            self._maps[shard] = np.memmap(os.path.join(self._directory, self._shards[shard]), dtype=np.uint8, mode="r")
+        return self._maps[shard]
+
+    def __getitem__(self, index):
+        sample = self._samples[index]
+        shard = self._shard(sample["shard"])
+        height, width = sample["height"], sample["width"]
+
+        image = shard[sample["image_offset"]:sample["image_offset"] + height * width].reshape(height, width)
+        image = image.astype(np.float32) * np.float32(1 / 255.0)
+
+        if self.grid_encoding == "params":
+            descriptor = GridDescriptor(**sample["descriptor"])
+            return image, expand_grid(descriptor) if self._expand_grids else descriptor
+
+        dtype = np.dtype(GRID_ENCODINGS[self.grid_encoding][0])
+        grid_bytes = 2 * height * width * dtype.itemsize
+        stored = shard[sample["grid_offset"]:sample["grid_offset"] + grid_bytes].view(dtype).reshape(2, height, width)
+
+        return image, decode_grid(stored, self.grid_encoding)
+
+    def image_scales(self):
+        """Returns the image scales in the dataset."""
+        return sorted({sample["image_scale"] for sample in self._samples})
+
+    def indices(self, image_scale: float):
+        """Returns the indices of the samples at the available image scale nearest to `image_scale`."""
+        scales = self.image_scales()
+        if not scales:
+            raise ValueError(f"Offline dataset {self._directory} has no samples, none at image scale {image_scale}.")
+        nearest = min(scales, key=lambda scale: abs(scale - image_scale))
+        return [i for i, sample in enumerate(self._samples) if sample["image_scale"] == nearest]
+
+    def iter_batches(self, image_scale, pages_per_batch: int = 4, shuffle: bool = True, seed: int = None, endless: bool = True):
+        """
+        Iterates mini batches (lists of images and grids) in this process, like a generator's
+        get_images() and get_grids() after regenerate_data().
+
+        Params:
+            image_scale: Image scale, a float or a multiprocessing.Value("d") read before every mini batch
+            pages_per_batch: Samples per mini batch
+            shuffle: Shuffle the samples across shards (every pass in a new order)
+            seed: Shuffling seed
+            endless: Start a new pass when the samples run out
+        """
+        for batch in ScaleBatchSampler(self, image_scale, pages_per_batch, shuffle, seed, endless):
+            yield collate_batch([self[i] for i in batch])
+
+
+class ScaleBatchSampler(Sampler):
+    def __init__(self, dataset: OfflineDataset, image_scale, pages_per_batch: int = 4, shuffle: bool = True,
+                 seed: int = None, endless: bool = True):
+        """
+        Batch sampler of an OfflineDataset yielding samples at the current image scale, so the training
+        curriculum can switch scales (see OfflineDataset.iter_batches() for the parameters).
+        """
+        self._dataset = dataset
+        self._image_scale = image_scale
+        self._pages_per_batch = pages_per_batch
+        self._shuffle = shuffle
+        self._random = random.Random(seed)
+        self._endless = endless
+
+    def _current_image_scale(self):
+        return self._image_scale.value if hasattr(self._image_scale, "value") else self._image_scale
+
+    def __iter__(self):
+        order, position, scale = [], 0, None
+        while True:
+            if scale != self._current_image_scale() or position >= len(order):
+                if position >= len(order) and order and not self._endless:
+                    return
+                scale = self._current_image_scale()
+                order, position = self._dataset.indices(scale), 0
+                if self._shuffle:
+                    self._random.shuffle(order)
+            yield order[position:position + self._pages_per_batch]
+            position += self._pages_per_batch
+
+
+def collate_batch(samples):
+    """Turns a list of (image, grid) samples into a mini batch of a list of images and a list of grids."""
+    return [image for image, _ in samples], [grid for _, grid in samples]
+
+
+def main():
+    from data_generator import DocumentImageGenerator
+
+    parser = argparse.ArgumentParser(description="Generate an offline dataset of deformed pages.")
+    parser.add_argument("output", help="Dataset directory.")
+    parser.add_argument("--text", default="assets/text.txt", help="Word list for the generator.")
+    parser.add_argument("--samples", type=int, default=1000, help="Samples per image scale.")
+    parser.add_argument("--image-scales", type=float, nargs="+", default=[0.45])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--grid-encoding", choices=list(GRID_ENCODINGS), default="params")
+    parser.add_argument("--shard-mb", type=int, default=1024, help="Approximate size of a shard file in MB.")
+    parser.add_argument("--renderer", choices=["libreoffice", "numpy"], default="libreoffice")
+    parser.add_argument("--cache-dir", help="Draw pages from a cached page corpus in this directory (CachedPageGenerator).")
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        from page_corpus import CachedPageGenerator
+        generator = CachedPageGenerator(args.text, args.cache_dir, renderer=args.renderer)
+    else:
+        generator = DocumentImageGenerator(args.text, args.renderer)
+
+    with open(args.text, "rb") as file:
+        text_checksum = hashlib.sha256(file.read()).hexdigest()[:16]
+    index = write_dataset(generator, args.output, args.samples, args.image_scales, args.seed, args.grid_encoding,
+                          args.shard_mb << 20, {"renderer": args.renderer, "text_checksum": text_checksum})
+    print(f"Wrote {len(index['samples'])} samples in {len(index['shards'])} shards to {args.output} "
+          f"(data version {index['data_version']})")
+
+
+if __name__ == "__main__":
+    main()
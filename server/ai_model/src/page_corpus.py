@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: page_corpus.py
+Date: 2026-10-19
+Description: Data generator that renders a pool of flat pages once, caches it on disk and produces training
+             samples by warping a randomly drawn cached page with a fresh random deformation.
+"""
+
+import hashlib
+import os
+
+import cv2
+
+from data_generator import DocumentImageGenerator
+
+# Renders in a row that may produce no pages (e.g. LibreOffice failing) before filling the pool gives up
+MAX_EMPTY_RENDERS = 5
+
+
+class CachedPageGenerator(DocumentImageGenerator):
+    def __init__(self,
+                 file_path: str,
+                 cache_dir: str,
+                 pool_size: int = 256,
+                 refresh_every: int = 0,
+                 pages_per_batch: int = 4,
+                 variants_per_page: int = 1,
+                 renderer: str = "libreoffice"):
+        """
+        Initializes the generator. It is a drop-in replacement for DocumentImageGenerator: rendering is
+        the expensive part of generation, so flat pages are rendered once into a pool and every mini batch
+        applies new random padding, waves and rotations to pages drawn from it.
+
+        Params:
+            file_path (str): Path to a text file containing a list of words.
+            cache_dir (str): Directory of the cached pages, one subdirectory per renderer, word list and image
+                             scale. Pages already in it are reused, so the pool also survives between training runs.
+            pool_size (int): Number of flat pages kept per image scale.
+            refresh_every (int): A new document replaces random pool pages after this many drawn pages,
+                                 0 keeps the pool fixed.
+            pages_per_batch (int): Number of pages drawn per mini batch.
+            variants_per_page (int): Differently deformed samples made from every drawn page, computed
+                                     in one batch (a mini batch has pages_per_batch * variants_per_page images).
+            renderer (str): Page renderer used to fill the pool, see DocumentImageGenerator.
+        """
+        super().__init__(file_path, renderer)
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1.")
+
+        self._cache_root = cache_dir
+        self._pool_size = pool_size
+        self._refresh_every = refresh_every
+        self._pages_per_batch = pages_per_batch
+        self._variants_per_page = variants_per_page
+        self._draws = 0
+        self._select_cache(file_path)
+
+    def __str__(self):
+        return "CachedPageGenerator"
+
+    def _select_cache(self, file_path):
+        """Uses the cache of the renderer and word list, pages rendered differently must not be mixed into the pool."""
+        with open(file_path, "rb") as file:
+            text_checksum = hashlib.sha256(file.read()).hexdigest()[:16]
+        self._cache_dir = os.path.join(self._cache_root, f"{self._renderer}_{text_checksum}")
+        self._pools = {}  # image scale -> list of cached page paths
+
+    def set_text_from_file_path(self, file_path: str):
+        """
+        Sets the text data for the data generator and switches to the page pool of the new word list.
+
+        Params:
+            file_path (str): Path to a text file containing a list of words.
+        """
+        super().set_text_from_file_path(file_path)
+        self._select_cache(file_path)
+
+    def _pool_dir(self, image_scale):
+        return os.path.join(self._cache_dir, f"scale_{image_scale:.3f}")
+
+    def _write_page(self, path, page):
+        """Writes a page atomically, generators in several DataLoader workers may share the cache."""
+        temporary_path = f"{path[:-len('.png')]}.{os.getpid()}.tmp.png"
+        cv2.imwrite(temporary_path, page)
+        os.replace(temporary_path, path)
+
+    def _get_pool(self, image_scale):
+        """Returns the page paths of an image scale, rendering the missing pages of the pool first."""
+        if image_scale not in self._pools:
+            directory = self._pool_dir(image_scale)
+            os.makedirs(directory, exist_ok=True)
+            paths = [os.path.join(directory, f"page_{i:05d}.png") for i in range(self._pool_size)]
+
+            missing = [path for path in paths if not os.path.exists(path)]
+            empty_renders = 0
+            while missing:
+                pages = self._render_pages(image_scale)
+                if not pages:
+                    empty_renders += 1
+                    if empty_renders >= MAX_EMPTY_RENDERS:
+                        raise RuntimeError(f"The {self._renderer} renderer produced no pages {empty_renders} times "
+                                           f"in a row, {len(missing)} pages of {directory} are missing.")
+                    continue
+                empty_renders = 0
+                for page in pages[:len(missing)]:
+                    self._write_page(missing.pop(), page)
+
+            self._pools[image_scale] = paths
+        return self._pools[image_scale]
+
+    def _refresh(self, image_scale):
+        """Replaces random pool pages with the pages of a newly rendered document."""
+        pages = self._render_pages(image_scale)
+        paths = self._pools[image_scale]
+        for page, slot in zip(pages, self._random.sample(range(len(paths)), min(len(pages), len(paths)))):
+            self._write_page(paths[slot], page)
+
+    def generate_new_images(self, image_scale: float = 0.45):
+        """
+        Generates new images from cached pages with fresh random deformations.
+
+        Params:
+            image_scale (float): Scale factor for resizing images.
+        """
+        paths = self._get_pool(image_scale)
+        for _ in range(self._pages_per_batch):
+            page = cv2.imread(self._random.choice(paths), cv2.IMREAD_GRAYSCALE)
+            images, descriptors = self._deform_page_variants(page, image_scale, self._variants_per_page)
+            self._images.extend(images)
+            self._descriptors.extend(descriptors)
+
+            self._draws += 1
+            if self._refresh_every and self._draws % self._refresh_every == 0:
+                self._refresh(image_scale)
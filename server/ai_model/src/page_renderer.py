@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: page_renderer.py
+Date: 2026-10-19
+Description: In-process renderer of the generator's spreadsheet pages. Lays out rows of styled cells the way
+             LibreOffice Calc prints the generated ODS file (A4, 2 cm margins, 2.26 cm columns, rows as tall as
+             their largest font, text bottom-aligned and clipped by the next non-empty cell, header and footer,
+             pages top to bottom then right) straight into a grayscale NumPy raster at the target scale.
+             Text is drawn in Liberation Sans with Pillow when the font files are installed, otherwise with
+             OpenCV's Hershey fonts.
+"""
+
+import os
+import unicodedata
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+# One spreadsheet cell: text, font size in points, bold and italic flags
+Cell = namedtuple("Cell", ["text", "font_size", "bold", "italic"])
+
+_CM_PER_INCH = 2.54
+_PT_PER_INCH = 72
+
+# Glyph proportions of Liberation Sans (Calc's default font) relative to the font size
+_CAP_HEIGHT = 0.73
+_DESCENT = 0.21
+_ROW_HEIGHT = 1.28
+# Hershey glyphs are wider than Liberation Sans, rendered text is narrowed to this fraction
+_WIDTH_FACTOR = 0.8
+
+# Liberation Sans (Calc's default font, installed with LibreOffice) by bold and italic flag
+_FONT_FILES = {
+    (False, False): "LiberationSans-Regular.ttf",
+    (True, False): "LiberationSans-Bold.ttf",
+    (False, True): "LiberationSans-Italic.ttf",
+    (True, True): "LiberationSans-BoldItalic.ttf",
+}
+_FONT_DIRS = (
+    "/usr/share/fonts/truetype/liberation",
+    "/usr/share/fonts/truetype/liberation2",
+    "/usr/share/fonts/liberation-sans",
+    "/usr/share/fonts/TTF",
+    "/Library/Fonts",
+    "C:\\Windows\\Fonts",
+)
+
+# Characters without an ASCII decomposition
+_REPLACEMENTS = {"ł": "l", "Ł": "L", "–": "-", "—": "-", "„": '"', "”": '"', "“": '"', "’": "'", "‘": "'", "…": "..."}
+
+
+def to_ascii(text: str) -> str:
+    """Transliterates text to the ASCII characters the Hershey fonts can draw (diacritics are dropped)."""
+    text = "".join(_REPLACEMENTS.get(char, char) for char in text)
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in text if ord(char) < 128 and not unicodedata.combining(char))
+
+
+def find_font_dir():
+    """Returns the first of the usual font directories that contains Liberation Sans, or None."""
+    for directory in _FONT_DIRS:
+        if all(os.path.isfile(os.path.join(directory, name)) for name in _FONT_FILES.values()):
+            return directory
+    return None
+
+
+class PageRenderer:
+    def __init__(self,
+                 dpi: int = 200,
+                 page_size_cm: tuple = (21.0, 29.7),
+                 margin_cm: float = 2.0,
+                 column_width_cm: float = 2.26,
+                 header_text: str = "Table",
+                 footer_text: str = "Strona {page}",
+                 header_font_size: float = 10.0,
+                 default_font_size: float = 10.0,
+                 font_dir: str = None):
+        """
+        Initializes the renderer. The defaults reproduce the LibreOffice Calc print settings and pdf2image
+        resolution of the original pipeline.
+
+        Params:
+            dpi (int): Resolution at scale 1 (pdf2image renders at 200 dpi).
+            page_size_cm (tuple): Page width and height in centimeters (A4).
+            margin_cm (float): Page margins in centimeters.
+            column_width_cm (float): Width of a spreadsheet column in centimeters.
+            header_text (str): Page header (Calc prints the sheet name); empty for none.
+            footer_text (str): Page footer, {page} is the page number (Calc prints "Page N" in the UI language,
+                               the existing training data was rendered in Polish); empty for none.
+            header_font_size (float): Font size of the header and footer in points.
+            default_font_size (float): Font size in points that sets the minimum row height.
+            font_dir (str): Directory with the Liberation Sans TrueType files, None searches the usual font
+                            directories. Text is drawn with them (keeping diacritics) if Pillow is installed,
+                            otherwise with Hershey fonts, which drop diacritics (see to_ascii()); "" forces
+                            the Hershey fonts.
+        """
+        self._dpi = dpi
+        self._page_size_cm = page_size_cm
+        self._margin_cm = margin_cm
+        self._column_width_cm = column_width_cm
+        self._header_text = header_text
+        self._footer_text = footer_text
+        self._header_font_size = header_font_size
+        self._default_font_size = default_font_size
+
+        # Cap height of the Hershey font at font scale 1, to size the glyphs like a TrueType font
+        (_, self._hershey_cap_height), _ = cv2.getTextSize("H", cv2.FONT_HERSHEY_SIMPLEX, 1.0, 1)
+
+        self._font_dir = find_font_dir() if font_dir is None else font_dir or None
+        if self._font_dir is not None:
+            try:
+                from PIL import ImageFont  # noqa: F401  (installed with pdf2image)
+            except ImportError:
+                self._font_dir = None
+        self._truetype_fonts = {}  # (size, bold, italic) -> ImageFont
+
+    def __str__(self):
+        return "PageRenderer"
+
+    def render(self, rows, scale: float = 1.0):
+        """
+        Renders rows of cells into pages.
+
+        Params:
+            rows (list[list[Cell]]): Spreadsheet rows; an empty text leaves the cell empty.
+            scale (float): Output scale relative to `dpi` (the generator's image_scale).
+
+        Returns:
+            list[np.ndarray]: Grayscale uint8 pages (white paper, black text), in print order.
+        """
+        px_per_cm = self._dpi * scale / _CM_PER_INCH
+        px_per_pt = self._dpi * scale / _PT_PER_INCH
+
+        page_w = round(self._page_size_cm[0] * px_per_cm)
+        page_h = round(self._page_size_cm[1] * px_per_cm)
+        margin = round(self._margin_cm * px_per_cm)
+        column_w = max(1, round(self._column_width_cm * px_per_cm))
+        header_h = round(self._header_font_size * px_per_pt * _ROW_HEIGHT * 1.5) if self._header_text else 0
+        footer_h = round(self._header_font_size * px_per_pt * _ROW_HEIGHT * 1.5) if self._footer_text else 0
+
+        body_top = margin + header_h
+        body_bottom = page_h - margin - footer_h
+        columns_per_page = max(1, (page_w - 2 * margin) // column_w)
+
+        row_heights = [
+            max(1, round(max([self._default_font_size] + [cell.font_size for cell in row]) * px_per_pt * _ROW_HEIGHT))
+            for row in rows
+        ]
+
+        # Split the rows into page-high chunks
+        row_chunks, start, height = [], 0, 0
+        for index, row_h in enumerate(row_heights):
+            if height + row_h > body_bottom - body_top and index > start:
+                row_chunks.append((start, index))
+                start, height = index, 0
+            height += row_h
+        if start < len(rows):
+            row_chunks.append((start, len(rows)))
+
+        max_columns = max((len(row) for row in rows), default=0)
+        column_groups = [(first, min(first + columns_per_page, max_columns))
+                         for first in range(0, max_columns, columns_per_page)]
+
+        pages = []
+        # Calc prints top to bottom, then right, and skips empty pages
+        for first_column, last_column in column_groups:
+            for first_row, last_row in row_chunks:
+                if not any(cell.text for row in rows[first_row:last_row] for cell in row[first_column:last_column]):
+                    continue
+
+                page = np.full((page_h, page_w), 255, dtype=np.uint8)
+                y = body_top
+                for row, row_h in zip(rows[first_row:last_row], row_heights[first_row:last_row]):
+                    row_bottom = y + row_h
+                    cells = row[first_column:last_column]
+                    for column, cell in enumerate(cells):
+                        if not cell.text:
+                            continue
+                        x = margin + column * column_w
+                        # Text overflows into empty cells to the right, otherwise it is clipped at the cell border
+                        next_filled = next((i for i in range(column + 1, len(cells)) if cells[i].text), None)
+                        clip_right = page_w - margin if next_filled is None else margin + next_filled * column_w
+                        em = cell.font_size * px_per_pt
+                        self._draw_text(page, cell.text, x + max(1, round(0.05 * column_w)),
+                                        row_bottom - round(_DESCENT * em), clip_right, em, cell.bold, cell.italic)
+                    y = row_bottom
+
+                page_number = len(pages) + 1
+                em = self._header_font_size * px_per_pt
+                if self._header_text:
+                    self._draw_centered(page, self._header_text, margin + round(header_h * 0.5), em)
+                if self._footer_text:
+                    self._draw_centered(page, self._footer_text.format(page=page_number), page_h - margin, em)
+                pages.append(page)
+
+        return pages
+
+    @property
+    def uses_truetype(self) -> bool:
+        """True if text is drawn in Liberation Sans, False if with the Hershey fonts."""
+        return self._font_dir is not None
+
+    def _font(self, em: float, bold: bool, italic: bool):
+        """Hershey font, scale and stroke thickness that match a TrueType font of `em` pixels."""
+        font = cv2.FONT_HERSHEY_SIMPLEX | (cv2.FONT_ITALIC if italic else 0)
+        scale = _CAP_HEIGHT * em / self._hershey_cap_height
+        thickness = max(1, round(em * (0.11 if bold else 0.06)))
+        return font, scale, thickness
+
+    def _truetype_font(self, em: float, bold: bool, italic: bool):
+        from PIL import ImageFont
+
+        key = (max(1, round(em)), bold, italic)
+        if key not in self._truetype_fonts:
+            self._truetype_fonts[key] = ImageFont.truetype(
+                os.path.join(self._font_dir, _FONT_FILES[bold, italic]), key[0]
+            )
+        return self._truetype_fonts[key]
+
+    def _text_patch(self, text, em, bold=False, italic=False):
+        """
+        Renders text into a white patch.
+
+        Returns:
+            tuple: (patch, left, top): the uint8 patch and the offsets of its top-left corner from the
+                   start of the baseline, or None if there is nothing to draw.
+        """
+        if em < 1:
+            return None
+
+        if self.uses_truetype:
+            from PIL import Image, ImageDraw
+
+            font = self._truetype_font(em, bold, italic)
+            left, top, right, bottom = font.getbbox(text, anchor="ls")
+            if right <= left or bottom <= top:
+                return None
+            image = Image.new("L", (right - left, bottom - top), 255)
+            ImageDraw.Draw(image).text((-left, -top), text, font=font, fill=0, anchor="ls")
+            return np.asarray(image), left, top
+
+        text = to_ascii(text)
+        if not text:
+            return None
+        font, scale, thickness = self._font(em, bold, italic)
+        (text_w, text_h), descent = cv2.getTextSize(text, font, scale, thickness)
+
+        patch = np.full((text_h + descent + 2 * thickness, text_w + 2 * thickness), 255, dtype=np.uint8)
+        cv2.putText(patch, text, (thickness, text_h + thickness), font, scale, 0, thickness, cv2.LINE_AA)
+        patch = cv2.resize(patch, (max(1, round(patch.shape[1] * _WIDTH_FACTOR)), patch.shape[0]),
+                           interpolation=cv2.INTER_AREA)
+        return patch, 0, -text_h - thickness
+
+    def _draw_text(self, page, text, x, baseline, clip_right, em, bold=False, italic=False):
+        """Draws text with its baseline at `baseline`, clipped at `clip_right`, darkening the page."""
+        rendered = self._text_patch(text, em, bold, italic)
+        if rendered is None:
+            return
+        patch, left, top = rendered
+        left += x
+        top += baseline
+
+        y0, x0 = max(top, 0), max(left, 0)
+        y1 = min(top + patch.shape[0], page.shape[0])
+        x1 = min(left + patch.shape[1], clip_right, page.shape[1])
+        if y1 <= y0 or x1 <= x0:
+            return
+        region = page[y0:y1, x0:x1]
+        np.minimum(region, patch[y0 - top:y1 - top, x0 - left:x1 - left], out=region)
+
+    def _draw_centered(self, page, text, baseline, em):
+        rendered = self._text_patch(text, em)
+        if rendered is None:
+            return
+        patch, left, _ = rendered
+        x = (page.shape[1] - patch.shape[1]) // 2 - left
+        self._draw_text(page, text, x, baseline, page.shape[1], em)
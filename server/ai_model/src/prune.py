@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: prune.py
+Date: 2026-10-19
+Description: Structured channel pruning of UNetFlexible. Whole convolution channels are ranked by their
+             BatchNorm scaling factors or by mean activations on generator samples, removed step by step
+             with fine-tuning in between until the model fits a FLOP or latency budget.
+"""
+
+import argparse
+import json
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from evaluate import evaluate_model
+from model_artifact import load_model, save_artifact
+from model_stats import count_flops, measure_latency
+from train import train_model
+from unet_flexible import UNetFlexible, default_channels
+
+# Every convolution of UNetFlexible: (BatchNorm after it, convolutions whose outputs are concatenated into its input).
+# None stands for the input image. The output channels of all but final_conv can be pruned.
+LAYERS = {
+    "enc1.0": ("enc1.1", [None]),
+    "enc1.3": ("enc1.4", ["enc1.0"]),
+    "enc2.0": ("enc2.1", ["enc1.3"]),
+    "enc2.3": ("enc2.4", ["enc2.0"]),
+    "enc3.0": ("enc3.1", ["enc2.3"]),
+    "enc3.3": ("enc3.4", ["enc3.0"]),
+    "bottleneck.0": ("bottleneck.1", ["enc3.3"]),
+    "bottleneck.3": ("bottleneck.4", ["bottleneck.0"]),
+    "up3.1": ("up3.2", ["bottleneck.3"]),
+    "up2.1": ("up2.2", ["up3.1", "enc3.3"]),
+    "up1.1": ("up1.2", ["up2.1", "enc2.3"]),
+    "final_conv": (None, ["up1.1", "enc1.3"]),
+}
+PRUNABLE = [name for name in LAYERS if name != "final_conv"]
+
+# Position of every prunable convolution in the `channels` config of UNetFlexible
+_CONFIG_KEYS = {
+    "enc1.0": ("enc1", 0), "enc1.3": ("enc1", 1),
+    "enc2.0": ("enc2", 0), "enc2.3": ("enc2", 1),
+    "enc3.0": ("enc3", 0), "enc3.3": ("enc3", 1),
+    "bottleneck.0": ("bottleneck", 0), "bottleneck.3": ("bottleneck", 1),
+    "up3.1": ("up3", 0), "up2.1": ("up2", 0), "up1.1": ("up1", 0),
+}
+
+
+def bn_scores(model: UNetFlexible) -> dict:
+    """Ranks channels by the absolute BatchNorm scaling factor (gamma) following each convolution."""
+    modules = dict(model.named_modules())
+    return {name: modules[LAYERS[name][0]].weight.detach().abs().cpu() for name in PRUNABLE}
+
+
+def activation_scores(model: UNetFlexible, generator, device, num_batches: int = 2, image_scale: float = 0.45) -> dict:
+    """
+    Ranks channels by their mean activation (after BatchNorm and ReLU) on generator samples.
+
+    Params:
+        model: The model
+        generator: DocumentImageGenerator instance
+        device: Device the model is on
+        num_batches: Number of generator mini batches to sample
+        image_scale: Generator image scale
+
+    Returns:
+        Dict of layer name -> score per output channel
+    """
+    modules = dict(model.named_modules())
+    sums = {name: 0.0 for name in PRUNABLE}
+    count = 0
+
+    def hook(name):
+        def record(module, inputs, output):
+            sums[name] = sums[name] + F.relu(output).mean(dim=(0, 2, 3)).cpu()
+        return record
+
+    handles = [modules[LAYERS[name][0]].register_forward_hook(hook(name)) for name in PRUNABLE]
+    model.eval()
+    try:
+        with torch.no_grad():
+            for _ in range(num_batches):
+                generator.regenerate_data(image_scale=image_scale)
+                for img in generator.get_images():
+                    model(torch.from_numpy(img).unsqueeze(0).unsqueeze(0).float().to(device))
+                    count += 1
+    finally:
+        for handle in handles:
+            handle.remove()
+    return {name: total / max(count, 1) for name, total in sums.items()}
+
+
+def select_channels(scores: dict, fraction: float, min_channels: int = 8) -> dict:
+    """
+    Chooses the channels to keep: the `fraction` of all prunable channels with the lowest scores,
+    compared across layers after dividing each layer's scores by their mean, is removed, but every
+    layer keeps at least `min_channels`.
+
+    Returns:
+        Dict of layer name -> sorted indices of the kept output channels
+    """
+    candidates = []
+    for name in PRUNABLE:
+        layer_scores = scores[name]
+        normalized = layer_scores / layer_scores.mean().clamp_min(1e-12)
+        candidates.extend((float(score), name, index) for index, score in enumerate(normalized))
+
+    remaining = {name: len(scores[name]) for name in PRUNABLE}
+    removed = {name: set() for name in PRUNABLE}
+    to_remove = int(fraction * len(candidates))
+    for score, name, index in sorted(candidates):
+        if to_remove == 0:
+            break
+        if remaining[name] > min_channels:
+            removed[name].add(index)
+            remaining[name] -= 1
+            to_remove -= 1
+
+    return {
+        name: torch.tensor([index for index in range(len(scores[name])) if index not in removed[name]], dtype=torch.long)
+        for name in PRUNABLE
+    }
+
+
+def prune_model(model: UNetFlexible, keep: dict) -> UNetFlexible:
+    """
+    Builds a smaller UNetFlexible holding only the kept output channels of every convolution
+    (and the matching input channels of the convolutions that consume them, including skip connections).
+
+    Params:
+        model: The model to prune (not modified)
+        keep: Dict of layer name -> indices of the kept output channels, e.g. from select_channels()
+
+    Returns:
+        The pruned model on the same device
+    """
+    old_modules = dict(model.named_modules())
+    keep = dict(keep)
+    keep["final_conv"] = torch.arange(old_modules["final_conv"].out_channels)
+
+    channels = default_channels(model.config["base_channels"])
+    for name, (key, position) in _CONFIG_KEYS.items():
+        channels[key][position] = len(keep[name])
+
+    device = next(model.parameters()).device
+    pruned = UNetFlexible(base_channels=model.config["base_channels"], channels=channels).to(device)
+    new_modules = dict(pruned.named_modules())
+
+    with torch.no_grad():
+        for name, (bn_name, sources) in LAYERS.items():
+            out_index = keep[name].to(device)
+            in_index, offset = [], 0
+            for source in sources:
+                if source is None:
+                    in_index.append(torch.arange(1))
+                    offset += 1
+                else:
+                    in_index.append(keep[source] + offset)
+                    offset += old_modules[source].out_channels
+            in_index = torch.cat(in_index).to(device)
+
+            old_conv, new_conv = old_modules[name], new_modules[name]
+            new_conv.weight.copy_(old_conv.weight[out_index][:, in_index])
+            new_conv.bias.copy_(old_conv.bias[out_index])
+
+            if bn_name is not None:
+                old_bn, new_bn = old_modules[bn_name], new_modules[bn_name]
+                for attribute in ("weight", "bias", "running_mean", "running_var"):
+                    getattr(new_bn, attribute).copy_(getattr(old_bn, attribute)[out_index])
+                new_bn.num_batches_tracked.copy_(old_bn.num_batches_tracked)
+
+    return pruned
+
+
+def prune(model: UNetFlexible, generator, device, max_gflops: float = None, max_latency_ms: float = None,
+          height: int = 1024, width: int = 768, criterion_name: str = "bn", step_fraction: float = 0.1,
+          min_channels: int = 8, max_steps: int = 20, finetune_epochs: int = 3, num_batches: int = 100,
+          num_val_batches: int = 10, learning_rate: float = 1e-4, image_scale: float = 0.45,
+          teacher=None, name: str = "pruned"):
+    """
+    Prunes and fine-tunes the model step by step until it fits the budget.
+
+    Params:
+        model: The trained UNetFlexible
+        generator: DocumentImageGenerator instance for fine-tuning, ranking and validation
+        device: Device to run on
+        max_gflops: FLOP budget in GFLOPs at height x width
+        max_latency_ms: Latency budget in milliseconds at height x width on `device`
+        height: Input height the budget applies to
+        width: Input width the budget applies to
+        criterion_name: "bn" (BatchNorm scaling factors) or "activation" (mean activations on generator samples)
+        step_fraction: Fraction of the prunable channels removed per step
+        min_channels: Channels every layer keeps at least
+        max_steps: Maximum number of pruning steps
+        finetune_epochs: Epochs of train_model after every step
+        num_batches: Mini batches per fine-tuning epoch
+        num_val_batches: Mini batches of the validation loss
+        learning_rate: Learning rate for fine-tuning
+        image_scale: Generator image scale for fine-tuning and ranking
+        teacher: Optional model to distill from while fine-tuning (e.g. the unpruned model)
+        name: Name of the model (checkpoints and logs of train_model)
+
+    Returns:
+        The pruned model and the history of every step (channels, GFLOPs, latency and validation loss)
+    """
+    if max_gflops is None and max_latency_ms is None:
+        raise ValueError("Provide a FLOP or latency budget.")
+
+    criterion = nn.MSELoss()
+
+    def measure(step):
+        gflops = count_flops(model, height, width) / 1e9
+        latency_ms = measure_latency(model, height, width, device) * 1000
+        return {
+            "step": step,
+            "channels": sum(module.out_channels for module in model.modules() if isinstance(module, nn.Conv2d)),
+            "gflops": gflops,
+            "latency_ms": latency_ms,
+            "val_loss": evaluate_model(model, generator, device, criterion, num_val_batches),
+            "within_budget": (max_gflops is None or gflops <= max_gflops)
+                             and (max_latency_ms is None or latency_ms <= max_latency_ms),
+        }
+
+    history = [measure(0)]
+    print(f"step 0: {history[-1]['gflops']:.2f} GFLOPs, {history[-1]['latency_ms']:.1f}ms, val loss {history[-1]['val_loss']:.6f}")
+
+    for step in range(1, max_steps + 1):
+        if history[-1]["within_budget"]:
+            break
+
+        if criterion_name == "activation":
+            scores = activation_scores(model, generator, device, image_scale=image_scale)
+        else:
+            scores = bn_scores(model)
+        keep = select_channels(scores, step_fraction, min_channels)
+        if all(len(keep[layer]) == len(scores[layer]) for layer in PRUNABLE):
+            print("Every layer is at min_channels, stopping.")
+            break
+
+        model = prune_model(model, keep)
+        optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+        # A different seed per step, evaluate_model() always resets it to 42
+        generator.set_seed(1000 + step)
+        model = train_model(model, generator, device, finetune_epochs, criterion, optimizer, num_batches,
+                            f"{name}_step{step}", teacher=teacher, image_scales=[image_scale])[0]
+
+        history.append(measure(step))
+        print(f"step {step}: {history[-1]['gflops']:.2f} GFLOPs, {history[-1]['latency_ms']:.1f}ms, "
+              f"val loss {history[-1]['val_loss']:.6f}")
+
+    return model, history
+
+
+def main():
+    from data_generator import DocumentImageGenerator
+
+    parser = argparse.ArgumentParser(description="Prune UNetFlexible channels down to a FLOP or latency budget.")
+    parser.add_argument("model", help="Trained UNetFlexible (.safetensors artifact or .pth state_dict).")
+    parser.add_argument("output", help="Path of the pruned model artifact (.safetensors).")
+    parser.add_argument("--max-gflops", type=float, help="FLOP budget in GFLOPs at --height x --width.")
+    parser.add_argument("--max-latency-ms", type=float, help="Latency budget in ms at --height x --width on --device.")
+    parser.add_argument("--height", type=int, default=1024)
+    parser.add_argument("--width", type=int, default=768)
+    parser.add_argument("--criterion", choices=["bn", "activation"], default="bn")
+    parser.add_argument("--step", type=float, default=0.1, help="Fraction of the prunable channels removed per step.")
+    parser.add_argument("--min-channels", type=int, default=8)
+    parser.add_argument("--max-steps", type=int, default=20)
+    parser.add_argument("--finetune-epochs", type=int, default=3)
+    parser.add_argument("--batches", type=int, default=100, help="Mini batches per fine-tuning epoch.")
+    parser.add_argument("--val-batches", type=int, default=10)
+    parser.add_argument("--learning-rate", type=float, default=1e-4)
+    parser.add_argument("--image-scale", type=float, default=0.45)
+    parser.add_argument("--distill", action="store_true", help="Distill from the unpruned model while fine-tuning.")
+    parser.add_argument("--text", default="assets/text.txt", help="Word list for the generator.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--name", default="pruned")
+    parser.add_argument("--report", help="Write the per-step history to this JSON file.")
+    args = parser.parse_args()
+
+    model, metadata = load_model(args.model, args.device)
+    if not isinstance(model, UNetFlexible):
+        raise SystemExit(f"Only UNetFlexible models can be pruned, got {type(model).__name__}.")
+    teacher = None
+    if args.distill:
+        teacher, _ = load_model(args.model, args.device)
+
+    generator = DocumentImageGenerator(args.text)
+    model, history = prune(
+        model, generator, args.device,
+        max_gflops=args.max_gflops, max_latency_ms=args.max_latency_ms,
+        height=args.height, width=args.width, criterion_name=args.criterion,
+        step_fraction=args.step, min_channels=args.min_channels, max_steps=args.max_steps,
+        finetune_epochs=args.finetune_epochs, num_batches=args.batches, num_val_batches=args.val_batches,
+        learning_rate=args.learning_rate, image_scale=args.image_scale, teacher=teacher, name=args.name,
+    )
+
+    data_version = metadata.get("data_version", "")
+    save_artifact(model.cpu(), args.output, metadata.get("input_scale") or args.image_scale, data_version)
+    print(f"Pruned model saved to {args.output}")
+    if not history[-1]["within_budget"]:
+        print("WARNING: the budget was not reached, see the history.")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(history, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import torch
 from evaluate import evaluate_model
+from generator_dataset import generator_batches, shared_image_scale, to_target, to_tensor
+from offline_dataset import OfflineDataset
 from torch.optim.lr_scheduler import LambdaLR
 import os
 
@@ -11,7 +13,13 @@ def train_model(model,
                 optimizer, 
                 num_batches,
                 name,
-                resume_from_checkpoint=False):
+                resume_from_checkpoint=False,
+                teacher=None,
+                distillation_weight=0.5,
+                image_scales=None,
+                num_workers=0,
+                prefetch_factor=2,
+                val_generator=None):
     """
     Train the U-Net model using dynamically generated document images.
     If resume_from_checkpoint=True, resume training from last saved checkpoint.
@@ -26,10 +34,26 @@ def train_model(model,
         num_batches: Number of mini batches to train on
         name: Name of the model
         resume_from_checkpoint: Whether to resume from a saved checkpoint
+        teacher: Optional trained model to distill from; the loss mixes the ground truth grid and the teacher's prediction
+        distillation_weight: Weight of the teacher's prediction in the loss (0 uses only the ground truth)
+        image_scales: Generator image scales, switched to the next one when training stops improving
+                      (default [0.05, 0.1, 0.2, 0.4, 0.45]; e.g. [0.45] to fine-tune a trained model)
+        num_workers: DataLoader worker processes generating mini batches in parallel with training (0 generates
+                     each mini batch in this process before training on it)
+        prefetch_factor: Mini batches prepared in advance by each worker
+        val_generator: Validation data, e.g. an OfflineDataset written with another seed (default: generator;
+                       required when generator is an OfflineDataset, so the model is not validated on its
+                       own training samples)
     
     Returns:
         The trained model, best validation loss and lists of training and validation losses.
     """
+    if val_generator is None:
+        if isinstance(generator, OfflineDataset):
+            raise ValueError("Training on an OfflineDataset needs a separate val_generator, "
+                             "e.g. a dataset written with another seed.")
+        val_generator = generator
+
     checkpoint_path = f"../models/{name}_checkpoint.pth"
     start_epoch = 0
     train_losses, val_losses = [], []
@@ -37,11 +61,14 @@ def train_model(model,
     best_train_loss = float('inf')
     early_stop_counter_train = 0
     early_stop_counter_val = 0
-    images_scales = [0.05, 0.1, 0.2, 0.4, 0.45]
+    images_scales = list(image_scales) if image_scales else [0.05, 0.1, 0.2, 0.4, 0.45]
     images_scale = images_scales.pop(0)
 
     scheduler = LambdaLR(optimizer, lr_lambda=lambda epoch: 1.0 if epoch < 5 else 0.1)
 
+    if teacher is not None:
+        teacher.eval()
+
     # === Resume training if requested ===
     if resume_from_checkpoint and os.path.exists(checkpoint_path):
         checkpoint = torch.load(checkpoint_path, map_location=device)
@@ -61,6 +88,11 @@ def train_model(model,
 
         print(f"Resuming training from epoch {start_epoch}")
 
+    # Shared with the workers, so the curriculum can switch the scale while they generate
+    # (mini batches already prefetched keep the previous scale)
+    shared_scale = shared_image_scale(images_scale)
+    batches = generator_batches(generator, shared_scale, num_workers, prefetch_factor)
+
     with open("../logs/train.log", "a" if resume_from_checkpoint else "w") as log_file:
         log_file.write(f"Starting training for {epochs} epochs...\n")
 
@@ -70,24 +102,25 @@ def train_model(model,
                 epoch_loss = 0.0
                 
                 for batch_idx in range(num_batches):
-                    generator.regenerate_data(image_scale=images_scale)
-                    images = generator.get_images()
-                    grids = generator.get_grids()
+                    images, grids = next(batches)
                     
                     if not images:
                         continue
                     
                     batch_loss = 0.0
                     
-                    for img, (x_grid, y_grid) in zip(images, grids):
-                        img_tensor = torch.from_numpy(img).unsqueeze(0).unsqueeze(0).float().to(device)
-                        x_grid_tensor = torch.from_numpy(x_grid).unsqueeze(0).unsqueeze(0).to(device)
-                        y_grid_tensor = torch.from_numpy(y_grid).unsqueeze(0).unsqueeze(0).to(device)
-                        target_grid = torch.cat([x_grid_tensor, y_grid_tensor], dim=1)
+                    for img, grid in zip(images, grids):
+                        img_tensor = to_tensor(img, device)
+                        target_grid = to_target(grid, device)
                         
                         optimizer.zero_grad()
                         predicted_offsets = model(img_tensor)
                         loss = criterion(predicted_offsets, target_grid)
+                        if teacher is not None:
+                            # Distillation: also match the field predicted by the teacher
+                            with torch.no_grad():
+                                teacher_offsets = teacher(img_tensor)
+                            loss = (1 - distillation_weight) * loss + distillation_weight * criterion(predicted_offsets, teacher_offsets)
                         loss.backward()
                         optimizer.step()
                         
@@ -112,6 +145,7 @@ def train_model(model,
                     if early_stop_counter_train >= 21:
                         if len(images_scales) > 0:
                             images_scale = images_scales.pop(0)
+                            shared_scale.value = images_scale
                             log_file.write(f"No improvement for 21 epochs, switching image scale to {images_scale:.2f}\n")
                             early_stop_counter_train = 0
                             best_train_loss = float('inf')
@@ -120,7 +154,7 @@ def train_model(model,
                             break
                 
                 if (epoch + 1) % 60 == 0 or epoch == epochs - 1:
-                    val_loss = evaluate_model(model, generator, device, criterion, num_batches*2)
+                    val_loss = evaluate_model(model, val_generator, device, criterion, num_batches*2)
                     val_losses.append(val_loss)
 
                     if val_loss < best_val_loss:
@@ -133,6 +167,7 @@ def train_model(model,
                         if early_stop_counter_val >= 3:
                             if len(images_scales) > 0:
                                 images_scale = images_scales.pop(0)
+                                shared_scale.value = images_scale
                                 log_file.write(f"No improvement in evaluation, switching image scale to {images_scale:.2f}\n")
                                 early_stop_counter_val = 0
                             else:
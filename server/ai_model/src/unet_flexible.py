@@ -2,34 +2,62 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+
+def default_channels(base_channels):
+    """Output channels of every convolution of the unpruned UNetFlexible."""
+    c = base_channels
+    return {
+        "enc1": [c, c],
+        "enc2": [c * 2, c * 2],
+        "enc3": [c * 4, c * 4],
+        "bottleneck": [c * 8, c * 8],
+        "up3": [c * 4],
+        "up2": [c * 2],
+        "up1": [c],
+    }
+
+
 class UNetFlexible(nn.Module):
-    def __init__(self, base_channels=64):
+    def __init__(self, base_channels=64, channels=None):
+        """
+        Params:
+            base_channels: Channels of the first encoder stage; the others are multiples of it
+            channels: Optional output channels of every convolution, overriding base_channels (used by
+                      pruned models): {"enc1": [c, c], "enc2": [c, c], "enc3": [c, c], "bottleneck": [c, c],
+                      "up3": [c], "up2": [c], "up1": [c]}
+        """
         super(UNetFlexible, self).__init__()
+        self.config = {"base_channels": base_channels}  # stored in model artifacts
+        if channels is None:
+            channels = default_channels(base_channels)
+        else:
+            self.config["channels"] = channels
 
         # Encoder
-        self.enc1 = self.conv_block(1, base_channels)
-        self.enc2 = self.conv_block(base_channels, base_channels * 2)
-        self.enc3 = self.conv_block(base_channels * 2, base_channels * 4)
+        self.enc1 = self.conv_block(1, *channels["enc1"])
+        self.enc2 = self.conv_block(channels["enc1"][1], *channels["enc2"])
+        self.enc3 = self.conv_block(channels["enc2"][1], *channels["enc3"])
 
         self.pool = nn.MaxPool2d(2)
 
         # Bottleneck
-        self.bottleneck = self.conv_block(base_channels * 4, base_channels * 8)
+        self.bottleneck = self.conv_block(channels["enc3"][1], *channels["bottleneck"])
 
         # Decoder
-        self.up3 = self.up_block(base_channels * 8, base_channels * 4)
-        self.up2 = self.up_block(base_channels * 4 * 2, base_channels * 2)
-        self.up1 = self.up_block(base_channels * 2 * 2, base_channels)
+        self.up3 = self.up_block(channels["bottleneck"][1], channels["up3"][0])
+        self.up2 = self.up_block(channels["up3"][0] + channels["enc3"][1], channels["up2"][0])
+        self.up1 = self.up_block(channels["up2"][0] + channels["enc2"][1], channels["up1"][0])
 
         # Final layer
-        self.final_conv = nn.Conv2d(base_channels * 2, 2, kernel_size=1)  # 2 channels for (x, y) offsets
+        self.final_conv = nn.Conv2d(channels["up1"][0] + channels["enc1"][1], 2, kernel_size=1)  # 2 channels for (x, y) offsets
 
-    def conv_block(self, in_ch, out_ch):
+    def conv_block(self, in_ch, mid_ch, out_ch=None):
+        out_ch = mid_ch if out_ch is None else out_ch
         return nn.Sequential(
-            nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1),
-            nn.BatchNorm2d(out_ch),
+            nn.Conv2d(in_ch, mid_ch, kernel_size=3, padding=1),
+            nn.BatchNorm2d(mid_ch),
             nn.ReLU(inplace=True),
-            nn.Conv2d(out_ch, out_ch, kernel_size=3, padding=1),
+            nn.Conv2d(mid_ch, out_ch, kernel_size=3, padding=1),
             nn.BatchNorm2d(out_ch),
             nn.ReLU(inplace=True)
         )
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: unet_inference.py
+Date: 2026-10-19
+Description: Inference-only version of UNetFlexible: BatchNorm folded into the convolutions, ReLU applied in
+             place or while writing into the concatenation buffers, and identity interpolations skipped.
+"""
+
+import argparse
+import copy
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from unet_flexible import UNetFlexible
+from unet_light import UNetLight
+
+
+def fold_conv_block(block: nn.Sequential) -> nn.ModuleList:
+    """
+    Folds every Conv2d followed by BatchNorm2d of a block (eval statistics) into a single Conv2d.
+
+    Params:
+        block: Sequential of Conv2d, BatchNorm2d and activation layers
+
+    Returns:
+        The folded convolutions in order
+    """
+    layers = list(block)
+    convs = nn.ModuleList()
+    for layer, following in zip(layers, layers[1:] + [None]):
+        if isinstance(layer, nn.Conv2d):
+            if isinstance(following, nn.BatchNorm2d):
+                layer = fuse_conv_bn_eval(layer.eval(), following.eval())
+            convs.append(layer)
+    for parameter in convs.parameters():
+        parameter.requires_grad_(False)
+    return convs
+
+
+def relu_into(x: torch.Tensor, out: torch.Tensor) -> torch.Tensor:
+    """ReLU written straight into `out` (e.g. a slice of a concatenation buffer) instead of a new tensor."""
+    return torch.clamp_min(x, 0, out=out)
+
+
+class InferenceUNetFlexible(nn.Module):
+    """
+    UNetFlexible prepared for inference. The outputs equal the original model's in eval mode up to
+    floating-point rounding of the folded weights.
+
+    - Conv2d→BatchNorm2d pairs are folded into one convolution, so each block is Conv2d→ReLU.
+    - ReLU runs in place on the convolution output; the last ReLU of every encoder and decoder stage
+      writes straight into its half of the decoder's concatenation buffer, which is allocated once per
+      forward pass, so torch.cat (a second allocation and copy of every skip connection) is not needed.
+    - Skip connections and the output are interpolated only when their size differs, which happens only
+      for inputs whose sides are not divisible by 8 (bilinear resizing to the same size with
+      align_corners=True is an exact identity).
+    """
+
+    def __init__(self, model: UNetFlexible):
+        """
+        Params:
+            model: The trained UNetFlexible (not modified)
+        """
+        super().__init__()
+        self.config = dict(getattr(model, "config", {}))
+        self.enc1 = fold_conv_block(model.enc1)
+        self.enc2 = fold_conv_block(model.enc2)
+        self.enc3 = fold_conv_block(model.enc3)
+        self.bottleneck = fold_conv_block(model.bottleneck)
+        self.up3 = fold_conv_block(model.up3)
+        self.up2 = fold_conv_block(model.up2)
+        self.up1 = fold_conv_block(model.up1)
+        self.final_conv = fold_conv_block(nn.Sequential(model.final_conv))[0]
+        self.eval()
+
+    @staticmethod
+    def _stage(convs: nn.ModuleList, x: torch.Tensor, out: torch.Tensor = None) -> torch.Tensor:
+        """Conv2d→ReLU for every folded convolution; the last ReLU writes into `out` when given."""
+        for conv in convs[:-1]:
+            x = F.relu(conv(x), inplace=True)
+        x = convs[-1](x)
+        return F.relu(x, inplace=True) if out is None else relu_into(x, out)
+
+    @staticmethod
+    def _upsample(x: torch.Tensor) -> torch.Tensor:
+        return F.interpolate(x, scale_factor=2, mode="bilinear", align_corners=True)
+
+    @staticmethod
+    def _resize(x: torch.Tensor, size) -> torch.Tensor:
+        if tuple(x.shape[2:]) == tuple(size):
+            return x
+        return F.interpolate(x, size=size, mode="bilinear", align_corners=True)
+
+    @torch.inference_mode()
+    def forward(self, x):
+        n, _, h, w = x.shape
+        sizes = [(h, w)]
+        for _ in range(3):
+            sizes.append((sizes[-1][0] // 2, sizes[-1][1] // 2))
+        # Decoder sizes: every up block doubles the previous stage
+        d3_size = (sizes[3][0] * 2, sizes[3][1] * 2)
+        d2_size = (d3_size[0] * 2, d3_size[1] * 2)
+        d1_size = (d2_size[0] * 2, d2_size[1] * 2)
+
+        c1 = self.enc1[-1].out_channels
+        c2 = self.enc2[-1].out_channels
+        c3 = self.enc3[-1].out_channels
+
+        def buffer(decoder_channels, skip_channels, size):
+            return x.new_empty((n, decoder_channels + skip_channels, *size))
+
+        cat3 = buffer(self.up3[-1].out_channels, c3, d3_size)
+        cat2 = buffer(self.up2[-1].out_channels, c2, d2_size)
+        cat1 = buffer(self.up1[-1].out_channels, c1, d1_size)
+
+        def skip_slot(cat, channels, size, full_size):
+            # The encoder writes its output straight into the buffer when no resize is needed
+            return cat[:, cat.shape[1] - channels:] if size == full_size else None
+
+        slot1 = skip_slot(cat1, c1, sizes[0], d1_size)
+        slot2 = skip_slot(cat2, c2, sizes[1], d2_size)
+        slot3 = skip_slot(cat3, c3, sizes[2], d3_size)
+
+        e1 = self._stage(self.enc1, x, slot1)
+        e2 = self._stage(self.enc2, F.max_pool2d(e1, 2), slot2)
+        e3 = self._stage(self.enc3, F.max_pool2d(e2, 2), slot3)
+        b = self._stage(self.bottleneck, F.max_pool2d(e3, 2))
+
+        if slot3 is None:
+            cat3[:, cat3.shape[1] - c3:].copy_(self._resize(e3, d3_size))
+        self._stage(self.up3, self._upsample(b), cat3[:, :cat3.shape[1] - c3])
+        del b, e3
+
+        if slot2 is None:
+            cat2[:, cat2.shape[1] - c2:].copy_(self._resize(e2, d2_size))
+        self._stage(self.up2, self._upsample(cat3), cat2[:, :cat2.shape[1] - c2])
+        del cat3, e2
+
+        if slot1 is None:
+            cat1[:, cat1.shape[1] - c1:].copy_(self._resize(e1, d1_size))
+        self._stage(self.up1, self._upsample(cat2), cat1[:, :cat1.shape[1] - c1])
+        del cat2, e1
+
+        return self._resize(self.final_conv(cat1), (h, w))
+
+
+def fold_batchnorm(model: nn.Module) -> nn.Module:
+    """
+    Returns a copy of a model in which every Conv2d directly followed by BatchNorm2d inside an
+    nn.Sequential is folded into one convolution (the BatchNorm becomes an identity). Works for any
+    architecture built from such blocks, e.g. UNetLight.
+
+    Params:
+        model: The trained model (not modified)
+
+    Returns:
+        The folded model in eval mode
+    """
+    model = copy.deepcopy(model).eval()
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for index in range(len(module) - 1):
+            if isinstance(module[index], nn.Conv2d) and isinstance(module[index + 1], nn.BatchNorm2d):
+                module[index] = fuse_conv_bn_eval(module[index], module[index + 1])
+                module[index + 1] = nn.Identity()
+    for parameter in model.parameters():
+        parameter.requires_grad_(False)
+    return model
+
+
+# Architecture -> callable building its inference version
+OPTIMIZED_ARCHITECTURES = {
+    UNetFlexible: InferenceUNetFlexible,
+    UNetLight: fold_batchnorm,
+}
+
+
+def optimize_for_inference(model: nn.Module) -> nn.Module:
+    """
+    Returns the inference-optimized version of a model, or the model itself if its
+    architecture has none. The original model is not modified.
+
+    Params:
+        model: The trained model
+
+    Returns:
+        A model in eval mode with the same outputs
+    """
+    model.eval()
+    optimize = OPTIMIZED_ARCHITECTURES.get(type(model))
+    if optimize is None:
+        return model
+    device = next(model.parameters()).device
+    return optimize(model).to(device)
+
+
+def compare_models(reference: nn.Module, optimized: nn.Module, shapes, device="cpu", repeats: int = 5):
+    """
+    Compares outputs, latency and allocated memory of a model and its optimized version on random inputs.
+
+    Params:
+        reference: The original model
+        optimized: The optimized model
+        shapes: List of (height, width) input sizes
+        device: Device the models are on
+        repeats: Timed forward passes per shape (after one warm-up pass)
+
+    Returns:
+        List of dicts with the shape, maximum absolute difference and, for both models,
+        median seconds per forward pass and MB allocated by one forward pass
+    """
+    reference.eval()
+    rows = []
+    for height, width in shapes:
+        x = torch.rand(1, 1, height, width, device=device)
+        row = {"shape": (height, width)}
+        outputs = {}
+        for name, model in (("reference", reference), ("optimized", optimized)):
+            with torch.inference_mode():
+                outputs[name] = model(x)
+                seconds = []
+                for _ in range(repeats):
+                    if device != "cpu":
+                        torch.cuda.synchronize()
+                    start = time.perf_counter()
+                    model(x)
+                    if device != "cpu":
+                        torch.cuda.synchronize()
+                    seconds.append(time.perf_counter() - start)
+                with torch.profiler.profile(profile_memory=True) as profile:
+                    model(x)
+            allocated = sum(max(event.self_cpu_memory_usage, 0) + max(getattr(event, "self_device_memory_usage", 0), 0)
+                            for event in profile.events())
+            row[f"{name}_seconds"] = sorted(seconds)[len(seconds) // 2]
+            row[f"{name}_mb"] = allocated / 2**20
+        row["max_abs_diff"] = float((outputs["reference"] - outputs["optimized"]).abs().max())
+        rows.append(row)
+    return rows
+
+
+def main():
+    from model_artifact import load_model
+
+    parser = argparse.ArgumentParser(description="Check the inference-optimized model against the original.")
+    parser.add_argument("model", help="Model artifact (.safetensors) or .pth state_dict.")
+    parser.add_argument("--shapes", nargs="+", default=["512x384", "1024x768", "1001x757"],
+                        help="Input sizes as HEIGHTxWIDTH.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--atol", type=float, default=1e-3, help="Largest accepted absolute difference (pixels).")
+    args = parser.parse_args()
+
+    reference, _ = load_model(args.model, args.device)
+    optimized = optimize_for_inference(reference)
+    shapes = [tuple(int(side) for side in shape.split("x")) for shape in args.shapes]
+
+    rows = compare_models(reference, optimized, shapes, args.device, args.repeats)
+    print(f"{'shape':>12} {'max diff':>10} {'reference':>12} {'optimized':>12} {'speed-up':>9} {'ref MB':>9} {'opt MB':>9}")
+    for row in rows:
+        print(f"{'%dx%d' % row['shape']:>12} {row['max_abs_diff']:>10.2e} "
+              f"{row['reference_seconds'] * 1000:>10.1f}ms {row['optimized_seconds'] * 1000:>10.1f}ms "
+              f"{row['reference_seconds'] / row['optimized_seconds']:>8.2f}x "
+              f"{row['reference_mb']:>9.1f} {row['optimized_mb']:>9.1f}")
+
+    worst = max(row["max_abs_diff"] for row in rows)
+    if worst > args.atol:
+        raise SystemExit(f"Outputs differ by up to {worst:.2e}, more than --atol {args.atol}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+File name: unet_light.py
+Date: 2026-10-19
+Description: Lighter U-Net variants for CPU serving: an early downsampling stem, fewer channels
+             and optionally depthwise-separable convolutions. Trained by distillation from UNetFlexible.
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class UNetLight(nn.Module):
+    def __init__(self, base_channels=16, depthwise=True, stem_stride=2):
+        """
+        Params:
+            base_channels: Channels of the first encoder stage (UNetFlexible uses 64)
+            depthwise: Use depthwise-separable convolutions (3x3 depthwise + 1x1 pointwise) in the blocks
+            stem_stride: Stride of the input convolution; 2 runs the whole network at half resolution
+                         and upsamples the predicted field at the end
+        """
+        super(UNetLight, self).__init__()
+        self.config = {"base_channels": base_channels, "depthwise": depthwise, "stem_stride": stem_stride}  # stored in model artifacts
+        self._depthwise = depthwise
+
+        # Stem: a single full-resolution convolution
+        self.stem = nn.Sequential(
+            nn.Conv2d(1, base_channels, kernel_size=3, stride=stem_stride, padding=1, bias=False),
+            nn.BatchNorm2d(base_channels),
+            nn.ReLU(inplace=True)
+        )
+
+        # Encoder
+        self.enc1 = self.conv_block(base_channels, base_channels)
+        self.enc2 = self.conv_block(base_channels, base_channels * 2)
+        self.enc3 = self.conv_block(base_channels * 2, base_channels * 4)
+
+        self.pool = nn.MaxPool2d(2)
+
+        # Bottleneck
+        self.bottleneck = self.conv_block(base_channels * 4, base_channels * 8)
+
+        # Decoder
+        self.up3 = self.up_block(base_channels * 8, base_channels * 4)
+        self.up2 = self.up_block(base_channels * 4 * 2, base_channels * 2)
+        self.up1 = self.up_block(base_channels * 2 * 2, base_channels)
+
+        # Final layer
+        self.final_conv = nn.Conv2d(base_channels * 2, 2, kernel_size=1)  # 2 channels for (x, y) coordinates
+
+    def conv(self, in_ch, out_ch):
+        """3x3 convolution, depthwise-separable if enabled (BatchNorm follows, so no bias)."""
+        if not self._depthwise:
+            return [nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1, bias=False)]
+        return [
+            nn.Conv2d(in_ch, in_ch, kernel_size=3, padding=1, groups=in_ch, bias=False),
+            nn.Conv2d(in_ch, out_ch, kernel_size=1, bias=False),
+        ]
+
+    def conv_block(self, in_ch, out_ch):
+        return nn.Sequential(
+            *self.conv(in_ch, out_ch),
+            nn.BatchNorm2d(out_ch),
+            nn.ReLU(inplace=True),
+            *self.conv(out_ch, out_ch),
+            nn.BatchNorm2d(out_ch),
+            nn.ReLU(inplace=True)
+        )
+
+    def up_block(self, in_ch, out_ch):
+        return nn.Sequential(
+            nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True),
+            *self.conv(in_ch, out_ch),
+            nn.BatchNorm2d(out_ch),
+            nn.ReLU(inplace=True)
+        )
+
+    def forward(self, x):
+        e1 = self.enc1(self.stem(x))
+        e2 = self.enc2(self.pool(e1))
+        e3 = self.enc3(self.pool(e2))
+
+        b = self.bottleneck(self.pool(e3))
+
+        d3 = self.up3(b)
+        if e3.shape[2:] != d3.shape[2:]:
+            e3 = F.interpolate(e3, size=d3.shape[2:], mode='bilinear', align_corners=True)
+        d3 = torch.cat([d3, e3], dim=1)
+
+        d2 = self.up2(d3)
+        if e2.shape[2:] != d2.shape[2:]:
+            e2 = F.interpolate(e2, size=d2.shape[2:], mode='bilinear', align_corners=True)
+        d2 = torch.cat([d2, e2], dim=1)
+
+        d1 = self.up1(d2)
+        if e1.shape[2:] != d1.shape[2:]:
+            e1 = F.interpolate(e1, size=d1.shape[2:], mode='bilinear', align_corners=True)
+        d1 = torch.cat([d1, e1], dim=1)
+
+        out = self.final_conv(d1)
+        if out.shape[2:] != x.shape[2:]:
+            # Coordinates are in input pixels at every resolution, the field only needs resampling
+            out = F.interpolate(out, size=x.shape[2:], mode='bilinear', align_corners=True)
+
+        return out
+
+
+# Speed tiers, from fastest to most accurate
+VARIANTS = {
+    "light-s": {"base_channels": 16, "depthwise": True, "stem_stride": 2},
+    "light-m": {"base_channels": 24, "depthwise": True, "stem_stride": 2},
+    "light-l": {"base_channels": 32, "depthwise": False, "stem_stride": 2},
+    "light-full": {"base_channels": 24, "depthwise": True, "stem_stride": 1},
+}
+
+
+def build_variant(name: str) -> UNetLight:
+    """
+    Creates an untrained model of a named variant.
+
+    Params:
+        name: One of VARIANTS
+
+    Returns:
+        The UNetLight instance
+    """
+    if name not in VARIANTS:
+        raise ValueError(f"Unknown variant {name!r}, expected one of {', '.join(VARIANTS)}.")
+    return UNetLight(**VARIANTS[name])
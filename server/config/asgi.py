@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Load the dewarp model in serving workers before the first request
+from django.conf import settings
+
+if settings.DEWARP_WARM_UP:
+    from photos.dewarp_service import warm_up
+    warm_up()
@@ -158,6 +158,91 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 
+# Image processing admission control
+# The budget is per server worker process (the controller lives in process memory): with N
+# gunicorn/uvicorn workers, size these settings to 1/N of what the machine can afford
+
+# Total memory (MB) that concurrently processed uploads may use. A 12 MP photo takes about 4 GB,
+# an image of DEWARP_MAX_PIXELS about 8 GB; smaller budgets decode large photos at reduced resolution
+DEWARP_MEMORY_BUDGET_MB = config('DEWARP_MEMORY_BUDGET_MB', default=8192, cast=int)
+# Maximum number of uploads processed at once
+DEWARP_MAX_CONCURRENT = config('DEWARP_MAX_CONCURRENT', default=os.cpu_count() or 1, cast=int)
+# Maximum number of uploads waiting for admission before 429 is returned
+DEWARP_MAX_QUEUE = config('DEWARP_MAX_QUEUE', default=8, cast=int)
+# Seconds an upload may wait for admission before 429 is returned
+DEWARP_QUEUE_TIMEOUT = config('DEWARP_QUEUE_TIMEOUT', default=30, cast=float)
+# Maximum number of uploads of one user processed at once (0 disables the cap)
+DEWARP_USER_MAX_CONCURRENT = config('DEWARP_USER_MAX_CONCURRENT', default=2, cast=int)
+# Queue length and wait timeout for bulk uploads (sent with priority=bulk)
+DEWARP_MAX_BULK_QUEUE = config('DEWARP_MAX_BULK_QUEUE', default=64, cast=int)
+DEWARP_BULK_QUEUE_TIMEOUT = config('DEWARP_BULK_QUEUE_TIMEOUT', default=300, cast=float)
+# Interactive uploads admitted in a row before a waiting bulk upload is served
+DEWARP_INTERACTIVE_WEIGHT = config('DEWARP_INTERACTIVE_WEIGHT', default=4, cast=int)
+# Uploads of one user running or waiting beyond which further uploads are queued as bulk,
+# whatever priority the client sent (0 trusts the client)
+DEWARP_USER_INTERACTIVE_BURST = config('DEWARP_USER_INTERACTIVE_BURST', default=4, cast=int)
+# Largest image (in pixels) processed without reduced decoding
+DEWARP_MAX_PIXELS = config('DEWARP_MAX_PIXELS', default=25_000_000, cast=int)
+# Decode over-size images at 1/2, 1/4 or 1/8 resolution instead of rejecting them
+DEWARP_DOWNSCALE_OVERSIZE = config('DEWARP_DOWNSCALE_OVERSIZE', default=True, cast=bool)
+
+
+# Skip the inverse warp when the predicted field deviates from identity by less than this RMS (pixels, 0 disables).
+# Disabled by default: validate a value with `manage.py dewarp_golden compare <corpus> --path fast_paths` before enabling it.
+DEWARP_FLAT_THRESHOLD = config('DEWARP_FLAT_THRESHOLD', default=0.0, cast=float)
+# Use a global homography instead of the inverse warp when it fits the field within this RMS (pixels, 0 disables).
+# Disabled by default, validate it with dewarp_golden like DEWARP_FLAT_THRESHOLD.
+DEWARP_HOMOGRAPHY_THRESHOLD = config('DEWARP_HOMOGRAPHY_THRESHOLD', default=0.0, cast=float)
+# Skip inference for pages whose outline is a straight-edged quadrilateral
+DEWARP_FLAT_PRECHECK = config('DEWARP_FLAT_PRECHECK', default=False, cast=bool)
+# Choose the inference resolution per image instead of a fixed 0.4 scale
+DEWARP_ADAPTIVE_SCALE = config('DEWARP_ADAPTIVE_SCALE', default=False, cast=bool)
+# Latency budget (seconds) for inference and inverse warp of one image
+DEWARP_LATENCY_SLO = config('DEWARP_LATENCY_SLO', default=3.0, cast=float)
+# Page width (pixels) at inference when no calibration table is available
+DEWARP_TARGET_PAGE_WIDTH = config('DEWARP_TARGET_PAGE_WIDTH', default=750, cast=int)
+# Calibration table written by `manage.py calibrate_dewarp`
+DEWARP_CALIBRATION_PATH = config('DEWARP_CALIBRATION_PATH', default=os.path.join(BASE_DIR, 'ai_model', 'models', 'dewarp_calibration.json'))
+# Answer uploads with a quick preview and replace it with the full dewarp in the background
+DEWARP_PROGRESSIVE = config('DEWARP_PROGRESSIVE', default=False, cast=bool)
+# Threads waiting for admission to refine previews, and admission attempts per preview
+DEWARP_REFINE_THREADS = config('DEWARP_REFINE_THREADS', default=4, cast=int)
+DEWARP_REFINE_ATTEMPTS = config('DEWARP_REFINE_ATTEMPTS', default=10, cast=int)
+# Dewarp model: a .safetensors artifact (see ai_model/src/model_artifact.py) or a legacy .pth state_dict
+DEWARP_MODEL_PATH = config('DEWARP_MODEL_PATH', default=os.path.join(BASE_DIR, 'ai_model', 'models', 'unet_deform_best_train.pth'))
+# Run the inference-optimized model (check it first with `manage.py dewarp_golden compare --path optimized_model`)
+DEWARP_OPTIMIZE_MODEL = config('DEWARP_OPTIMIZE_MODEL', default=False, cast=bool)
+# Load the dewarp model when a WSGI/ASGI worker starts instead of on the first upload
+DEWARP_WARM_UP = config('DEWARP_WARM_UP', default=False, cast=bool)
+
+
+# Async photo views (served through config.asgi)
+
+# Route upload, view, temp-view and list endpoints to the async views
+PHOTOS_ASYNC_VIEWS = config('PHOTOS_ASYNC_VIEWS', default=False, cast=bool)
+# Executor for dewarping in async views: 'thread' or 'process'
+DEWARP_EXECUTOR = config('DEWARP_EXECUTOR', default='thread')
+# Threads for encryption/decryption and for file system I/O in async views
+PHOTO_CRYPTO_THREADS = config('PHOTO_CRYPTO_THREADS', default=4, cast=int)
+PHOTO_IO_THREADS = config('PHOTO_IO_THREADS', default=8, cast=int)
+# Photos decrypted ahead of the one being streamed by the library export
+PHOTO_EXPORT_READ_AHEAD = config('PHOTO_EXPORT_READ_AHEAD', default=2, cast=int)
+# Report per-stage timings of photo requests in a Server-Timing response header
+PHOTOS_SERVER_TIMING = config('PHOTOS_SERVER_TIMING', default=False, cast=bool)
+
+
+# Per-request profiling for staff (see photos.profiling)
+
+# Allow staff to profile upload and render requests
+PHOTOS_PROFILING = config('PHOTOS_PROFILING', default=False, cast=bool)
+# Directory for flame graph stacks, torch traces and profile metadata
+PROFILES_DIR = config('PROFILES_DIR', default=os.path.join(BASE_DIR, 'profiles'))
+# Seconds between stack samples
+PROFILING_INTERVAL = config('PROFILING_INTERVAL', default=0.005, cast=float)
+# Lifetime in seconds of X-Profile-Token headers
+PROFILING_TOKEN_MAX_AGE = config('PROFILING_TOKEN_MAX_AGE', default=3600, cast=int)
+
+
 # For testing purposes
 # SIMPLE_JWT = {
 #     'ACCESS_TOKEN_LIFETIME': timedelta(seconds=5),
@@ -0,0 +1,79 @@
+"""
+Settings profile for load tests (manage.py loadtest).
+
+Runs the app against a throwaway SQLite database and media directory, so a load test
+never touches the real PostgreSQL database or stored photos:
+
+    DJANGO_SETTINGS_MODULE=config.settings_loadtest python manage.py migrate
+    DJANGO_SETTINGS_MODULE=config.settings_loadtest python manage.py runserver --noreload
+"""
+import json
+import os
+import tempfile
+
+from cryptography.fernet import Fernet
+from django.core.management.utils import get_random_secret_key
+
+# Directory for the database and media, shared by the server and the load test command
+LOADTEST_DIR = os.environ.get('LOADTEST_DIR') or os.path.join(tempfile.gettempdir(), 'bookscanner-loadtest')
+
+
+def _loadtest_keys(directory: str) -> dict:
+    """
+    Returns the SECRET_KEY and MASTER_KEY of the load test directory, generating them on first use.
+    The user keys in the database are encrypted with MASTER_KEY, so every server worker and every
+    restart must use the same keys as long as the directory exists.
+    """
+    path = os.path.join(directory, 'keys.json')
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        keys = {'SECRET_KEY': get_random_secret_key(), 'MASTER_KEY': Fernet.generate_key().decode()}
+        temporary_path = f"{path}.{os.getpid()}"
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(keys, f)
+        try:
+            # Workers starting together race here: the first link wins and the others read its keys
+            os.link(temporary_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary_path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Values for what the base settings require (environment variables take precedence over .env),
+# so the profile works without a .env file and never uses the real keys
+for _name, _value in _loadtest_keys(LOADTEST_DIR).items():
+    os.environ.setdefault(_name, _value)
+os.environ.setdefault('DEBUG', 'False')
+os.environ.setdefault('ALLOWED_HOSTS', '*')
+os.environ.setdefault('CORS_ALLOWED_ORIGINS', '')
+os.environ.setdefault('DB_NAME', 'loadtest')
+os.environ.setdefault('DB_USER', '')
+os.environ.setdefault('DB_PASSWORD', '')
+
+from .settings import *  # noqa: E402,F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(LOADTEST_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # Concurrent clients write at the same time; wait for the lock instead of failing
+            'timeout': 30,
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
+    }
+}
+
+MEDIA_ROOT = os.path.join(LOADTEST_DIR, 'media')
+PROFILES_DIR = os.path.join(LOADTEST_DIR, 'profiles')
+
+# Registering the test users should not dominate the run
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+PHOTOS_SERVER_TIMING = True
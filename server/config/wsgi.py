@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Load the dewarp model in serving workers before the first request
+from django.conf import settings
+
+if settings.DEWARP_WARM_UP:
+    from photos.dewarp_service import warm_up
+    warm_up()
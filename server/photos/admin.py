@@ -1,3 +1,19 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ProfileCapture, ProfilingToggle
+
+
+@admin.register(ProfilingToggle)
+class ProfilingToggleAdmin(admin.ModelAdmin):
+    list_display = ('user', 'enabled')
+    list_editable = ('enabled',)
+
+
+@admin.register(ProfileCapture)
+class ProfileCaptureAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'view', 'status_code', 'duration', 'width', 'height', 'created_at')
+    list_filter = ('view', 'status_code')
+    readonly_fields = [field.name for field in ProfileCapture._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
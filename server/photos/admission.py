@@ -0,0 +1,545 @@
+import asyncio
+import concurrent.futures
+import math
+import struct
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .inference_scale import max_inference_scale
+
+
+# Reduced decoding factors supported by cv2.imdecode (IMREAD_REDUCED_GRAYSCALE_*)
+REDUCTION_FACTORS = (1, 2, 4, 8)
+
+# Approximate peak bytes per pixel of each pipeline stage
+DECODE_BYTES_PER_PIXEL = 1          # uint8 grayscale decode
+FIND_PAGE_BYTES_PER_PIXEL = 24      # int32 + float64 intermediates and uint8 masks in _find_page
+UNET_BYTES_PER_PIXEL = 1792         # float32 activations of UNetFlexible(base_channels=64) under inference_mode:
+                                    # peak in up1, upsampled 256 channels + conv, norm and skip tensors of 64
+GRIDDATA_BYTES_PER_PIXEL = 160      # Delaunay triangulation, meshgrids and inverse maps
+REMAP_BYTES_PER_PIXEL = 9           # float32 x and y maps and the uint8 output of apply_field
+
+# Approximate CPU seconds per megapixel of the original and the inference image
+FIND_PAGE_SECONDS_PER_MP = 0.05
+DEWARP_SECONDS_PER_MP = 1.5
+REMAP_SECONDS_PER_MP = 0.02
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a dewarp request cannot be admitted within the configured budget.
+
+    Attributes:
+        retry_after (int): Suggested number of seconds before the client retries.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Image processing is saturated, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class ImageTooLarge(Exception):
+    """Raised when an image cannot be processed even after reduced decoding."""
+
+
+@dataclass(frozen=True)
+class ProcessingCost:
+    """Estimated resources needed to dewarp a single image."""
+    width: int
+    height: int
+    reduction: int
+    memory_bytes: int
+    cpu_seconds: float
+
+
+def read_image_size(uploaded_file) -> tuple[int, int] | None:
+    """
+    Reads the image dimensions from the JPEG or PNG header without decoding pixels.
+    The file position is restored to the beginning afterwards.
+
+    Args:
+        uploaded_file: The uploaded file object.
+
+    Returns:
+        tuple[int, int] | None: (width, height) or None if the format is not recognized.
+    """
+    uploaded_file.seek(0)
+    try:
+        head = uploaded_file.read(24)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', head[16:24])
+            return width, height
+        if head.startswith(b'\xff\xd8'):
+            uploaded_file.seek(2)
+            return _read_jpeg_size(uploaded_file)
+        return None
+    finally:
+        uploaded_file.seek(0)
+
+
+def _read_jpeg_size(stream) -> tuple[int, int] | None:
+    """Walks JPEG segments until a start-of-frame marker is found."""
+    frame = read_jpeg_frame(stream)
+    return frame[:2] if frame is not None else None
+
+
+def read_jpeg_frame(stream) -> tuple[int, int, int] | None:
+    """
+    Reads the start-of-frame header of a JPEG stream positioned after the SOI marker.
+
+    Args:
+        stream: A binary file object.
+
+    Returns:
+        tuple[int, int, int] | None: (width, height, components) or None if no frame header is found.
+    """
+    while True:
+        marker = stream.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:
+            fill = stream.read(1)
+            if not fill:
+                return None
+            code = fill[0]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        length_bytes = stream.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        # SOF0..SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            frame = stream.read(6)
+            if len(frame) < 6:
+                return None
+            height, width, components = struct.unpack('>HHB', frame[1:6])
+            return width, height, components
+        stream.seek(length - 2, 1)
+
+
+def estimate_cost(width: int, height: int, reduction: int = 1) -> ProcessingCost:
+    """
+    Estimates peak memory and CPU time of the dewarp pipeline for an image.
+
+    Args:
+        width (int): Width of the image in the file header.
+        height (int): Height of the image in the file header.
+        reduction (int): Reduced decoding factor applied before processing.
+
+    Returns:
+        ProcessingCost: The estimated cost.
+    """
+    decoded_width, decoded_height = math.ceil(width / reduction), math.ceil(height / reduction)
+    pixels = decoded_width * decoded_height
+    inference_pixels = pixels * max_inference_scale(decoded_width, decoded_height) ** 2
+
+    memory_bytes = int(
+        pixels * (DECODE_BYTES_PER_PIXEL + FIND_PAGE_BYTES_PER_PIXEL)
+        + inference_pixels * (UNET_BYTES_PER_PIXEL + GRIDDATA_BYTES_PER_PIXEL)
+    )
+    cpu_seconds = (pixels * FIND_PAGE_SECONDS_PER_MP + inference_pixels * DEWARP_SECONDS_PER_MP) / 1e6
+
+    return ProcessingCost(width, height, reduction, memory_bytes, cpu_seconds)
+
+
+def estimate_render_cost(width: int, height: int, reduction: int = 1) -> ProcessingCost:
+    """
+    Estimates peak memory and CPU time of re-rendering a photo from its stored deformation field.
+    The original is decoded and the page found as in the dewarp pipeline, followed by a single remap
+    instead of inference; the remap output is never larger than the decoded image.
+
+    Args:
+        width (int): Width of the original in the file header.
+        height (int): Height of the original in the file header.
+        reduction (int): Reduced decoding factor applied before rendering.
+
+    Returns:
+        ProcessingCost: The estimated cost.
+    """
+    pixels = math.ceil(width / reduction) * math.ceil(height / reduction)
+    memory_bytes = int(pixels * (DECODE_BYTES_PER_PIXEL + FIND_PAGE_BYTES_PER_PIXEL + REMAP_BYTES_PER_PIXEL))
+    cpu_seconds = pixels * (FIND_PAGE_SECONDS_PER_MP + REMAP_SECONDS_PER_MP) / 1e6
+
+    return ProcessingCost(width, height, reduction, memory_bytes, cpu_seconds)
+
+
+def plan_processing(width: int, height: int) -> ProcessingCost:
+    """
+    Chooses the smallest reduced decoding factor that keeps the image within
+    DEWARP_MAX_PIXELS and the global memory budget. The defaults are sized so that every image
+    within DEWARP_MAX_PIXELS fits the budget at full resolution: the thresholds of the page
+    detection are tuned for full-size photos, so reduction is a last resort for over-size images.
+
+    Args:
+        width (int): Width of the image in the file header.
+        height (int): Height of the image in the file header.
+
+    Returns:
+        ProcessingCost: The cost of the chosen plan.
+
+    Raises:
+        ImageTooLarge: If no allowed factor brings the image within limits.
+    """
+    factors = REDUCTION_FACTORS if settings.DEWARP_DOWNSCALE_OVERSIZE else REDUCTION_FACTORS[:1]
+
+    for reduction in factors:
+        cost = estimate_cost(width, height, reduction)
+        pixels = math.ceil(width / reduction) * math.ceil(height / reduction)
+        if pixels <= settings.DEWARP_MAX_PIXELS and cost.memory_bytes <= dewarp_admission.memory_budget:
+            return cost
+
+    raise ImageTooLarge(f"Image of {width}x{height} pixels exceeds the processing limits.")
+
+
+# Priority classes of dewarp requests
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+# Recent queue waits kept per class for the percentiles in stats()
+WAIT_SAMPLES = 1000
+
+
+class _Ticket:
+    """A request waiting for admission."""
+
+    def __init__(self, cost: ProcessingCost, user_id, priority: str):
+        self.cost = cost
+        self.user_id = user_id
+        self.priority = priority
+        self.granted = False
+
+
+class AdmissionSlot:
+    """
+    The share of the budget held inside AdmissionController.admit_async().
+    Cancelling a coroutine does not stop executor work it started, so the budget is released only
+    once the work handed to run() has completed.
+    """
+
+    def __init__(self, controller: "AdmissionController", cost: ProcessingCost, user_id):
+        self._controller = controller
+        self._cost = cost
+        self._user_id = user_id
+        self._future = None
+
+    async def run(self, future: concurrent.futures.Future):
+        """
+        Awaits an executor future while holding the budget.
+
+        Args:
+            future (concurrent.futures.Future): The submitted work.
+
+        Returns:
+            The result of the work.
+        """
+        self._future = future
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        """Releases the budget now, or when the work passed to run() completes."""
+        if self._future is None:
+            self._controller.release(self._cost, self._user_id)
+        else:
+            # Called at once if the work is already done, otherwise from the executor thread
+            self._future.add_done_callback(lambda _: self._controller.release(self._cost, self._user_id))
+
+
+class AdmissionController:
+    """
+    Memory and concurrency budget for dewarp requests with bounded wait queues.
+
+    The state lives in the memory of the server process, so the budget is per worker process;
+    with several gunicorn/uvicorn workers every worker enforces its own copy of the settings.
+
+    Waiting requests are scheduled fairly: each priority class keeps a FIFO queue per user
+    and serves users round-robin, skipping users at their concurrency cap. Interactive
+    requests go first, but every interactive_weight-th grant goes to bulk work if any is
+    waiting, so bulk work is never starved.
+    """
+
+    def __init__(self,
+                 memory_budget: int,
+                 max_concurrent: int,
+                 max_queue: int,
+                 queue_timeout: float,
+                 user_max_concurrent: int = 0,
+                 max_bulk_queue: int | None = None,
+                 bulk_queue_timeout: float | None = None,
+                 interactive_weight: int = 4,
+                 user_interactive_burst: int = 0):
+        """
+        Args:
+            memory_budget (int): Total bytes that admitted requests may use at once.
+            max_concurrent (int): Maximum number of requests processed at once.
+            max_queue (int): Maximum number of interactive requests waiting for admission.
+            queue_timeout (float): Seconds an interactive request may wait before it is rejected.
+            user_max_concurrent (int): Maximum number of requests of one user processed at once. 0 disables it.
+            max_bulk_queue (int | None): Maximum number of bulk requests waiting (default max_queue).
+            bulk_queue_timeout (float | None): Seconds a bulk request may wait (default queue_timeout).
+            interactive_weight (int): Interactive grants in a row before a waiting bulk request is served.
+            user_interactive_burst (int): Requests of one user running or waiting beyond which further
+                requests are served as bulk, see assign_priority(). 0 disables it.
+        """
+        self.memory_budget = memory_budget
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_max_concurrent = user_max_concurrent
+        self.interactive_weight = max(1, interactive_weight)
+        self.user_interactive_burst = user_interactive_burst
+        self._queue_limits = {
+            PRIORITY_INTERACTIVE: max_queue,
+            PRIORITY_BULK: max_queue if max_bulk_queue is None else max_bulk_queue,
+        }
+        self._queue_timeouts = {
+            PRIORITY_INTERACTIVE: queue_timeout,
+            PRIORITY_BULK: queue_timeout if bulk_queue_timeout is None else bulk_queue_timeout,
+        }
+
+        self._cond = threading.Condition()
+        self._memory_in_use = 0
+        self._running = 0
+        self._running_by_user = Counter()
+        self._pending_seconds = 0.0
+        # priority -> user -> tickets; dict order is the round-robin order of users
+        self._queues = {priority: {} for priority in PRIORITIES}
+        self._waiting = Counter()
+        self._interactive_streak = 0
+
+        self._admitted = Counter()
+        self._rejected = Counter()
+        self._wait_total = Counter()
+        self._waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITIES}
+
+    def _fits(self, cost: ProcessingCost) -> bool:
+        if self._running >= self.max_concurrent:
+            return False
+        return self._running == 0 or self._memory_in_use + cost.memory_bytes <= self.memory_budget
+
+    def _under_user_cap(self, user_id) -> bool:
+        return (not self.user_max_concurrent or user_id is None
+                or self._running_by_user[user_id] < self.user_max_concurrent)
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._pending_seconds / max(1, self.max_concurrent)))
+
+    def _grant(self, cost: ProcessingCost, user_id):
+        self._running += 1
+        self._running_by_user[user_id] += 1
+        self._memory_in_use += cost.memory_bytes
+        self._pending_seconds += cost.cpu_seconds
+
+    def _class_order(self) -> tuple[str, ...]:
+        if self._waiting[PRIORITY_BULK] and self._interactive_streak >= self.interactive_weight:
+            return (PRIORITY_BULK, PRIORITY_INTERACTIVE)
+        return PRIORITIES
+
+    def _next_ticket(self) -> _Ticket | None:
+        """Picks the next ticket: by class order, then round-robin over users under their cap."""
+        for priority in self._class_order():
+            for user_id, tickets in self._queues[priority].items():
+                if self._under_user_cap(user_id):
+                    return tickets[0]
+        return None
+
+    def _dequeue(self, ticket: _Ticket):
+        queue = self._queues[ticket.priority]
+        tickets = queue.pop(ticket.user_id)
+        tickets.remove(ticket)
+        if tickets:
+            # Re-insert at the end so the user's next request waits for the other users
+            queue[ticket.user_id] = tickets
+        self._waiting[ticket.priority] -= 1
+
+    def _dispatch(self):
+        """Grants waiting tickets in scheduling order while they fit. Called with the lock held."""
+        granted = False
+        while True:
+            ticket = self._next_ticket()
+            # Stop at a ticket that does not fit, so large images are not overtaken indefinitely
+            if ticket is None or not self._fits(ticket.cost):
+                break
+            self._dequeue(ticket)
+            self._grant(ticket.cost, ticket.user_id)
+            self._interactive_streak = self._interactive_streak + 1 if ticket.priority == PRIORITY_INTERACTIVE else 0
+            ticket.granted = True
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _record_wait(self, priority: str, seconds: float):
+        self._admitted[priority] += 1
+        self._wait_total[priority] += seconds
+        self._waits[priority].append(seconds)
+
+    def assign_priority(self, user_id, requested: str = PRIORITY_INTERACTIVE) -> str:
+        """
+        Chooses the priority class of a client request. Clients may lower their requests to bulk,
+        but interactive is granted only while the user has fewer than user_interactive_burst
+        requests running or waiting, so uploading a whole book as interactive gains nothing.
+
+        Args:
+            user_id: The user the request is processed for.
+            requested (str): The priority the client asked for.
+
+        Returns:
+            str: PRIORITY_INTERACTIVE or PRIORITY_BULK.
+        """
+        if requested == PRIORITY_BULK or not self.user_interactive_burst or user_id is None:
+            return requested
+        with self._cond:
+            in_flight = self._running_by_user[user_id] + sum(
+                len(self._queues[priority].get(user_id, ())) for priority in PRIORITIES
+            )
+        return PRIORITY_INTERACTIVE if in_flight < self.user_interactive_burst else PRIORITY_BULK
+
+    def acquire(self, cost: ProcessingCost, user_id=None, priority: str = PRIORITY_INTERACTIVE):
+        """
+        Blocks until the request is scheduled and fits within the budget, and reserves its share.
+
+        Args:
+            cost (ProcessingCost): The estimated cost of the request.
+            user_id: The user the request is processed for, used for fair queuing and the
+                per-user cap. None exempts the request from the cap.
+            priority (str): PRIORITY_INTERACTIVE or PRIORITY_BULK.
+
+        Raises:
+            AdmissionRejected: If the wait queue is full or the wait times out.
+        """
+        with self._cond:
+            if not self._waiting.total() and self._fits(cost) and self._under_user_cap(user_id):
+                self._grant(cost, user_id)
+                self._interactive_streak = self._interactive_streak + 1 if priority == PRIORITY_INTERACTIVE else 0
+                self._record_wait(priority, 0.0)
+                return
+
+            if self._waiting[priority] >= self._queue_limits[priority]:
+                self._rejected[priority] += 1
+                raise AdmissionRejected(self._retry_after())
+
+            ticket = _Ticket(cost, user_id, priority)
+            self._queues[priority].setdefault(user_id, deque()).append(ticket)
+            self._waiting[priority] += 1
+            self._dispatch()
+
+            start = time.monotonic()
+            deadline = start + self._queue_timeouts[priority]
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._dequeue(ticket)
+                    self._rejected[priority] += 1
+                    # The removed ticket may have blocked smaller ones behind it
+                    self._dispatch()
+                    raise AdmissionRejected(self._retry_after())
+                self._cond.wait(remaining)
+            self._record_wait(priority, time.monotonic() - start)
+
+    def release(self, cost: ProcessingCost, user_id=None):
+        """Returns the share reserved by acquire() to the budget."""
+        with self._cond:
+            self._running -= 1
+            self._running_by_user[user_id] -= 1
+            if self._running_by_user[user_id] <= 0:
+                del self._running_by_user[user_id]
+            self._memory_in_use -= cost.memory_bytes
+            self._pending_seconds -= cost.cpu_seconds
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost: ProcessingCost, user_id=None, priority: str = PRIORITY_INTERACTIVE):
+        """
+        Holds the request's share of the budget while processing.
+
+        Args:
+            cost (ProcessingCost): The estimated cost of the request.
+            user_id: The user the request is processed for.
+            priority (str): PRIORITY_INTERACTIVE or PRIORITY_BULK.
+
+        Raises:
+            AdmissionRejected: If the wait queue is full or the wait times out.
+        """
+        self.acquire(cost, user_id, priority)
+        try:
+            yield
+        finally:
+            self.release(cost, user_id)
+
+    @asynccontextmanager
+    async def admit_async(self, cost: ProcessingCost, user_id=None, priority: str = PRIORITY_INTERACTIVE):
+        """
+        Async variant of admit(); the wait happens in a worker thread so the event loop is not blocked.
+        Work handed to an executor should be awaited with AdmissionSlot.run(), so the budget stays held
+        until the work has finished even if the request is cancelled while waiting for it.
+
+        Args:
+            cost (ProcessingCost): The estimated cost of the request.
+            user_id: The user the request is processed for.
+            priority (str): PRIORITY_INTERACTIVE or PRIORITY_BULK.
+
+        Raises:
+            AdmissionRejected: If the wait queue is full or the wait times out.
+        """
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self.acquire, cost, user_id, priority))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The worker thread keeps waiting for the budget; give back whatever it is granted.
+            def release_if_granted(task):
+                if not task.cancelled() and task.exception() is None:
+                    self.release(cost, user_id)
+
+            acquiring.add_done_callback(release_if_granted)
+            raise
+
+        slot = AdmissionSlot(self, cost, user_id)
+        try:
+            yield slot
+        finally:
+            slot.close()
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the current budget usage and the queue wait times per priority class."""
+        with self._cond:
+            classes = {}
+            for priority in PRIORITIES:
+                waits = sorted(self._waits[priority])
+                classes[priority] = {
+                    "waiting": self._waiting[priority],
+                    "admitted": self._admitted[priority],
+                    "rejected": self._rejected[priority],
+                    "mean_wait": self._wait_total[priority] / self._admitted[priority] if self._admitted[priority] else 0.0,
+                    "p50_wait": waits[len(waits) // 2] if waits else 0.0,
+                    "p95_wait": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                    "max_wait": waits[-1] if waits else 0.0,
+                }
+            return {
+                "running": self._running,
+                "waiting": self._waiting.total(),
+                "memory_in_use": self._memory_in_use,
+                "memory_budget": self.memory_budget,
+                "users_running": len(self._running_by_user),
+                "classes": classes,
+            }
+
+
+dewarp_admission = AdmissionController(
+    memory_budget=settings.DEWARP_MEMORY_BUDGET_MB * 1024 * 1024,
+    max_concurrent=settings.DEWARP_MAX_CONCURRENT,
+    max_queue=settings.DEWARP_MAX_QUEUE,
+    queue_timeout=settings.DEWARP_QUEUE_TIMEOUT,
+    user_max_concurrent=settings.DEWARP_USER_MAX_CONCURRENT,
+    max_bulk_queue=settings.DEWARP_MAX_BULK_QUEUE,
+    bulk_queue_timeout=settings.DEWARP_BULK_QUEUE_TIMEOUT,
+    interactive_weight=settings.DEWARP_INTERACTIVE_WEIGHT,
+    user_interactive_burst=settings.DEWARP_USER_INTERACTIVE_BURST,
+)
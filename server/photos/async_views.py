@@ -0,0 +1,287 @@
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.http import (
+    Http404,
+    HttpResponseForbidden,
+    HttpResponseNotFound,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.decorators import method_decorator
+from django.utils.http import content_disposition_header
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .admission import (
+    AdmissionRejected,
+    ImageTooLarge,
+    PRIORITIES,
+    PRIORITY_INTERACTIVE,
+    dewarp_admission,
+    estimate_render_cost,
+    plan_processing,
+    read_image_size,
+)
+from .executors import run_crypto, run_io, submit_dewarp, submit_preview
+from .dewarp_service import get_model_version
+from .models import EncryptedPhoto
+from .refinement import submit_refinement
+from .utils import generate_signed_url, verify_signed_url, get_user_key
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+async def _stream_chunks(data: bytes):
+    """Yields the image in STREAM_CHUNK_SIZE pieces so slow clients don't hold the whole body in one write."""
+    view = memoryview(data)
+    for start in range(0, len(view), STREAM_CHUNK_SIZE):
+        yield bytes(view[start:start + STREAM_CHUNK_SIZE])
+
+
+def _image_response(data: bytes, filename: str) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(_stream_chunks(data), content_type='image/jpeg')
+    response['Content-Length'] = str(len(data))
+    response['Content-Disposition'] = content_disposition_header(False, filename)
+    return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncPhotoView(View):
+    """
+    Base class for async photo endpoints.
+    Authenticates requests with the same JWT scheme as the DRF views.
+    """
+    authentication_required = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        if self.authentication_required:
+            try:
+                result = await sync_to_async(JWTAuthentication().authenticate)(request)
+            except AuthenticationFailed as e:
+                return self._unauthorized(str(e.detail))
+            if result is None:
+                return self._unauthorized("Authentication credentials were not provided.")
+            request.user = result[0]
+
+        return await super().dispatch(request, *args, **kwargs)
+
+    @staticmethod
+    def _unauthorized(detail: str) -> JsonResponse:
+        response = JsonResponse({"detail": detail}, status=status.HTTP_401_UNAUTHORIZED)
+        response['WWW-Authenticate'] = 'Bearer realm="api"'
+        return response
+
+
+class AsyncUploadEncryptedPhotoView(AsyncPhotoView):
+
+    async def post(self, request):
+        """
+        Async version of UploadEncryptedPhotoView.
+        Dewarping runs on the dewarp executor and encryption on the crypto executor.
+        Progressive uploads are refined in the background as in the sync view.
+
+        Returns:
+            - 201 Created: with signed URL and photo ID of the (first) page and the list of pages
+            - 400 Bad Request: if no file is uploaded or the format is not supported
+            - 413 Payload Too Large: if the image exceeds the processing limits
+            - 429 Too Many Requests: if image processing is saturated (with Retry-After)
+        """
+        files = await sync_to_async(lambda: request.FILES)()
+        uploaded_file = files.get('photo')
+        if not uploaded_file:
+            return JsonResponse({"detail": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+
+        size = await run_io(read_image_size, uploaded_file)
+        if size is None:
+            return JsonResponse({"detail": "Unsupported image format."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            cost = plan_processing(*size)
+        except ImageTooLarge as e:
+            return JsonResponse({"detail": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        data = await sync_to_async(lambda: request.POST)()
+        spread = str(data.get('spread', '')).lower() in ('1', 'true', 'yes')
+        priority = data.get('priority', PRIORITY_INTERACTIVE)
+        if priority not in PRIORITIES:
+            return JsonResponse({"detail": "Invalid priority."}, status=status.HTTP_400_BAD_REQUEST)
+        priority = dewarp_admission.assign_priority(request.user.id, priority)
+
+        progressive = str(data.get('progressive', settings.DEWARP_PROGRESSIVE)).lower() in ('1', 'true', 'yes')
+        progressive = progressive and not spread
+
+        fernet = await run_io(get_user_key, request.user.id)
+        image_data = await run_io(uploaded_file.read)
+
+        try:
+            if progressive:
+                # The preview skips inference: it reserves the share of a render, and the refinement
+                # takes the full dewarp cost later
+                preview_cost = estimate_render_cost(*size, cost.reduction)
+                async with dewarp_admission.admit_async(preview_cost, request.user.id, priority) as slot:
+                    pages = [await slot.run(submit_preview(image_data, cost.reduction))]
+            else:
+                async with dewarp_admission.admit_async(cost, request.user.id, priority) as slot:
+                    pages = await slot.run(submit_dewarp(image_data, cost.reduction, spread))
+        except AdmissionRejected as e:
+            response = JsonResponse(
+                {"detail": "Server is busy processing other photos. Try again later."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+            response['Retry-After'] = str(e.retry_after)
+            return response
+
+        spread_id = uuid.uuid4() if len(pages) > 1 else None
+        model_version = await run_io(get_model_version)
+        page_list = []
+
+        for page in pages:
+            original = page.original if page.original is not None else image_data
+            encrypted_data = await run_crypto(fernet.encrypt, page.image)
+            encrypted_original = await run_crypto(fernet.encrypt, original)
+            encrypted_field = await run_crypto(fernet.encrypt, page.field) if page.field else None
+
+            photo = await EncryptedPhoto.objects.acreate(
+                user=request.user,
+                file=None,
+                original_filename=uploaded_file.name,
+                model_version='' if progressive else model_version,
+                is_preview=progressive,
+                spread_id=spread_id,
+                page_side=page.side,
+                width=page.width,
+                height=page.height,
+                plain_size=len(page.image),
+                encrypted_size=len(encrypted_data),
+                processing_time=page.processing_time,
+                placeholder=page.placeholder,
+            )
+
+            filename = f"user_{request.user.id}_{photo.id}.enc"
+            await run_io(photo.file.save, filename, ContentFile(encrypted_data), False)
+            await run_io(photo.original_file.save, filename, ContentFile(encrypted_original), False)
+            if encrypted_field is not None:
+                await run_io(photo.deformation_file.save, filename, ContentFile(encrypted_field), False)
+            await photo.asave(update_fields=['file', 'original_file', 'deformation_file'])
+
+            if progressive:
+                submit_refinement(photo.id, request.user.id, cost, priority)
+
+            signed_url = generate_signed_url(photo.id)
+            page_list.append({
+                "processed_url": request.build_absolute_uri(signed_url),
+                "photo_id": photo.id,
+                "page_side": photo.page_side,
+                "version": photo.version,
+                "is_preview": photo.is_preview,
+            })
+
+        return JsonResponse({
+            "processed_url": page_list[0]["processed_url"],
+            "photo_id": page_list[0]["photo_id"],
+            "spread_id": str(spread_id) if spread_id else None,
+            "version": page_list[0]["version"],
+            "is_preview": page_list[0]["is_preview"],
+            "pages": page_list,
+        }, status=status.HTTP_201_CREATED)
+
+
+class AsyncViewDecryptedPhoto(AsyncPhotoView):
+
+    async def get(self, request, photo_id):
+        """
+        Async version of ViewDecryptedPhoto.
+
+        Returns:
+            - 200 OK: streamed decrypted image
+            - 404 Not Found: if image is missing or decryption fails
+        """
+        try:
+            photo = await EncryptedPhoto.objects.aget(id=photo_id, user=request.user)
+        except EncryptedPhoto.DoesNotExist:
+            raise Http404("Photo not found.")
+
+        fernet = await run_io(get_user_key, request.user.id)
+
+        try:
+            encrypted_data = await run_io(_read_file, photo.file.path)
+            decrypted_data = await run_crypto(fernet.decrypt, encrypted_data)
+        except Exception:
+            raise Http404("Could not decrypt the image.")
+
+        return _image_response(decrypted_data, photo.original_filename)
+
+
+class AsyncTemporaryDecryptedPhotoView(AsyncPhotoView):
+    """
+    Async version of TemporaryDecryptedPhotoView.
+    Does not require authentication.
+    """
+    authentication_required = False
+
+    async def get(self, request, signed_value):
+        photo_id = verify_signed_url(signed_value)
+        if photo_id is None:
+            return HttpResponseForbidden("Invalid or expired link.")
+
+        try:
+            photo = await EncryptedPhoto.objects.aget(id=photo_id)
+        except EncryptedPhoto.DoesNotExist:
+            return HttpResponseNotFound("Photo not found.")
+
+        fernet = await run_io(get_user_key, photo.user_id)
+
+        try:
+            encrypted_data = await run_io(_read_file, photo.file.path)
+            decrypted_data = await run_crypto(fernet.decrypt, encrypted_data)
+        except Exception:
+            return HttpResponseForbidden("Could not decrypt the image.")
+
+        return _image_response(decrypted_data, photo.original_filename)
+
+
+class AsyncListUserPhotosView(AsyncPhotoView):
+
+    async def get(self, request):
+        """
+        Async version of ListUserPhotosView.
+
+        Returns:
+            - 200 OK: A list of photo metadata and signed URLs
+        """
+        photo_list = []
+
+        async for photo in EncryptedPhoto.objects.filter(user=request.user):
+            signed_url = generate_signed_url(photo.id)
+            full_url = request.build_absolute_uri(signed_url)
+            photo_list.append({
+                "photo_id": photo.id,
+                "original_filename": photo.original_filename,
+                "processed_url": full_url,
+                "spread_id": str(photo.spread_id) if photo.spread_id else None,
+                "page_side": photo.page_side,
+                "width": photo.width,
+                "height": photo.height,
+                "plain_size": photo.plain_size,
+                "encrypted_size": photo.encrypted_size,
+                "processing_time": photo.processing_time,
+                "model_version": photo.model_version,
+                "placeholder": photo.placeholder,
+                "version": photo.version,
+                "is_preview": photo.is_preview,
+                "uploaded_at": photo.uploaded_at.isoformat(),
+            })
+
+        return JsonResponse(photo_list, safe=False, status=status.HTTP_200_OK)
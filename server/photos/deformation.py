@@ -0,0 +1,87 @@
+import io
+import zlib
+
+import cv2
+import numpy as np
+
+
+# Number of control points along the longer side of the stored field
+CONTROL_GRID_SIZE = 64
+
+
+def encode_field(inv_x: np.ndarray, inv_y: np.ndarray, grid_size: int = CONTROL_GRID_SIZE) -> bytes:
+    """
+    Compresses an inverse warp map into a resolution independent control grid.
+
+    The map is normalized to [0, 1] relative coordinates, downsampled so its longer
+    side has grid_size points and stored as zlib compressed float32.
+
+    Args:
+        inv_x (np.ndarray): Source x coordinate for every output pixel [H, W].
+        inv_y (np.ndarray): Source y coordinate for every output pixel [H, W].
+        grid_size (int): Number of control points along the longer side.
+
+    Returns:
+        bytes: The encoded field.
+    """
+    H, W = inv_x.shape
+    scale = grid_size / max(H, W)
+    grid_w, grid_h = max(2, round(W * scale)), max(2, round(H * scale))
+
+    field = np.stack([
+        cv2.resize((inv_x / max(W - 1, 1)).astype(np.float32), (grid_w, grid_h), interpolation=cv2.INTER_AREA),
+        cv2.resize((inv_y / max(H - 1, 1)).astype(np.float32), (grid_w, grid_h), interpolation=cv2.INTER_AREA),
+    ])
+
+    buffer = io.BytesIO()
+    np.savez(buffer, field=field, shape=np.array([H, W], dtype=np.int32))
+    return zlib.compress(buffer.getvalue(), level=9)
+
+
+def decode_field(data: bytes) -> tuple[np.ndarray, tuple[int, int]]:
+    """
+    Decodes a field produced by encode_field().
+
+    Args:
+        data (bytes): The encoded field.
+
+    Returns:
+        tuple[np.ndarray, tuple[int, int]]: The normalized control grid [2, h, w]
+            and the (H, W) shape of the image it was predicted for.
+    """
+    with np.load(io.BytesIO(zlib.decompress(data))) as archive:
+        H, W = archive["shape"]
+        return archive["field"], (int(H), int(W))
+
+
+def expand_field(field: np.ndarray, height: int, width: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Upsamples a normalized control grid into dense remap coordinates.
+
+    Args:
+        field (np.ndarray): The normalized control grid [2, h, w].
+        height (int): Height of the output image.
+        width (int): Width of the output image.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: float32 map_x and map_y for cv2.remap.
+    """
+    map_x = cv2.resize(field[0], (width, height), interpolation=cv2.INTER_LINEAR) * (width - 1)
+    map_y = cv2.resize(field[1], (width, height), interpolation=cv2.INTER_LINEAR) * (height - 1)
+    return map_x.astype(np.float32), map_y.astype(np.float32)
+
+
+def apply_field(image_cv: np.ndarray, field: np.ndarray) -> np.ndarray:
+    """
+    Dewarps an image of any resolution with a stored control grid.
+
+    Args:
+        image_cv (np.ndarray): The page image (grayscale).
+        field (np.ndarray): The normalized control grid [2, h, w].
+
+    Returns:
+        np.ndarray: The dewarped image.
+    """
+    H, W = image_cv.shape[:2]
+    map_x, map_y = expand_field(field, H, W)
+    return cv2.remap(image_cv, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
@@ -0,0 +1,247 @@
+import contextvars
+import hashlib
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+
+# This module must stay light: torch, scipy and cv2 are only imported by
+# photos.image_processing, which is loaded on the first call that needs it.
+
+# The training module (model classes and the model artifact format)
+AI_MODEL_SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_model", "src")
+
+_lock = threading.Lock()
+_image_processing = None
+_renderer = None
+_page_executor = None
+
+
+@dataclass
+class DewarpedPage:
+    """
+    One dewarped page of an upload.
+
+    Attributes:
+        image (bytes): The processed image.
+        field (bytes): The encoded deformation field.
+        original (bytes | None): The page cropped from the upload, or None if the page is the whole upload.
+        side (str): 'left' or 'right' for pages of a two-page spread, otherwise ''.
+        width (int | None): Width of the processed image in pixels.
+        height (int | None): Height of the processed image in pixels.
+        placeholder (str): Tiny preview of the processed image as a data URI.
+        processing_time (float | None): Seconds spent processing the page.
+    """
+    image: bytes
+    field: bytes
+    original: bytes | None = None
+    side: str = ''
+    width: int | None = None
+    height: int | None = None
+    placeholder: str = ''
+    processing_time: float | None = None
+
+
+def get_model_path() -> str:
+    """Returns the path of the dewarp model (DEWARP_MODEL_PATH)."""
+    from django.conf import settings
+    return str(settings.DEWARP_MODEL_PATH)
+
+
+def import_model_artifact():
+    """Imports ai_model/src/model_artifact.py (stdlib and NumPy only, torch is imported when a model is built)."""
+    if AI_MODEL_SRC not in sys.path:
+        sys.path.append(AI_MODEL_SRC)
+    import model_artifact
+    return model_artifact
+
+
+@lru_cache(maxsize=None)
+def get_model_version(model_path: str | None = None) -> str:
+    """
+    Identify the model weights: by the checksum in the header of a model artifact,
+    or by the SHA-256 of a legacy checkpoint file.
+
+    Args:
+        model_path (str | None): Path to the model, DEWARP_MODEL_PATH by default.
+
+    Returns:
+        str: The first 16 hex digits of the checksum.
+    """
+    model_path = model_path or get_model_path()
+    model_artifact = import_model_artifact()
+    if model_artifact.is_artifact(model_path):
+        metadata, _, _ = model_artifact.read_header(model_path)
+        return metadata["checksum"][:16]
+
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def get_image_processing():
+    """
+    Returns the process-wide ImageProcessing instance, loading the ML stack and the model on first use.
+
+    Returns:
+        ImageProcessing: The shared image processor.
+    """
+    global _image_processing
+    if _image_processing is None:
+        with _lock:
+            if _image_processing is None:
+                from django.conf import settings
+                from .image_processing import ImageProcessing
+                from .inference_scale import get_scale_policy
+                _image_processing = ImageProcessing(
+                    flat_threshold=settings.DEWARP_FLAT_THRESHOLD,
+                    homography_threshold=settings.DEWARP_HOMOGRAPHY_THRESHOLD,
+                    flat_precheck=settings.DEWARP_FLAT_PRECHECK,
+                    scale_policy=get_scale_policy(),
+                    optimize_model=settings.DEWARP_OPTIMIZE_MODEL,
+                )
+    return _image_processing
+
+
+def get_renderer():
+    """
+    Returns the process-wide ImageProcessing instance without a model, used for re-rendering stored fields.
+
+    Returns:
+        ImageProcessing: The shared renderer.
+    """
+    global _renderer
+    if _renderer is None:
+        with _lock:
+            if _renderer is None:
+                from .image_processing import ImageProcessing
+                _renderer = ImageProcessing(load_model=False)
+    return _renderer
+
+
+def _describe(page: DewarpedPage, start: float) -> DewarpedPage:
+    """Fills in the dimensions, placeholder and processing time of a processed page."""
+    from .admission import read_image_size
+    size = read_image_size(io.BytesIO(page.image))
+    if size is not None:
+        page.width, page.height = size
+    page.placeholder = get_renderer().placeholder(page.image)
+    page.processing_time = time.perf_counter() - start
+    return page
+
+
+def dewarp(uploaded_file, reduction: int = 1) -> DewarpedPage:
+    """
+    Dewarps an uploaded image with the shared image processor.
+
+    Args:
+        uploaded_file: The uploaded file object.
+        reduction (int): Decode the image at 1/reduction resolution (1, 2, 4 or 8).
+
+    Returns:
+        DewarpedPage: The processed image, the encoded deformation field and the page metadata.
+    """
+    start = time.perf_counter()
+    image, field = get_image_processing()(uploaded_file, reduction, return_field=True)
+    return _describe(DewarpedPage(image, field), start)
+
+
+def preview(uploaded_file, reduction: int = 1) -> DewarpedPage:
+    """
+    Builds a quick preview of an upload without inference (see ImageProcessing.preview()).
+    Uses the model-free renderer, so the model does not have to be loaded.
+
+    Args:
+        uploaded_file: The uploaded file object.
+        reduction (int): Decode the image at 1/reduction resolution (1, 2, 4 or 8).
+
+    Returns:
+        DewarpedPage: The preview image with an empty field, and the page metadata.
+    """
+    start = time.perf_counter()
+    renderer = get_renderer()
+    image = renderer.preview(renderer.decode(uploaded_file, reduction))
+    return _describe(DewarpedPage(image, b''), start)
+
+
+def _process_page(image_cv, side: str = '', original: bytes | None = None) -> DewarpedPage:
+    start = time.perf_counter()
+    image, field = get_image_processing().process(image_cv, return_field=True)
+    return _describe(DewarpedPage(image, field, original=original, side=side), start)
+
+
+def _get_page_executor() -> ThreadPoolExecutor:
+    global _page_executor
+    if _page_executor is None:
+        with _lock:
+            if _page_executor is None:
+                _page_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='photos-pages')
+    return _page_executor
+
+
+def dewarp_spread(uploaded_file, reduction: int = 1) -> list[DewarpedPage]:
+    """
+    Dewarps a photo of an open book. If a gutter is found the two pages are split
+    and dewarped concurrently (OpenCV and torch release the GIL), otherwise the
+    photo is processed as a single page.
+
+    Args:
+        uploaded_file: The uploaded file object.
+        reduction (int): Decode the image at 1/reduction resolution (1, 2, 4 or 8).
+
+    Returns:
+        list[DewarpedPage]: The left and right page, or a single page.
+    """
+    processor = get_image_processing()
+    image_cv = processor.decode(uploaded_file, reduction)
+    pages = processor.split_spread(image_cv)
+
+    if len(pages) == 1:
+        return [_process_page(image_cv)]
+
+    futures = [
+        # Run in a copy of the request context so a profiled request also samples the page threads
+        _get_page_executor().submit(contextvars.copy_context().run, _process_page, page, side, processor.encode(page))
+        for page, side in zip(pages, ('left', 'right'))
+    ]
+    return [future.result() for future in futures]
+
+
+def render(uploaded_file, field: bytes, scale: float = 0.4, reduction: int = 1, ext: str = '.jpg') -> bytes:
+    """
+    Re-renders a photo from its original and stored deformation field without inference.
+    See ImageProcessing.render() for the arguments.
+    """
+    return get_renderer().render(uploaded_file, field, scale=scale, reduction=reduction, ext=ext)
+
+
+def path_counts() -> dict:
+    """Returns how many images of this process took each processing path (full, homography, identity, precheck)."""
+    if _image_processing is None:
+        return {}
+    return _image_processing.path_counts()
+
+
+def is_loaded() -> bool:
+    """Returns True if the model has been loaded in this process."""
+    return _image_processing is not None
+
+
+def warm_up() -> float:
+    """
+    Loads the ML stack and the model and runs one small forward pass, so the first
+    request of a serving worker does not pay the cold start. Call it from the
+    worker start-up (e.g. a gunicorn post_fork hook) or enable DEWARP_WARM_UP.
+
+    Returns:
+        float: Seconds spent warming up.
+    """
+    start = time.perf_counter()
+    get_image_processing().warm_up()
+    return time.perf_counter() - start
@@ -0,0 +1,97 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+
+from django.conf import settings
+
+from . import dewarp_service
+
+
+def _dewarp_in_worker(data: bytes, reduction: int) -> dewarp_service.DewarpedPage:
+    """
+    Runs ImageProcessing on raw image bytes inside an executor worker.
+    The model is loaded once per worker and reused for later requests.
+
+    Args:
+        data (bytes): The uploaded image bytes.
+        reduction (int): Decode the image at 1/reduction resolution.
+
+    Returns:
+        DewarpedPage: The processed image, the encoded deformation field and the page metadata.
+    """
+    return dewarp_service.dewarp(io.BytesIO(data), reduction)
+
+
+def _dewarp_pages_in_worker(data: bytes, reduction: int, spread: bool) -> list[dewarp_service.DewarpedPage]:
+    """
+    Like _dewarp_in_worker(), but returns pages and optionally splits a two-page spread.
+    """
+    if spread:
+        return dewarp_service.dewarp_spread(io.BytesIO(data), reduction)
+    return [dewarp_service.dewarp(io.BytesIO(data), reduction)]
+
+
+def _preview_in_worker(data: bytes, reduction: int) -> dewarp_service.DewarpedPage:
+    """Builds the quick preview of raw image bytes inside an executor worker."""
+    return dewarp_service.preview(io.BytesIO(data), reduction)
+
+
+@lru_cache(maxsize=None)
+def get_dewarp_executor():
+    """
+    Returns the executor for CPU-bound dewarping.
+    A process pool (spawned, so forked torch state is never inherited) is used
+    when DEWARP_EXECUTOR is 'process', otherwise a thread pool.
+    """
+    if settings.DEWARP_EXECUTOR == 'process':
+        return ProcessPoolExecutor(
+            max_workers=settings.DEWARP_MAX_CONCURRENT,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return ThreadPoolExecutor(max_workers=settings.DEWARP_MAX_CONCURRENT, thread_name_prefix='photos-dewarp')
+
+
+@lru_cache(maxsize=None)
+def get_crypto_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool for encryption and decryption (OpenSSL releases the GIL)."""
+    return ThreadPoolExecutor(max_workers=settings.PHOTO_CRYPTO_THREADS, thread_name_prefix='photos-crypto')
+
+
+@lru_cache(maxsize=None)
+def get_io_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool for blocking file system I/O."""
+    return ThreadPoolExecutor(max_workers=settings.PHOTO_IO_THREADS, thread_name_prefix='photos-io')
+
+
+def submit_dewarp(data: bytes, reduction: int = 1, spread: bool = False) -> Future:
+    """Submits dewarping of image bytes to the dewarp executor."""
+    return get_dewarp_executor().submit(_dewarp_pages_in_worker, data, reduction, spread)
+
+
+def submit_preview(data: bytes, reduction: int = 1) -> Future:
+    """Submits the quick preview of image bytes to the dewarp executor."""
+    return get_dewarp_executor().submit(_preview_in_worker, data, reduction)
+
+
+async def run_dewarp(data: bytes, reduction: int = 1, spread: bool = False) -> list[dewarp_service.DewarpedPage]:
+    """Dewarps image bytes on the dewarp executor without blocking the event loop."""
+    return await asyncio.wrap_future(submit_dewarp(data, reduction, spread))
+
+
+async def run_preview(data: bytes, reduction: int = 1) -> dewarp_service.DewarpedPage:
+    """Builds the quick preview of image bytes on the dewarp executor."""
+    return await asyncio.wrap_future(submit_preview(data, reduction))
+
+
+async def run_crypto(func, *args):
+    """Runs an encryption or decryption call on the crypto executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_crypto_executor(), partial(func, *args))
+
+
+async def run_io(func, *args):
+    """Runs a blocking file system call on the I/O executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), partial(func, *args))
@@ -0,0 +1,191 @@
+import io
+import os
+import zipfile
+from collections import deque
+
+from .admission import read_jpeg_frame
+from .executors import get_crypto_executor
+
+# Resolution at which exported images are placed on PDF pages
+PDF_DPI = 150
+
+# PDF colour spaces by number of JPEG components
+PDF_COLOR_SPACES = {1: b'/DeviceGray', 3: b'/DeviceRGB', 4: b'/DeviceCMYK'}
+
+
+def _decrypt_file(path: str, fernet) -> bytes:
+    with open(path, 'rb') as f:
+        return fernet.decrypt(f.read())
+
+
+def iter_decrypted(photos, fernet, read_ahead: int = 2):
+    """
+    Decrypts photos in order while the caller consumes the previous ones.
+    At most read_ahead photos are decrypted ahead of the one being yielded, so memory
+    stays bounded regardless of the size of the library.
+
+    Args:
+        photos: Iterable of EncryptedPhoto.
+        fernet (Fernet): The owner's key.
+        read_ahead (int): Number of photos decrypted in advance on the crypto executor.
+
+    Yields:
+        tuple[EncryptedPhoto, bytes | None]: The photo and its decrypted image, or None if it could not be decrypted.
+    """
+    executor = get_crypto_executor()
+    pending = deque()
+
+    for photo in photos:
+        pending.append((photo, executor.submit(_decrypt_file, photo.file.path, fernet)))
+        if len(pending) > read_ahead:
+            yield _result(*pending.popleft())
+
+    while pending:
+        yield _result(*pending.popleft())
+
+
+def _result(photo, future):
+    try:
+        return photo, future.result()
+    except Exception:
+        return photo, None
+
+
+def export_filename(index: int, photo) -> str:
+    """Names an exported photo so archive order matches page order, e.g. '0007_scan_left.jpg'."""
+    stem = os.path.splitext(os.path.basename(photo.original_filename))[0] or f"photo_{photo.id}"
+    side = f"_{photo.page_side}" if photo.page_side else ''
+    return f"{index:04d}_{stem}{side}.jpg"
+
+
+class _StreamBuffer:
+    """Write-only file object that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(items):
+    """
+    Streams a ZIP archive of the decrypted photos. Entries are stored without compression
+    (JPEG data does not compress) and written with data descriptors, so no seeking is needed.
+
+    Args:
+        items: Iterable of (EncryptedPhoto, bytes | None), e.g. from iter_decrypted().
+
+    Yields:
+        bytes: Consecutive pieces of the archive.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for index, (photo, data) in enumerate(items, start=1):
+            if data is None:
+                continue
+            info = zipfile.ZipInfo(export_filename(index, photo), date_time=photo.uploaded_at.timetuple()[:6])
+            info.file_size = len(data)
+            with archive.open(info, 'w') as entry:
+                entry.write(data)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+class _PdfWriter:
+    """Minimal PDF writer that emits objects as soon as they are complete."""
+
+    # Object numbers reserved for the catalog and the page tree, which is written last
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self):
+        self.offsets = {}
+        self.position = 0
+        self.next_id = 3
+        self.page_ids = []
+
+    def _emit(self, data: bytes) -> bytes:
+        self.position += len(data)
+        return data
+
+    def header(self) -> bytes:
+        return self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def object(self, object_id: int, body: bytes, stream: bytes | None = None) -> bytes:
+        self.offsets[object_id] = self.position
+        data = b'%d 0 obj\n' % object_id + body
+        if stream is not None:
+            data += b'\nstream\n' + stream + b'\nendstream'
+        return self._emit(data + b'\nendobj\n')
+
+    def page(self, jpeg: bytes, width: int, height: int, components: int) -> bytes:
+        """Emits an image XObject, a content stream and a page showing the image at PDF_DPI."""
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        self.page_ids.append(page_id)
+
+        page_width = width * 72 / PDF_DPI
+        page_height = height * 72 / PDF_DPI
+        content = b'q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q' % (page_width, page_height)
+
+        return b''.join([
+            self.object(image_id, b'<< /Type /XObject /Subtype /Image /Width %d /Height %d '
+                                  b'/ColorSpace %s /BitsPerComponent 8 /Filter /DCTDecode /Length %d >>'
+                        % (width, height, PDF_COLOR_SPACES[components], len(jpeg)), jpeg),
+            self.object(content_id, b'<< /Length %d >>' % len(content), content),
+            self.object(page_id, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] '
+                                 b'/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>'
+                        % (self.PAGES, page_width, page_height, image_id, content_id)),
+        ])
+
+    def trailer(self) -> bytes:
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        data = self.object(self.PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.page_ids)))
+        data += self.object(self.CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES)
+
+        xref_offset = self.position
+        size = self.next_id
+        xref = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        for object_id in range(1, size):
+            xref.append(b'%010d 00000 n \n' % self.offsets[object_id])
+        xref.append(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                    % (size, self.CATALOG, xref_offset))
+        return data + self._emit(b''.join(xref))
+
+
+def stream_pdf(items):
+    """
+    Streams a multi-page PDF with one decrypted photo per page. The JPEG data is embedded
+    as is (DCTDecode), so pages are neither decoded nor re-encoded.
+
+    Args:
+        items: Iterable of (EncryptedPhoto, bytes | None), e.g. from iter_decrypted().
+
+    Yields:
+        bytes: Consecutive pieces of the document.
+    """
+    writer = _PdfWriter()
+    yield writer.header()
+    for _, data in items:
+        if data is None or not data.startswith(b'\xff\xd8'):
+            continue
+        frame = read_jpeg_frame(io.BytesIO(data[2:]))
+        if frame is None or frame[2] not in PDF_COLOR_SPACES:
+            continue
+        yield writer.page(data, *frame)
+    yield writer.trailer()
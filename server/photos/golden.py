@@ -0,0 +1,240 @@
+"""
+Golden-output harness for the dewarp pipeline.
+
+A golden corpus holds seeded DocumentImageGenerator pages with their ground-truth grids
+and the outputs of the reference pipeline for every stage (_find_page, _predict_offsets,
+the inverse map and the inverse warp). Alternative paths are run on the same pages and
+compared with the reference outputs and the ground truth. Used by `manage.py dewarp_golden`.
+"""
+import importlib
+import json
+import os
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+import torch
+from django.conf import settings
+
+from .deformation import apply_field, decode_field, encode_field
+from .image_processing import ImageProcessing
+
+MANIFEST = 'manifest.json'
+
+
+@dataclass
+class PathResult:
+    """Outputs of every pipeline stage for one page."""
+    page: np.ndarray
+    offsets: np.ndarray
+    inv_x: np.ndarray
+    inv_y: np.ndarray
+    output: np.ndarray
+
+
+class ReferencePath:
+    """The production pipeline stages of ImageProcessing, without the fast paths."""
+    name = 'reference'
+
+    def __init__(self, processor: ImageProcessing):
+        self.processor = processor
+
+    def find_page(self, image):
+        return self.processor._find_page(image)
+
+    def predict(self, page):
+        return self.processor._predict_offsets(page)
+
+    def invert(self, offsets, shape):
+        return self.processor._compute_inverse_map(offsets, shape)
+
+    def warp(self, page, inv_x, inv_y):
+        return self.processor._remap(page, inv_x, inv_y)
+
+    def run(self, image) -> PathResult:
+        page = self.find_page(image)
+        offsets = self.predict(page)
+        inv_x, inv_y = self.invert(offsets, page.shape)
+        return PathResult(page, offsets, inv_x, inv_y, self.warp(page, inv_x, inv_y))
+
+
+class ControlGridPath(ReferencePath):
+    """Warps through the compressed 64-point control grid stored per photo (the render endpoint)."""
+    name = 'control_grid'
+
+    def warp(self, page, inv_x, inv_y):
+        control_grid, _ = decode_field(encode_field(inv_x, inv_y))
+        return apply_field(page, control_grid)
+
+
+class OpenCVRemapPath(ReferencePath):
+    """Samples the inverse map with cv2.remap instead of scipy's map_coordinates."""
+    name = 'cv2_remap'
+
+    def warp(self, page, inv_x, inv_y):
+        return cv2.remap(page, inv_x.astype(np.float32), inv_y.astype(np.float32),
+                         interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+
+class FastPathsPath(ReferencePath):
+    """Takes the identity and homography shortcuts of ImageProcessing.process() when they apply."""
+    name = 'fast_paths'
+
+    def __init__(self, processor: ImageProcessing):
+        super().__init__(processor)
+        self._selector = ImageProcessing(load_model=False,
+                                         flat_threshold=settings.DEWARP_FLAT_THRESHOLD,
+                                         homography_threshold=settings.DEWARP_HOMOGRAPHY_THRESHOLD)
+
+    def run(self, image) -> PathResult:
+        page = self.find_page(image)
+        offsets = self.predict(page)
+        path, homography = self._selector._choose_warp_path(offsets)
+        if path == ImageProcessing.PATH_IDENTITY:
+            inv_x, inv_y = self._selector._identity_map(page.shape)
+            output = page.copy()
+        elif path == ImageProcessing.PATH_HOMOGRAPHY:
+            output, inv_x, inv_y = self._selector._warp_homography(page, homography)
+        else:
+            inv_x, inv_y = self.invert(offsets, page.shape)
+            output = self.warp(page, inv_x, inv_y)
+        return PathResult(page, offsets, inv_x, inv_y, output)
+
+
+class OptimizedModelPath(ReferencePath):
+    """Predicts with the inference-optimized model (DEWARP_OPTIMIZE_MODEL)."""
+    name = 'optimized_model'
+
+    def __init__(self, processor: ImageProcessing):
+        super().__init__(processor)
+        from unet_inference import optimize_for_inference
+        self._model = optimize_for_inference(processor._model)
+        self._device = processor._device
+
+    def predict(self, page):
+        image_tensor = torch.from_numpy(page.astype(np.float32) / 255.0).unsqueeze(0).unsqueeze(0).to(self._device)
+        with torch.inference_mode():
+            return self._model(image_tensor).squeeze(0).cpu().numpy()
+
+
+PATHS = {path.name: path for path in (ReferencePath, ControlGridPath, OpenCVRemapPath, FastPathsPath, OptimizedModelPath)}
+
+
+def load_path(name: str, processor: ImageProcessing):
+    """
+    Creates a pipeline path by registry name or from 'module:Class'. Custom classes take the
+    processor as their only argument and implement run() (usually by subclassing ReferencePath).
+    """
+    if name in PATHS:
+        return PATHS[name](processor)
+    module_name, _, attribute = name.partition(':')
+    if not attribute:
+        raise ValueError(f"Unknown path {name!r}, expected one of {', '.join(PATHS)} or 'module:Class'.")
+    return getattr(importlib.import_module(module_name), attribute)(processor)
+
+
+@dataclass
+class Tolerances:
+    """Acceptance limits for an alternative path."""
+    max_field_rmse: float = 0.5         # px, predicted coordinates against the reference
+    max_inverse_rmse: float = 1.0       # px, inverse map against the reference
+    min_psnr: float = 30.0              # dB, output image against the reference
+    min_ssim: float = 0.95              # output image against the reference
+    max_gt_error_increase: float = 0.1  # px, ground-truth grid error above the reference's
+
+
+def rmse(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.sqrt(np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)))
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    """Peak signal-to-noise ratio of two uint8 images in dB (inf for identical images)."""
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def ssim(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean structural similarity of two uint8 images (Gaussian window, sigma 1.5)."""
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    a, b = a.astype(np.float64), b.astype(np.float64)
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), 1.5)
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    covariance = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * covariance + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def grid_error(offsets: np.ndarray, grid_x: np.ndarray, grid_y: np.ndarray) -> float:
+    """RMS distance in pixels between predicted coordinates and the ground-truth grid."""
+    return float(np.sqrt(np.mean((offsets[0] - grid_x) ** 2 + (offsets[1] - grid_y) ** 2)))
+
+
+def compare(case: dict, result: PathResult) -> dict:
+    """
+    Compares a path's outputs for one page with the stored reference outputs and ground truth.
+
+    Args:
+        case (dict): A golden case as loaded by load_case().
+        result (PathResult): The outputs of the path under test.
+
+    Returns:
+        dict: The metrics of the page.
+    """
+    return {
+        'page_psnr': psnr(result.page, case['page']),
+        'field_rmse': rmse(result.offsets, case['offsets']),
+        'inverse_rmse': rmse(np.stack([result.inv_x, result.inv_y]), np.stack([case['inv_x'], case['inv_y']])),
+        'psnr': psnr(result.output, case['output']),
+        'ssim': ssim(result.output, case['output']),
+        'gt_error': grid_error(result.offsets, case['grid_x'], case['grid_y']),
+        'reference_gt_error': grid_error(case['offsets'], case['grid_x'], case['grid_y']),
+    }
+
+
+def failures(metrics: dict, tolerances: Tolerances) -> list[str]:
+    """Returns a description of every tolerance the metrics of a page exceed."""
+    failed = []
+    if metrics['field_rmse'] > tolerances.max_field_rmse:
+        failed.append(f"field RMSE {metrics['field_rmse']:.3f}px > {tolerances.max_field_rmse}px")
+    if metrics['inverse_rmse'] > tolerances.max_inverse_rmse:
+        failed.append(f"inverse map RMSE {metrics['inverse_rmse']:.3f}px > {tolerances.max_inverse_rmse}px")
+    if metrics['psnr'] < tolerances.min_psnr:
+        failed.append(f"PSNR {metrics['psnr']:.2f}dB < {tolerances.min_psnr}dB")
+    if metrics['ssim'] < tolerances.min_ssim:
+        failed.append(f"SSIM {metrics['ssim']:.4f} < {tolerances.min_ssim}")
+    increase = metrics['gt_error'] - metrics['reference_gt_error']
+    if increase > tolerances.max_gt_error_increase:
+        failed.append(f"ground-truth error +{increase:.3f}px > {tolerances.max_gt_error_increase}px")
+    return failed
+
+
+def save_case(directory: str, index: int, image: np.ndarray, grid_x: np.ndarray, grid_y: np.ndarray,
+              result: PathResult):
+    """Stores a generator page, its ground truth and the reference outputs."""
+    np.savez_compressed(
+        os.path.join(directory, f'case_{index:04d}.npz'),
+        image=image, grid_x=grid_x, grid_y=grid_y,
+        page=result.page, offsets=result.offsets.astype(np.float32),
+        inv_x=result.inv_x.astype(np.float32), inv_y=result.inv_y.astype(np.float32),
+        output=result.output,
+    )
+
+
+def load_case(directory: str, index: int) -> dict:
+    with np.load(os.path.join(directory, f'case_{index:04d}.npz')) as data:
+        return {key: data[key] for key in data.files}
+
+
+def write_manifest(directory: str, manifest: dict):
+    with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -8,6 +8,10 @@ Date: 2025-06-20
 Description: This module processes an uploaded grayscale image using a neural network model to predict offsets and applies inverse warping to the image.
 """
 
+import base64
+import threading
+from collections import Counter
+
 import cv2
 import numpy as np
 import torch
@@ -15,54 +19,327 @@ import torch.nn.functional as F
 from scipy.ndimage import map_coordinates
 from scipy.interpolate import griddata
 
-import sys
-sys.path.append("./ai_model/src")
-from unet_flexible import UNetFlexible
+from .deformation import apply_field, decode_field, encode_field
+from .dewarp_service import get_model_path, get_model_version, import_model_artifact
+from .profiling import current_profile, forward_pass_gate
 
 class ImageProcessing:
-    def __init__(self):
+    _REDUCED_DECODE_FLAGS = {
+        1: cv2.IMREAD_GRAYSCALE,
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+    }
+
+    # Paths taken by __call__, reported by path_counts()
+    PATH_FULL = "full"
+    PATH_HOMOGRAPHY = "homography"
+    PATH_IDENTITY = "identity"
+    PATH_PRECHECK = "precheck"
+
+    def __init__(self,
+                 load_model: bool = True,
+                 flat_threshold: float = 0.0,
+                 homography_threshold: float = 0.0,
+                 flat_precheck: bool = False,
+                 scale_policy=None,
+                 optimize_model: bool = False):
+        """
+        Args:
+            load_model (bool): Load the neural network. Not needed for render().
+            flat_threshold (float): RMS deviation (pixels at inference scale) of the predicted
+                field from identity below which the inverse warp is skipped. 0 disables it.
+            homography_threshold (float): RMS residual (pixels) of a global homography fitted to
+                the predicted field below which a perspective warp replaces the inverse warp. 0 disables it.
+            flat_precheck (bool): Skip inference when the detected page outline is a straight-edged
+                quadrilateral and correct it with a homography instead.
+            scale_policy: Callable (image_size, page_size) -> inference scale, e.g.
+                photos.inference_scale.InferenceScalePolicy. None uses a fixed scale of 0.4.
+            optimize_model (bool): Run the inference-optimized model (folded BatchNorm, no identity
+                interpolations, see ai_model/src/unet_inference.py) instead of the trained one.
+        """
+        self._flat_threshold = flat_threshold
+        self._scale_policy = scale_policy
+        self._homography_threshold = homography_threshold
+        self._flat_precheck = flat_precheck
+        self._path_counts = Counter()
+        self._path_lock = threading.Lock()
+
         self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self._model = UNetFlexible()
-        self._model.load_state_dict(torch.load("./ai_model/models/unet_deform_best_train.pth", map_location=self._device))
-        self._model.to(self._device)
-        self._model.eval()
+        self.model_version = get_model_version()
+        self.model_metadata = {}
+        if not load_model:
+            self._model = None
+            return
+
+        # Artifacts are memory-mapped and name their architecture, legacy .pth files hold a UNetFlexible state_dict
+        self._model, self.model_metadata = import_model_artifact().load_model(get_model_path(), self._device)
+        if optimize_model:
+            from unet_inference import optimize_for_inference
+            self._model = optimize_for_inference(self._model)
+
+    @property
+    def device(self) -> str:
+        """The device the model runs on."""
+        return str(self._device)
+
+    def warm_up(self):
+        """
+        Run a forward pass on a small blank image to initialize kernels and allocator pools.
+        """
+        if self._model is not None:
+            self._predict_offsets(np.zeros((64, 64), dtype=np.uint8))
 
-    def __call__(self, uploaded_file):
+    def __call__(self, uploaded_file, reduction: int = 1, return_field: bool = False):
         """
         Process the uploaded grayscale image using a neural network and inverse warping.
 
         Args:
             uploaded_file: The uploaded file object.
+            reduction (int): Decode the image at 1/reduction resolution (1, 2, 4 or 8).
+            return_field (bool): Also return the encoded deformation field (see photos.deformation).
         
         Returns:
             bytes: The processed image in bytes format.
+            If return_field is True, a tuple of the image bytes and the encoded field.
         """
-        image_cv = self._convert_to_cv(uploaded_file)
+        image_cv = self._convert_to_cv(uploaded_file, reduction)
         # image_cv = cv2.imread("./ai_model/src/assets/generated_image_example_2.png", cv2.IMREAD_GRAYSCALE)
 
-        image_cv = self._find_page(image_cv)
+        return self.process(image_cv, return_field)
+
+    def decode(self, uploaded_file, reduction: int = 1):
+        """
+        Decode the uploaded file to a grayscale OpenCV image.
+
+        Args:
+            uploaded_file: The uploaded file object.
+            reduction (int): Decode the image at 1/reduction resolution (1, 2, 4 or 8).
+
+        Returns:
+            np.ndarray: The grayscale image.
+        """
+        return self._convert_to_cv(uploaded_file, reduction)
+
+    def encode(self, image_cv, ext: str = '.jpg'):
+        """
+        Encode an OpenCV image, e.g. a page cropped by split_spread().
+
+        Args:
+            image_cv (np.ndarray): The image.
+            ext (str): Image format extension.
+
+        Returns:
+            bytes: The encoded image.
+        """
+        return self._convert_to_bytes(image_cv, ext)
+
+    def placeholder(self, image_bytes: bytes, max_side: int = 16) -> str:
+        """
+        Build a tiny blurred preview that clients can show while the full image loads.
+
+        Args:
+            image_bytes (bytes): The encoded image.
+            max_side (int): Size in pixels of the longer side of the preview.
+
+        Returns:
+            str: A PNG data URI of a few hundred bytes.
+        """
+        image_cv = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        h, w = image_cv.shape[:2]
+        ratio = max_side / max(h, w)
+        size = (max(1, round(w * ratio)), max(1, round(h * ratio)))
+        tiny = cv2.resize(image_cv, size, interpolation=cv2.INTER_AREA)
+        data = cv2.imencode('.png', tiny, [cv2.IMWRITE_PNG_COMPRESSION, 9])[1].tobytes()
+        return "data:image/png;base64," + base64.b64encode(data).decode('ascii')
+
+    def preview(self, image_cv, scale: float = 0.4, min_fill: float = 0.9):
+        """
+        Cheap stand-in for process(), without inference: the page found by _find_page(),
+        perspective-corrected when its outline is roughly a quadrilateral.
+
+        Args:
+            image_cv (np.ndarray): The grayscale image.
+            scale (float): Output scale, the same as the default inference scale.
+            min_fill (float): Minimal ratio between contour and quadrilateral area, looser than
+                for the flat pre-check because the preview tolerates curved edges.
+
+        Returns:
+            bytes: The preview image in bytes format.
+        """
+        image_cv, page_contour = self._find_page(image_cv, return_contour=True)
+        page_quad = self._page_quad(page_contour, image_cv.shape, min_fill=min_fill)
+
+        image_cv = cv2.resize(image_cv, dsize=None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if page_quad is not None:
+            H, W = image_cv.shape[:2]
+            homography = self._quad_to_rect_homography(page_quad * scale)
+            image_cv = cv2.warpPerspective(image_cv, homography, (W, H), flags=cv2.INTER_LINEAR,
+                                           borderMode=cv2.BORDER_REFLECT)
+
+        return self._convert_to_bytes(image_cv)
+
+    def process(self, image_cv, return_field: bool = False):
+        """
+        Find the page in a decoded grayscale image and dewarp it.
+
+        Args:
+            image_cv (np.ndarray): The grayscale image.
+            return_field (bool): Also return the encoded deformation field (see photos.deformation).
+
+        Returns:
+            bytes: The processed image in bytes format.
+            If return_field is True, a tuple of the image bytes and the encoded field.
+        """
+        profile = current_profile()
+        if profile is not None:
+            profile.join_current_thread()
+            decoded_shape = image_cv.shape
+
+        image_cv, page_contour = self._find_page(image_cv, return_contour=True)
+        page_quad = self._page_quad(page_contour, image_cv.shape) if self._flat_precheck else None
+        scale = self._choose_scale(image_cv.shape, page_contour)
 
         image_cv = cv2.resize(image_cv, 
                                    dsize=None, 
-                                   fx=0.4, 
-                                   fy=0.4, 
+                                   fx=scale, 
+                                   fy=scale, 
                                    interpolation=cv2.INTER_LINEAR)
 
+        if page_quad is not None:
+            path = self.PATH_PRECHECK
+            homography = self._quad_to_rect_homography(page_quad * scale)
+            image_cv, inv_x, inv_y = self._warp_homography(image_cv, homography)
+        else:
+            offsets = self._predict_offsets(image_cv)
+            path, homography = self._choose_warp_path(offsets)
+
+            if path == self.PATH_IDENTITY:
+                inv_x, inv_y = self._identity_map(image_cv.shape)
+            elif path == self.PATH_HOMOGRAPHY:
+                image_cv, inv_x, inv_y = self._warp_homography(image_cv, homography)
+            else:
+                inv_x, inv_y = self._compute_inverse_map(offsets, image_cv.shape)
+                image_cv = self._remap(image_cv, inv_x, inv_y)
+
+        with self._path_lock:
+            self._path_counts[path] += 1
+
+        if profile is not None:
+            profile.record_image(
+                width=decoded_shape[1], height=decoded_shape[0],
+                inference_width=image_cv.shape[1], inference_height=image_cv.shape[0],
+                scale=scale, path=path,
+            )
+
+        if return_field:
+            return self._convert_to_bytes(image_cv), encode_field(inv_x, inv_y)
+        return self._convert_to_bytes(image_cv)
+
+    def infer(self, image_cv):
+        """
+        Run the model and invert its prediction on an already scaled page image.
+
+        Args:
+            image_cv (np.ndarray): The grayscale image at inference resolution.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The predicted coordinates [2, H, W]
+                and the inverse map (inv_x, inv_y).
+        """
         offsets = self._predict_offsets(image_cv)
+        inv_x, inv_y = self._compute_inverse_map(offsets, image_cv.shape)
+        return offsets, inv_x, inv_y
 
-        image_cv = self._apply_inverse_warp(image_cv, offsets)
+    def split_spread(self, image_cv, min_depth: float = 12.0):
+        """
+        Split a photo of an open book into its left and right page at the gutter.
 
-        return self._convert_to_bytes(image_cv)
+        The gutter is the darkest column (spine shadow) in the central band of the
+        image. The photo is treated as a spread only if that column is clearly darker
+        than the pages on both sides.
+
+        Args:
+            image_cv (np.ndarray): The grayscale image.
+            min_depth (float): Minimal intensity difference between the pages and the gutter.
+
+        Returns:
+            list[np.ndarray]: [left, right] page images, or [image_cv] if no gutter was found.
+        """
+        gutter = self._find_gutter(image_cv, min_depth)
+        if gutter is None:
+            return [image_cv]
+        return [image_cv[:, :gutter], image_cv[:, gutter:]]
+
+    def _find_gutter(self, image_cv, min_depth: float):
+        """
+        Return the x coordinate of the gutter between two pages, or None.
+        """
+        H, W = image_cv.shape[:2]
+        scale = min(1.0, 512 / W)
+        small = cv2.resize(image_cv, dsize=None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        # Ignore the top and bottom margins, where the background dominates
+        h, w = small.shape[:2]
+        profile = small[h // 5:h - h // 5].mean(axis=0)
+
+        lo, hi = int(0.35 * w), int(0.65 * w)
+        col = lo + int(np.argmin(profile[lo:hi]))
+
+        left_page = np.median(profile[int(0.15 * w):lo])
+        right_page = np.median(profile[hi:int(0.85 * w)])
+        if min(left_page, right_page) - profile[col] < min_depth:
+            return None
+
+        return int(round(col / scale))
+
+    def path_counts(self) -> dict:
+        """
+        Returns how many images took each processing path (full, homography, identity, precheck).
+        """
+        with self._path_lock:
+            return dict(self._path_counts)
+
+    def render(self, uploaded_file, field: bytes, scale: float = 0.4, reduction: int = 1, ext: str = '.jpg'):
+        """
+        Re-render a photo from its original and a stored deformation field, without running the model.
+
+        Args:
+            uploaded_file: The original uploaded file object.
+            field (bytes): The encoded field returned by __call__(..., return_field=True).
+            scale (float): Scale of the output relative to the page in the original.
+            reduction (int): Decode the image at 1/reduction resolution (1, 2, 4 or 8).
+            ext (str): Output image format extension, e.g. '.jpg', '.png' or '.webp'.
+
+        Returns:
+            bytes: The re-rendered image in bytes format.
+        """
+        image_cv = self._convert_to_cv(uploaded_file, reduction)
+        image_cv = self._find_page(image_cv)
+
+        scale *= reduction
+        if scale != 1:
+            image_cv = cv2.resize(image_cv,
+                                  dsize=None,
+                                  fx=scale,
+                                  fy=scale,
+                                  interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+
+        control_grid, _ = decode_field(field)
+        return self._convert_to_bytes(apply_field(image_cv, control_grid), ext)
     
-    def _find_page(self, image_cv):
+    def _find_page(self, image_cv, return_contour: bool = False):
         """ 
         Process the image to find the page and return the processed image.
 
         Args:
             image_cv: The input image in OpenCV format (grayscale).
+            return_contour (bool): Also return the contour of the page.
 
         Returns:
             image_cv: The processed image with target page.
+            If return_contour is True, a tuple of the image and the page contour.
         """
         image_cv = cv2.GaussianBlur(image_cv, (3, 3), 0.9)
 
@@ -133,7 +410,114 @@ class ImageProcessing:
         cv2.drawContours(mask, [largest_contour], -1, 255, thickness=cv2.FILLED)
         image_cv = cv2.bitwise_and(image_cv, mask)
 
+        if return_contour:
+            return image_cv, largest_contour
         return image_cv
+
+    def _choose_scale(self, shape, page_contour):
+        """
+        Choose the inference scale from the image and detected page size (fixed 0.4 without a scale policy).
+        """
+        if self._scale_policy is None:
+            return 0.4
+        _, _, page_width, page_height = cv2.boundingRect(page_contour)
+        return self._scale_policy((shape[1], shape[0]), (page_width, page_height))
+
+    def _page_quad(self, contour, shape, min_fill: float = 0.98, max_coverage: float = 0.95):
+        """
+        Return the page corners if the outline is a quadrilateral with straight edges.
+
+        Curved pages bulge or sag along their edges, so the contour fills its 4-point
+        approximation noticeably less (or more) than a flat sheet does. Pages touching
+        the frame border give no evidence about their edges and are rejected.
+
+        Args:
+            contour: The page contour.
+            shape: Shape of the image.
+            min_fill (float): Minimal ratio between contour and quadrilateral area.
+            max_coverage (float): Maximal ratio between quadrilateral and image area.
+
+        Returns:
+            np.ndarray | None: The [4, 2] float32 corners (tl, tr, br, bl) or None.
+        """
+        perimeter = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.02 * perimeter, True)
+        if len(approx) != 4 or not cv2.isContourConvex(approx):
+            return None
+
+        quad_area = cv2.contourArea(approx)
+        if quad_area == 0 or quad_area > max_coverage * shape[0] * shape[1]:
+            return None
+
+        fill = cv2.contourArea(contour) / quad_area
+        if not min_fill <= fill <= 1 / min_fill:
+            return None
+
+        points = approx.reshape(4, 2).astype(np.float32)
+        sums = points.sum(axis=1)
+        diffs = np.diff(points, axis=1).ravel()
+        return np.array([points[np.argmin(sums)], points[np.argmin(diffs)],
+                         points[np.argmax(sums)], points[np.argmax(diffs)]], dtype=np.float32)
+
+    def _quad_to_rect_homography(self, quad):
+        """Homography mapping the page corners onto their axis-aligned bounding rectangle."""
+        x0, y0 = quad.min(axis=0)
+        x1, y1 = quad.max(axis=0)
+        rect = np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float32)
+        return cv2.getPerspectiveTransform(quad, rect)
+
+    def _choose_warp_path(self, offsets, step: int = 8):
+        """
+        Measure how far the predicted field is from identity and from a global homography.
+
+        Args:
+            offsets (np.ndarray): The predicted absolute coordinates [2, H, W].
+            step (int): Sampling step of the field in pixels.
+
+        Returns:
+            tuple[str, np.ndarray | None]: The processing path and the fitted homography.
+        """
+        _, H, W = offsets.shape
+        grid_y, grid_x = np.mgrid[0:H:step, 0:W:step]
+        src = np.stack([grid_x.ravel(), grid_y.ravel()], axis=-1).astype(np.float32)
+        dst = np.stack([offsets[0, ::step, ::step].ravel(), offsets[1, ::step, ::step].ravel()], axis=-1).astype(np.float32)
+
+        if self._flat_threshold > 0:
+            deviation = np.sqrt(np.mean(np.sum((dst - src) ** 2, axis=1)))
+            if deviation < self._flat_threshold:
+                return self.PATH_IDENTITY, None
+
+        if self._homography_threshold > 0 and len(src) >= 4:
+            homography, _ = cv2.findHomography(src, dst, 0)
+            if homography is not None:
+                projected = cv2.perspectiveTransform(src.reshape(-1, 1, 2), homography).reshape(-1, 2)
+                residual = np.sqrt(np.mean(np.sum((projected - dst) ** 2, axis=1)))
+                if residual < self._homography_threshold:
+                    return self.PATH_HOMOGRAPHY, homography
+
+        return self.PATH_FULL, None
+
+    def _identity_map(self, shape):
+        H, W = shape[:2]
+        inv_y, inv_x = np.mgrid[0:H, 0:W].astype(np.float32)
+        return inv_x, inv_y
+
+    def _warp_homography(self, image_cv, homography):
+        """
+        Correct the image with a global homography (forward: source pixel -> flat page).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: The warped image and its inverse map.
+        """
+        H, W = image_cv.shape[:2]
+        warped = cv2.warpPerspective(image_cv, homography, (W, H), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+
+        inv_x, inv_y = self._identity_map(image_cv.shape)
+        points = np.stack([inv_x.ravel(), inv_y.ravel()], axis=-1).reshape(-1, 1, 2)
+        source = cv2.perspectiveTransform(points, np.linalg.inv(homography)).reshape(H, W, 2)
+        inv_x = np.clip(source[..., 0], 0, W - 1)
+        inv_y = np.clip(source[..., 1], 0, H - 1)
+        return warped, inv_x, inv_y
     
     def _extend_line(self, x1, y1, x2, y2, extension_length=200):
         # 1. Compute direction vector
@@ -167,7 +551,20 @@ class ImageProcessing:
             torch.Tensor: The predicted offsets as a tensor.
         """
         image_tensor = torch.from_numpy(image_cv.astype(np.float32)/255.0).unsqueeze(0).unsqueeze(0).float().to(self._device)
-        predicted_offsets = self._model(image_tensor)
+        profile = current_profile()
+        # No autograd graph: activations are freed as soon as the next layer has consumed them
+        with torch.inference_mode():
+            if profile is not None:
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if self._device.type == 'cuda':
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                with forward_pass_gate.trace():
+                    with torch.profiler.profile(activities=activities, record_shapes=True) as torch_profile:
+                        predicted_offsets = self._model(image_tensor)
+                    torch_profile.export_chrome_trace(profile.trace_path('torch'))
+            else:
+                with forward_pass_gate.forward():
+                    predicted_offsets = self._model(image_tensor)
         return predicted_offsets.squeeze(0).cpu().detach().numpy()  # [2, H, W] - absolute target coordinates
 
     def _apply_inverse_warp(self, image_cv, offsets):
@@ -181,35 +578,56 @@ class ImageProcessing:
         Returns:
             np.ndarray: The dewarped image.
         """
-        H, W = image_cv.shape
+        inv_x, inv_y = self._compute_inverse_map(offsets, image_cv.shape)
+        return self._remap(image_cv, inv_x, inv_y)
+
+    def _compute_inverse_map(self, offsets, shape):
+        """
+        Invert the predicted forward coordinates into a source coordinate for every output pixel.
+
+        Args:
+            offsets (np.ndarray): The predicted absolute coordinates [2, H, W].
+            shape (tuple): The (H, W) shape of the image.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: inv_x and inv_y [H, W].
+        """
+        H, W = shape[:2]
         map_x, map_y = offsets[0], offsets[1]
 
         src_y, src_x = np.meshgrid(np.arange(H), np.arange(W), indexing='ij')
-        src_y = src_y.ravel()
-        src_x = src_x.ravel()
         target_y = map_y.ravel()
         target_x = map_x.ravel()
 
         grid_y, grid_x = np.mgrid[0:H, 0:W]
 
-        inv_y = griddata(
-            points=np.vstack((target_y, target_x)).T,
-            values=src_y,
-            xi=(grid_y, grid_x),
-            method='linear',
-            fill_value=0
-        )
-        inv_x = griddata(
+        # Interpolate both source coordinates over a single triangulation
+        inv = griddata(
             points=np.vstack((target_y, target_x)).T,
-            values=src_x,
+            values=np.stack([src_y.ravel(), src_x.ravel()], axis=-1),
             xi=(grid_y, grid_x),
             method='linear',
             fill_value=0
         )
 
-        inv_y = np.clip(inv_y, 0, H - 1)
-        inv_x = np.clip(inv_x, 0, W - 1)
+        inv_y = np.clip(inv[..., 0], 0, H - 1)
+        inv_x = np.clip(inv[..., 1], 0, W - 1)
+
+        return inv_x, inv_y
+
+    def _remap(self, image_cv, inv_x, inv_y):
+        """
+        Sample the image at the inverse map coordinates.
+
+        Args:
+            image_cv (np.ndarray): The input grayscale image.
+            inv_x (np.ndarray): Source x coordinate for every output pixel [H, W].
+            inv_y (np.ndarray): Source y coordinate for every output pixel [H, W].
 
+        Returns:
+            np.ndarray: The dewarped image.
+        """
+        H, W = image_cv.shape
         coords = np.vstack([inv_y.ravel(), inv_x.ravel()])
         warped = map_coordinates(image_cv, coords, order=1, mode='reflect')
         warped = warped.reshape(H, W).astype(np.uint8)
@@ -217,27 +635,29 @@ class ImageProcessing:
         return warped
 
 
-    def _convert_to_cv(self, uploaded_file):
+    def _convert_to_cv(self, uploaded_file, reduction: int = 1):
         """ 
         Convert the uploaded file to a grayscale OpenCV image.
 
         Args:
             uploaded_file: The uploaded file object.
+            reduction (int): Decode the image at 1/reduction resolution (1, 2, 4 or 8).
 
         Returns:
             np.ndarray: The grayscale image in OpenCV format.
         """
-        file_bytes = np.asarray(bytearray(uploaded_file.read()), dtype=np.uint8)
-        return cv2.imdecode(file_bytes, cv2.IMREAD_GRAYSCALE)
+        file_bytes = np.frombuffer(uploaded_file.read(), dtype=np.uint8)
+        return cv2.imdecode(file_bytes, self._REDUCED_DECODE_FLAGS[reduction])
 
-    def _convert_to_bytes(self, image):
+    def _convert_to_bytes(self, image, ext: str = '.jpg'):
         """
         Convert the OpenCV image to bytes format.
 
         Args:
             image: The OpenCV image in BGR format.
+            ext (str): Image format extension.
 
         Returns:
             bytes: The image in bytes format.
         """
-        return cv2.imencode('.jpg', image)[1].tobytes()
\ No newline at end of file
+        return cv2.imencode(ext, image)[1].tobytes()
\ No newline at end of file
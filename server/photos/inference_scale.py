@@ -0,0 +1,146 @@
+import json
+import math
+import os
+from functools import lru_cache
+
+from django.conf import settings
+
+
+# Scale used when adaptive inference resolution is disabled
+DEFAULT_SCALE = 0.4
+
+# Latency model used when no calibration table is available (seconds per inference pixel)
+DEFAULT_SECONDS_PER_PIXEL = 1.5e-6
+
+
+class InferenceScalePolicy:
+    """
+    Chooses the resize factor applied before the model forward pass.
+
+    The scale aims for the page width the model works best at, and is capped so the
+    predicted latency of the model and the inverse warp stays within the latency SLO.
+    Both come from a calibration table built offline with `manage.py calibrate_dewarp`.
+    """
+
+    def __init__(self,
+                 latency_slo: float,
+                 target_page_width: float,
+                 entries: list[dict] | None = None,
+                 min_scale: float = 0.05,
+                 max_scale: float = 1.0,
+                 quality_tolerance: float = 0.1):
+        """
+        Args:
+            latency_slo (float): Latency budget in seconds for inference and inverse warp.
+            target_page_width (float): Page width in pixels at inference, used without calibration.
+            entries (list[dict] | None): Calibration entries with 'pixels', 'seconds',
+                'page_width' and 'error_px' keys.
+            min_scale (float): Smallest allowed scale.
+            max_scale (float): Largest allowed scale.
+            quality_tolerance (float): Relative error above the best calibrated error that is
+                accepted when choosing the target page width.
+        """
+        self.latency_slo = latency_slo
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self._entries = sorted(entries or [], key=lambda entry: entry['pixels'])
+
+        self.target_page_width = target_page_width
+        if self._entries:
+            best_error = min(entry['error_px'] for entry in self._entries)
+            acceptable = [entry['page_width'] for entry in self._entries
+                          if entry['error_px'] <= best_error * (1 + quality_tolerance)]
+            self.target_page_width = min(acceptable)
+
+        self.max_pixels = self._pixels_for_latency(latency_slo)
+
+    @classmethod
+    def load(cls, path: str, latency_slo: float, target_page_width: float, **kwargs):
+        """
+        Creates a policy from a calibration file, or an uncalibrated one if the file does not exist.
+
+        Args:
+            path (str): Path to the calibration JSON written by calibrate_dewarp.
+            latency_slo (float): Latency budget in seconds.
+            target_page_width (float): Fallback page width at inference.
+
+        Returns:
+            InferenceScalePolicy: The policy.
+        """
+        entries = None
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)['entries']
+        return cls(latency_slo, target_page_width, entries, **kwargs)
+
+    def predict_latency(self, pixels: float) -> float:
+        """
+        Predicts the latency of inference and inverse warp for an image with the given pixel count,
+        interpolating the calibration table linearly (and extrapolating from its ends).
+        """
+        if len(self._entries) < 2:
+            rate = (self._entries[0]['seconds'] / self._entries[0]['pixels']
+                    if self._entries else DEFAULT_SECONDS_PER_PIXEL)
+            return pixels * rate
+
+        for lower, upper in zip(self._entries, self._entries[1:]):
+            if pixels <= upper['pixels']:
+                break
+        slope = (upper['seconds'] - lower['seconds']) / max(upper['pixels'] - lower['pixels'], 1)
+        return max(0.0, lower['seconds'] + (pixels - lower['pixels']) * slope)
+
+    def _pixels_for_latency(self, seconds: float) -> float:
+        """Inverts predict_latency() by bisection (latency grows with the pixel count)."""
+        low, high = 0.0, 1.0
+        while self.predict_latency(high) < seconds and high < 1e10:
+            high *= 2
+        for _ in range(60):
+            middle = (low + high) / 2
+            if self.predict_latency(middle) <= seconds:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def max_scale_for(self, width: int, height: int) -> float:
+        """Largest scale for an image of this size that fits the latency SLO."""
+        latency_scale = math.sqrt(self.max_pixels / max(width * height, 1))
+        return max(self.min_scale, min(self.max_scale, latency_scale))
+
+    def __call__(self, image_size: tuple[int, int], page_size: tuple[int, int]) -> float:
+        """
+        Chooses the inference scale for one image.
+
+        Args:
+            image_size (tuple[int, int]): (width, height) of the image fed to the model after scaling.
+            page_size (tuple[int, int]): (width, height) of the detected page.
+
+        Returns:
+            float: The scale factor.
+        """
+        quality_scale = self.target_page_width / max(page_size[0], 1)
+        return max(self.min_scale, min(quality_scale, self.max_scale_for(*image_size)))
+
+
+@lru_cache(maxsize=None)
+def get_scale_policy() -> InferenceScalePolicy | None:
+    """
+    Returns the policy configured in settings, or None if adaptive inference resolution is disabled.
+    """
+    if not settings.DEWARP_ADAPTIVE_SCALE:
+        return None
+    return InferenceScalePolicy.load(
+        settings.DEWARP_CALIBRATION_PATH,
+        latency_slo=settings.DEWARP_LATENCY_SLO,
+        target_page_width=settings.DEWARP_TARGET_PAGE_WIDTH,
+    )
+
+
+def max_inference_scale(width: int, height: int) -> float:
+    """
+    Upper bound of the scale used for an image of this size, for cost estimates made before decoding.
+    """
+    policy = get_scale_policy()
+    if policy is None:
+        return DEFAULT_SCALE
+    return policy.max_scale_for(width, height)
@@ -0,0 +1,97 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from photos import dewarp_service
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the latency/quality calibration table used by adaptive inference resolution. "
+        "Runs the model and inverse warp at several scales on DocumentImageGenerator pages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=float, nargs='+', default=[0.25, 0.5, 0.75, 1.0, 1.25, 1.5],
+                            help="Scales relative to the generator's training resolution.")
+        parser.add_argument('--batches', type=int, default=3,
+                            help="Number of generator batches (documents) to measure.")
+        parser.add_argument('--image-scale', type=float,
+                            help="Generator image scale the model was trained at (default: from the model artifact, or 0.45).")
+        parser.add_argument('--text', default='./ai_model/src/assets/text.txt',
+                            help="Word list for the generator.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=settings.DEWARP_CALIBRATION_PATH)
+
+    def handle(self, *args, **options):
+        import cv2
+        import numpy as np
+
+        processor = dewarp_service.get_image_processing()
+        processor.warm_up()
+        if options['image_scale'] is None:
+            options['image_scale'] = processor.model_metadata.get('input_scale') or 0.45
+
+        # ai_model/src is on sys.path once the model is loaded (see dewarp_service.import_model_artifact)
+        from data_generator import DocumentImageGenerator
+
+        generator = DocumentImageGenerator(options['text'])
+        generator.set_seed(options['seed'])
+
+        measurements = {scale: [] for scale in options['scales']}
+
+        for batch in range(options['batches']):
+            generator.regenerate_data(image_scale=options['image_scale'])
+
+            for image, (x_grid, y_grid) in zip(generator.get_images(), generator.get_grids()):
+                image = (image * 255).astype(np.uint8)
+                base_h, base_w = image.shape
+                _, _, page_width, _ = cv2.boundingRect(cv2.findNonZero((image > 25).astype(np.uint8)))
+
+                for scale in options['scales']:
+                    scaled = cv2.resize(image, dsize=None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+
+                    start = time.perf_counter()
+                    offsets, _, _ = processor.infer(scaled)
+                    seconds = time.perf_counter() - start
+
+                    # Compare with the ground truth at the training resolution
+                    pred_x = cv2.resize(offsets[0], (base_w, base_h), interpolation=cv2.INTER_LINEAR) / scale
+                    pred_y = cv2.resize(offsets[1], (base_w, base_h), interpolation=cv2.INTER_LINEAR) / scale
+                    error = float(np.sqrt(np.mean((pred_x - x_grid) ** 2 + (pred_y - y_grid) ** 2)))
+
+                    measurements[scale].append({
+                        'pixels': scaled.shape[0] * scaled.shape[1],
+                        'page_width': page_width * scale,
+                        'seconds': seconds,
+                        'error_px': error,
+                    })
+                    self.stdout.write(f"batch {batch + 1}, scale {scale:.2f}: {seconds:.3f}s, error {error:.2f}px")
+
+        entries = []
+        for scale, samples in measurements.items():
+            if not samples:
+                continue
+            entry = {key: float(np.mean([sample[key] for sample in samples]))
+                     for key in ('pixels', 'page_width', 'seconds', 'error_px')}
+            entry['scale'] = scale
+            entries.append(entry)
+
+        os.makedirs(os.path.dirname(options['output']) or '.', exist_ok=True)
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump({
+                'model_version': dewarp_service.get_model_version(),
+                'device': processor.device,
+                'image_scale': options['image_scale'],
+                'entries': entries,
+            }, f, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f"Calibration table written to {options['output']}"))
+        for entry in entries:
+            self.stdout.write(
+                f"scale {entry['scale']:.2f}: {entry['pixels'] / 1e6:.2f} MP, page {entry['page_width']:.0f}px, "
+                f"{entry['seconds']:.3f}s, error {entry['error_px']:.2f}px"
+            )
@@ -0,0 +1,159 @@
+import json
+import math
+import os
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from photos import dewarp_service
+
+
+class Command(BaseCommand):
+    help = (
+        "Record the reference dewarp outputs on seeded DocumentImageGenerator pages, or compare "
+        "an alternative path (e.g. an optimized model or warp) against them within tolerances."
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+
+        record = subparsers.add_parser('record', help="Generate the corpus and store the reference outputs.")
+        record.add_argument('directory', help="Directory of the golden corpus.")
+        record.add_argument('--batches', type=int, default=3,
+                            help="Number of generator batches (documents) to record.")
+        record.add_argument('--image-scale', type=float,
+                            help="Generator image scale the model was trained at (default: from the model artifact, or 0.45).")
+        record.add_argument('--text', default='./ai_model/src/assets/text.txt',
+                            help="Word list for the generator.")
+        record.add_argument('--seed', type=int, default=42)
+
+        compare = subparsers.add_parser('compare', help="Run a path on the corpus and check it against the reference.")
+        compare.add_argument('directory', help="Directory of the golden corpus.")
+        compare.add_argument('--path', default='reference',
+                             help="Registered path name (see photos.golden.PATHS) or 'module:Class'.")
+        compare.add_argument('--max-field-rmse', type=float, default=0.5)
+        compare.add_argument('--max-inverse-rmse', type=float, default=1.0)
+        compare.add_argument('--min-psnr', type=float, default=30.0)
+        compare.add_argument('--min-ssim', type=float, default=0.95)
+        compare.add_argument('--max-gt-error-increase', type=float, default=0.1)
+        compare.add_argument('--report', help="Write the per-page metrics to this JSON file.")
+
+    def handle(self, *args, **options):
+        processor = dewarp_service.get_image_processing()
+        processor.warm_up()
+        if options.get('image_scale') is None:
+            options['image_scale'] = processor.model_metadata.get('input_scale') or 0.45
+
+        # Imported after the model is loaded, which also puts ai_model/src on sys.path
+        from photos import golden
+
+        if options['action'] == 'record':
+            self._record(golden, processor, options)
+        else:
+            self._compare(golden, processor, options)
+
+    def _record(self, golden, processor, options):
+        import numpy as np
+        from data_generator import DocumentImageGenerator
+
+        directory = options['directory']
+        os.makedirs(directory, exist_ok=True)
+
+        generator = DocumentImageGenerator(options['text'])
+        generator.set_seed(options['seed'])
+        reference = golden.ReferencePath(processor)
+
+        count = 0
+        for batch in range(options['batches']):
+            generator.regenerate_data(image_scale=options['image_scale'])
+
+            for image, (x_grid, y_grid) in zip(generator.get_images(), generator.get_grids()):
+                image = (image * 255).astype(np.uint8)
+                result = reference.run(image)
+                golden.save_case(directory, count, image, x_grid.astype(np.float32), y_grid.astype(np.float32), result)
+                error = golden.grid_error(result.offsets, x_grid, y_grid)
+                self.stdout.write(f"batch {batch + 1}, case {count}: ground-truth error {error:.2f}px")
+                count += 1
+
+        golden.write_manifest(directory, {
+            'model_version': dewarp_service.get_model_version(),
+            'device': processor.device,
+            'seed': options['seed'],
+            'image_scale': options['image_scale'],
+            'batches': options['batches'],
+            'cases': count,
+        })
+        self.stdout.write(self.style.SUCCESS(f"Recorded {count} reference cases in {directory}"))
+
+    def _compare(self, golden, processor, options):
+        import numpy as np
+
+        directory = options['directory']
+        try:
+            manifest = golden.read_manifest(directory)
+        except FileNotFoundError:
+            raise CommandError(f"No golden corpus in {directory}, run 'dewarp_golden record' first.")
+
+        if manifest['model_version'] != dewarp_service.get_model_version():
+            self.stderr.write(self.style.WARNING(
+                f"The corpus was recorded with model {manifest['model_version']}, "
+                f"the loaded model is {dewarp_service.get_model_version()}."
+            ))
+
+        try:
+            path = golden.load_path(options['path'], processor)
+        except (ValueError, ImportError, AttributeError) as e:
+            raise CommandError(str(e))
+
+        tolerances = golden.Tolerances(
+            max_field_rmse=options['max_field_rmse'],
+            max_inverse_rmse=options['max_inverse_rmse'],
+            min_psnr=options['min_psnr'],
+            min_ssim=options['min_ssim'],
+            max_gt_error_increase=options['max_gt_error_increase'],
+        )
+
+        pages = []
+        failed_pages = 0
+        for index in range(manifest['cases']):
+            case = golden.load_case(directory, index)
+            metrics = golden.compare(case, path.run(case['image']))
+            failed = golden.failures(metrics, tolerances)
+            pages.append({'case': index, **metrics, 'failures': failed})
+
+            status = self.style.ERROR('FAIL') if failed else 'ok'
+            self.stdout.write(
+                f"case {index}: field {metrics['field_rmse']:.3f}px, inverse {metrics['inverse_rmse']:.3f}px, "
+                f"PSNR {metrics['psnr']:.2f}dB, SSIM {metrics['ssim']:.4f}, "
+                f"ground truth {metrics['gt_error']:.2f}px (reference {metrics['reference_gt_error']:.2f}px) {status}"
+            )
+            for failure in failed:
+                self.stdout.write(f"    {failure}")
+            failed_pages += bool(failed)
+
+        summary = {
+            key: float(np.mean([page[key] for page in pages]))
+            for key in ('field_rmse', 'inverse_rmse', 'ssim', 'gt_error', 'reference_gt_error')
+        }
+        # Identical outputs have an infinite PSNR, report the worst page instead of the mean
+        summary['min_psnr'] = min(page['psnr'] for page in pages)
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as f:
+                json.dump({
+                    'path': options['path'],
+                    'manifest': manifest,
+                    'tolerances': asdict(tolerances),
+                    'summary': {k: (None if math.isinf(v) else v) for k, v in summary.items()},
+                    'pages': [{k: (None if isinstance(v, float) and math.isinf(v) else v) for k, v in page.items()}
+                              for page in pages],
+                }, f, indent=2)
+
+        self.stdout.write(
+            f"{options['path']}: field {summary['field_rmse']:.3f}px, inverse {summary['inverse_rmse']:.3f}px, "
+            f"min PSNR {summary['min_psnr']:.2f}dB, SSIM {summary['ssim']:.4f}, "
+            f"ground truth {summary['gt_error']:.2f}px (reference {summary['reference_gt_error']:.2f}px)"
+        )
+        if failed_pages:
+            raise CommandError(f"{failed_pages} of {len(pages)} pages exceed the tolerances.")
+        self.stdout.write(self.style.SUCCESS(f"All {len(pages)} pages within tolerances."))
@@ -0,0 +1,323 @@
+import glob
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+OPERATIONS = ('upload', 'list', 'fetch')
+
+
+@dataclass
+class Sample:
+    """One request made by a load test client."""
+    operation: str
+    status: int
+    latency: float
+    error: str = ''
+    stages: dict = field(default_factory=dict)
+
+
+def percentile(values: list, q: float) -> float:
+    """Returns the q-th percentile (0-100) of values by the nearest-rank method."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def parse_server_timing(header: str) -> dict:
+    """Parses 'name;dur=12.3, other;dur=4' into {'name': 0.0123, 'other': 0.004} (seconds)."""
+    stages = {}
+    for entry in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, _, params = entry.partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                stages[name] = float(value) / 1000
+    return stages
+
+
+class Client:
+    """A simulated mobile client with its own account, issuing requests against the photo API."""
+
+    def __init__(self, base_url: str, images: list[bytes], timeout: float, progressive: bool, seed: int):
+        self.base_url = base_url.rstrip('/')
+        self.images = images
+        self.timeout = timeout
+        self.progressive = progressive
+        self.random = random.Random(seed)
+        self.token = None
+        self.photo_urls = []
+
+    def _request(self, method: str, path: str, body: bytes | None = None, headers: dict | None = None,
+                 url: str | None = None):
+        request = urllib.request.Request(url or self.base_url + path, data=body, method=method, headers=headers or {})
+        if self.token and url is None:
+            request.add_header('Authorization', f'Bearer {self.token}')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers.get('Server-Timing', '')
+
+    def _json(self, method: str, path: str, payload: dict):
+        status, body, _ = self._request(method, path, json.dumps(payload).encode(),
+                                        {'Content-Type': 'application/json'})
+        return status, json.loads(body or b'{}')
+
+    def sign_up(self):
+        """Registers a fresh account and logs in."""
+        email = f"loadtest-{uuid.uuid4().hex[:12]}@example.com"
+        password = uuid.uuid4().hex
+        status, body = self._json('POST', '/api/register/',
+                                  {'email': email, 'password': password, 'password2': password})
+        if status != 201:
+            raise CommandError(f"Registration failed ({status}): {body}")
+        status, body = self._json('POST', '/api/login/', {'email': email, 'password': password})
+        if status != 200:
+            raise CommandError(f"Login failed ({status}): {body}")
+        self.token = body['access']
+
+    def run(self, operation: str) -> Sample:
+        """Performs one operation and measures it."""
+        if operation == 'fetch' and not self.photo_urls:
+            operation = 'upload'
+        start = time.perf_counter()
+        try:
+            status, body, timing = getattr(self, f'_{operation}')()
+            error = '' if 200 <= status < 300 else body[:200].decode(errors='replace')
+        except (OSError, ValueError) as e:
+            status, timing, error = 0, '', str(e)
+        return Sample(operation, status, time.perf_counter() - start, error, parse_server_timing(timing))
+
+    def _upload(self):
+        boundary = uuid.uuid4().hex
+        fields = [(b'progressive', b'true' if self.progressive else b'false')]
+        body = b''.join(
+            b'--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (boundary.encode(), name, value)
+            for name, value in fields
+        )
+        body += (b'--%s\r\nContent-Disposition: form-data; name="photo"; filename="page.jpg"\r\n'
+                 b'Content-Type: image/jpeg\r\n\r\n' % boundary.encode())
+        body += self.random.choice(self.images) + b'\r\n--%s--\r\n' % boundary.encode()
+
+        status, response, timing = self._request(
+            'POST', '/api/photos/upload-photo/', body,
+            {'Content-Type': f'multipart/form-data; boundary={boundary}'},
+        )
+        if status == 201:
+            self.photo_urls.append(json.loads(response)['processed_url'])
+        return status, response, timing
+
+    def _list(self):
+        status, response, timing = self._request('GET', '/api/photos/user-photos/')
+        if status == 200:
+            # Signed URLs expire, so fetches use the ones from the latest listing
+            self.photo_urls = [photo['processed_url'] for photo in json.loads(response)] or self.photo_urls
+        return status, response, timing
+
+    def _fetch(self):
+        return self._request('GET', '', url=self.random.choice(self.photo_urls))
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the photo API with concurrent clients mixing uploads, listings and image fetches. "
+        "Reports throughput, latency percentiles, error rates and server-side stage timings. "
+        "Run it with DJANGO_SETTINGS_MODULE=config.settings_loadtest."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000.")
+        parser.add_argument('--serve', action='store_true',
+                            help="Start a throwaway server (runserver with config.settings_loadtest) for the run.")
+        parser.add_argument('--port', type=int, default=0, help="Port for --serve (default: a free port).")
+        parser.add_argument('--clients', type=int, default=8, help="Number of concurrent clients.")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run.")
+        parser.add_argument('--mix', default='upload=1,list=3,fetch=6',
+                            help="Relative weights of the operations.")
+        parser.add_argument('--images', nargs='+',
+                            default=sorted(glob.glob(os.path.join(settings.BASE_DIR, 'ai_model', 'src', 'assets', '*.jpg'))),
+                            help="JPEG files to upload.")
+        parser.add_argument('--progressive', action='store_true', help="Send progressive uploads.")
+        parser.add_argument('--timeout', type=float, default=120, help="Per-request timeout in seconds.")
+        parser.add_argument('--no-warm-up', action='store_false', dest='warm_up',
+                            help="Do not make an untimed upload (which loads the model) before the run.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Also write the report as JSON to this file.")
+
+    def handle(self, *args, **options):
+        if bool(options['url']) == options['serve']:
+            raise CommandError("Pass either --url or --serve.")
+        if options['clients'] < 1:
+            raise CommandError("--clients must be at least 1.")
+        weights = self._parse_mix(options['mix'])
+        images = []
+        for path in options['images']:
+            with open(path, 'rb') as f:
+                images.append(f.read())
+        if not images:
+            raise CommandError("No images to upload, pass --images.")
+
+        server = None
+        base_url = options['url']
+        try:
+            if options['serve']:
+                server, base_url = self._start_server(options['port'])
+
+            clients = [Client(base_url, images, options['timeout'], options['progressive'], options['seed'] + i)
+                       for i in range(options['clients'])]
+            for client in clients:
+                client.sign_up()
+            if options['warm_up']:
+                warm_up = clients[0].run('upload')
+                self.stdout.write(f"Warm-up upload: {warm_up.status} in {warm_up.latency:.2f}s")
+
+            samples, elapsed = self._run(clients, weights, options['duration'])
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+        report = self._report(samples, elapsed, options)
+        self._print(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+
+    def _parse_mix(self, mix: str) -> dict:
+        weights = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            if name.strip() not in OPERATIONS:
+                raise CommandError(f"Unknown operation {name!r} in --mix, expected {', '.join(OPERATIONS)}.")
+            weights[name.strip()] = float(weight or 1)
+        return weights
+
+    def _start_server(self, port: int):
+        """Migrates a fresh load test database and starts runserver on it."""
+        if not port:
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+
+        env = dict(os.environ)
+        env['DJANGO_SETTINGS_MODULE'] = 'config.settings_loadtest'
+        env['LOADTEST_DIR'] = tempfile.mkdtemp(prefix='bookscanner-loadtest-')
+        manage = os.path.join(settings.BASE_DIR, 'manage.py')
+        self.stdout.write(f"Load test data in {env['LOADTEST_DIR']}")
+
+        subprocess.run([sys.executable, manage, 'migrate', '--noinput', '-v', '0'],
+                       cwd=settings.BASE_DIR, env=env, check=True)
+        server = subprocess.Popen([sys.executable, manage, 'runserver', '--noreload', f'127.0.0.1:{port}'],
+                                  cwd=settings.BASE_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server, f'http://127.0.0.1:{port}'
+            except OSError:
+                if server.poll() is not None:
+                    break
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("The load test server did not start.")
+
+    def _run(self, clients: list[Client], weights: dict, duration: float):
+        samples = []
+        lock = threading.Lock()
+        operations, operation_weights = list(weights), list(weights.values())
+        start = time.perf_counter()
+        deadline = start + duration
+
+        def work(client):
+            while time.perf_counter() < deadline:
+                operation = client.random.choices(operations, operation_weights)[0]
+                sample = client.run(operation)
+                with lock:
+                    samples.append(sample)
+
+        threads = [threading.Thread(target=work, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - start
+
+    def _report(self, samples: list[Sample], elapsed: float, options: dict) -> dict:
+        by_operation = defaultdict(list)
+        for sample in samples:
+            by_operation[sample.operation].append(sample)
+
+        operations = {}
+        for operation, group in by_operation.items():
+            latencies = [sample.latency for sample in group]
+            errors = [sample for sample in group if not 200 <= sample.status < 300]
+            stages = defaultdict(list)
+            for sample in group:
+                for stage, seconds in sample.stages.items():
+                    stages[stage].append(seconds)
+
+            operations[operation] = {
+                'requests': len(group),
+                'throughput': len(group) / elapsed,
+                'error_rate': len(errors) / len(group),
+                'statuses': {str(status): sum(1 for s in group if s.status == status)
+                             for status in sorted({s.status for s in group})},
+                'latency': {
+                    'mean': sum(latencies) / len(latencies),
+                    'p50': percentile(latencies, 50),
+                    'p90': percentile(latencies, 90),
+                    'p99': percentile(latencies, 99),
+                    'max': max(latencies),
+                },
+                'stages': {
+                    stage: {'mean': sum(values) / len(values), 'p95': percentile(values, 95)}
+                    for stage, values in stages.items()
+                },
+                'sample_errors': sorted({sample.error for sample in errors if sample.error})[:5],
+            }
+
+        return {
+            'clients': options['clients'],
+            'duration': elapsed,
+            'requests': len(samples),
+            'throughput': len(samples) / elapsed if elapsed else 0.0,
+            'operations': operations,
+        }
+
+    def _print(self, report: dict):
+        self.stdout.write(f"\n{report['requests']} requests from {report['clients']} clients in "
+                          f"{report['duration']:.1f}s ({report['throughput']:.1f} req/s)\n")
+        self.stdout.write(f"{'operation':<10}{'requests':>10}{'req/s':>9}{'errors':>9}"
+                          f"{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for operation, stats in sorted(report['operations'].items()):
+            latency = stats['latency']
+            self.stdout.write(
+                f"{operation:<10}{stats['requests']:>10}{stats['throughput']:>9.2f}{stats['error_rate']:>9.1%}"
+                f"{latency['p50']:>9.3f}{latency['p90']:>9.3f}{latency['p99']:>9.3f}{latency['max']:>9.3f}"
+            )
+
+        self.stdout.write("\nServer-side stages (mean / p95 seconds):")
+        for operation, stats in sorted(report['operations'].items()):
+            stages = ', '.join(f"{stage} {values['mean']:.3f}/{values['p95']:.3f}"
+                               for stage, values in stats['stages'].items())
+            self.stdout.write(f"  {operation:<8} {stages or '-'}")
+            for error in stats['sample_errors']:
+                self.stdout.write(self.style.WARNING(f"    {error}"))
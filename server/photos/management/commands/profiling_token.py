@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from photos.profiling import PROFILE_HEADER, generate_profiling_token
+
+
+class Command(BaseCommand):
+    help = "Print a signed header value that enables profiling of a staff user's photo requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist.")
+        if not user.is_staff:
+            raise CommandError("Profiling is only available to staff users.")
+        if not settings.PHOTOS_PROFILING:
+            self.stderr.write("PHOTOS_PROFILING is disabled, the token has no effect until it is enabled.")
+
+        self.stdout.write(f"{PROFILE_HEADER}: {generate_profiling_token(user.id)}")
+        self.stderr.write(f"Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds.")
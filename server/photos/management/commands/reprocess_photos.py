@@ -0,0 +1,196 @@
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from photos.admission import (
+    AdmissionRejected,
+    ImageTooLarge,
+    PRIORITY_BULK,
+    dewarp_admission,
+    plan_processing,
+    read_image_size,
+)
+from photos.executors import _dewarp_in_worker
+from photos.dewarp_service import get_model_version
+from photos.models import EncryptedPhoto
+from photos.refinement import store_processed
+from photos.utils import get_user_key
+
+
+class IOThrottle:
+    """Limits the average rate of bytes read and written by the command."""
+
+    def __init__(self, bytes_per_second: float):
+        self._rate = bytes_per_second
+        self._start = time.monotonic()
+        self._transferred = 0
+
+    def __call__(self, num_bytes: int):
+        if self._rate <= 0:
+            return
+        self._transferred += num_bytes
+        expected = self._transferred / self._rate
+        elapsed = time.monotonic() - self._start
+        if expected > elapsed:
+            time.sleep(expected - elapsed)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-run the dewarp pipeline over stored photos whose model_version differs "
+        "from the current model. Requires the encrypted original kept at upload time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help="Only reprocess photos of this user ID (repeatable).")
+        parser.add_argument('--photo', type=int, action='append', dest='photos',
+                            help="Only reprocess this photo ID (repeatable).")
+        parser.add_argument('--force', action='store_true',
+                            help="Reprocess photos even if they already use the current model.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Number of worker processes (default: number of CPUs). The command "
+                                 "applies its own DEWARP_MAX_CONCURRENT and memory budget on top, which "
+                                 "cap how many photos it processes at once; the server's budget is "
+                                 "separate.")
+        parser.add_argument('--io-limit', type=float, default=0,
+                            help="Maximum file I/O in MB/s (default: unlimited).")
+        parser.add_argument('--checkpoint', default=os.path.join(settings.MEDIA_ROOT, 'reprocess_checkpoint.json'),
+                            help="Checkpoint file used to resume an interrupted run.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report which photos would be reprocessed.")
+
+    def handle(self, *args, **options):
+        model_version = get_model_version()
+        checkpoint_path = options['checkpoint']
+        done = self._load_checkpoint(checkpoint_path, model_version)
+
+        queryset = EncryptedPhoto.objects.exclude(original_file='').order_by('id')
+        if options['users']:
+            queryset = queryset.filter(user_id__in=options['users'])
+        if options['photos']:
+            queryset = queryset.filter(id__in=options['photos'])
+        if not options['force']:
+            queryset = queryset.exclude(model_version=model_version)
+
+        photo_ids = [photo_id for photo_id in queryset.values_list('id', flat=True) if photo_id not in done]
+        skipped = EncryptedPhoto.objects.filter(original_file='').count()
+
+        self.stdout.write(f"Model version: {model_version}")
+        self.stdout.write(f"Photos to reprocess: {len(photo_ids)} ({len(done)} already done in checkpoint)")
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"{skipped} photos have no stored original and cannot be reprocessed."))
+        if options['dry_run'] or not photo_ids:
+            return
+
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        throttle = IOThrottle(options['io_limit'] * 1024 * 1024)
+        max_in_flight = options['workers'] * 2
+        failed = 0
+
+        with ProcessPoolExecutor(max_workers=options['workers'],
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            pending = {}
+            remaining = iter(photo_ids)
+
+            try:
+                while True:
+                    # Keep a bounded number of photos in flight so memory stays flat
+                    while len(pending) < max_in_flight:
+                        photo_id = next(remaining, None)
+                        if photo_id is None:
+                            break
+                        submitted = self._submit(pool, photo_id, throttle)
+                        if submitted is not None:
+                            pending[submitted[0]] = submitted[1]
+                        else:
+                            failed += 1
+
+                    if not pending:
+                        break
+
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        photo, fernet = pending.pop(future)
+                        try:
+                            self._store(photo, fernet, future.result(), model_version, throttle)
+                        except Exception as e:
+                            failed += 1
+                            self.stderr.write(f"Photo {photo.id}: {e}")
+                            continue
+                        done.add(photo.id)
+                        self._save_checkpoint(checkpoint_path, model_version, done)
+                        self.stdout.write(f"Reprocessed photo {photo.id}")
+            except KeyboardInterrupt:
+                for future in pending:
+                    future.cancel()
+                self.stdout.write(self.style.WARNING("Interrupted, progress saved to checkpoint."))
+                return
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f"Finished with {failed} failures."))
+        else:
+            os.remove(checkpoint_path)
+            self.stdout.write(self.style.SUCCESS("All selected photos reprocessed."))
+
+    def _submit(self, pool, photo_id, throttle):
+        """Read and decrypt the stored original, wait for bulk admission and hand it to a worker process."""
+        try:
+            photo = EncryptedPhoto.objects.get(id=photo_id)
+            fernet = get_user_key(photo.user_id)
+            with open(photo.original_file.path, 'rb') as f:
+                encrypted_data = f.read()
+            throttle(len(encrypted_data))
+            original_data = fernet.decrypt(encrypted_data)
+
+            size = read_image_size(io.BytesIO(original_data))
+            if size is None:
+                raise ValueError("Unsupported image format.")
+            cost = plan_processing(*size)
+        except (EncryptedPhoto.DoesNotExist, ImageTooLarge, ValueError, OSError) as e:
+            self.stderr.write(f"Photo {photo_id}: {e}")
+            return None
+
+        # The admission controller is process-local, so this is the command's own concurrency and
+        # memory cap (sized by the DEWARP_* settings); it does not compete with the server's queues.
+        # The photo holds its share until the worker has finished it
+        while True:
+            try:
+                dewarp_admission.acquire(cost, priority=PRIORITY_BULK)
+                break
+            except AdmissionRejected as e:
+                time.sleep(e.retry_after)
+        try:
+            future = pool.submit(_dewarp_in_worker, original_data, cost.reduction)
+        except BaseException:
+            dewarp_admission.release(cost)
+            raise
+        future.add_done_callback(lambda _: dewarp_admission.release(cost))
+        return future, (photo, fernet)
+
+    def _store(self, photo, fernet, page, model_version, throttle):
+        """Atomically replace the processed file and deformation field and record the model version and metadata."""
+        throttle(store_processed(photo, fernet, page, model_version))
+
+    def _load_checkpoint(self, path, model_version):
+        if not os.path.exists(path):
+            return set()
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('model_version') != model_version:
+            return set()
+        return set(checkpoint.get('done', []))
+
+    def _save_checkpoint(self, path, model_version, done):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'model_version': model_version, 'done': sorted(done)}, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0003_alter_encryptedphoto_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='original_file',
+            field=models.FileField(blank=True, default='', upload_to='originals/'),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='model_version',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
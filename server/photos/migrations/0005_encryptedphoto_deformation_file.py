@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0004_encryptedphoto_original_file_model_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='deformation_file',
+            field=models.FileField(blank=True, default='', upload_to='fields/'),
+        ),
+    ]
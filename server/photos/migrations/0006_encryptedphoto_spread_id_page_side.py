@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0005_encryptedphoto_deformation_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='spread_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='page_side',
+            field=models.CharField(blank=True, choices=[('left', 'Left'), ('right', 'Right')], default='', max_length=5),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0006_encryptedphoto_spread_id_page_side'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='plain_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='encrypted_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='processing_time',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
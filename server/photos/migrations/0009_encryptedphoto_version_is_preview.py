@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0008_profilingtoggle_profilecapture'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='encryptedphoto',
+            name='is_preview',
+            field=models.BooleanField(default=False),
+        ),
+    ]
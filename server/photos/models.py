@@ -4,5 +4,51 @@ from django.contrib.auth.models import User
 class EncryptedPhoto(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='photos')
     file = models.FileField(upload_to='photos/', default='')
+    original_file = models.FileField(upload_to='originals/', blank=True, default='')
+    deformation_file = models.FileField(upload_to='fields/', blank=True, default='')
     original_filename = models.CharField(max_length=255, default='')
-    uploaded_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    model_version = models.CharField(max_length=64, blank=True, default='')
+    # Pages split from one photo of a two-page spread share a spread_id
+    spread_id = models.UUIDField(null=True, blank=True, db_index=True)
+    page_side = models.CharField(max_length=5, blank=True, default='', choices=[('left', 'Left'), ('right', 'Right')])
+    # Metadata recorded at upload so listings need not decrypt the files
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    plain_size = models.PositiveIntegerField(null=True, blank=True)
+    encrypted_size = models.PositiveIntegerField(null=True, blank=True)
+    processing_time = models.FloatField(null=True, blank=True)
+    placeholder = models.TextField(blank=True, default='')
+    # Incremented whenever the processed file is replaced, e.g. when a preview is refined
+    version = models.PositiveIntegerField(default=1)
+    is_preview = models.BooleanField(default=False)
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+
+
+class ProfilingToggle(models.Model):
+    """Switches on profiling of all photo requests of a staff user (see photos.profiling)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profiling_toggle',
+                                limit_choices_to={'is_staff': True})
+    enabled = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.user} ({'on' if self.enabled else 'off'})"
+
+
+class ProfileCapture(models.Model):
+    """A profiled request. The traces are in `directory`; only image dimensions are recorded, never images."""
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='profile_captures')
+    name = models.CharField(max_length=64, unique=True)
+    view = models.CharField(max_length=100)
+    path = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField()
+    duration = models.FloatField()
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    directory = models.CharField(max_length=500)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.name
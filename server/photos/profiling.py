@@ -0,0 +1,264 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
+
+# Like photos.dewarp_service, this module must stay light. The torch profiler is
+# started by photos.image_processing around the forward pass of a profiled request,
+# serialized with every other forward pass of the process by forward_pass_gate.
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+_signer = TimestampSigner(salt='photos.profiling')
+_current = contextvars.ContextVar('photos_profile', default=None)
+
+
+def generate_profiling_token(user_id: int) -> str:
+    """
+    Creates a signed token that enables profiling for requests of a staff user.
+
+    Args:
+        user_id (int): The ID of the staff user.
+
+    Returns:
+        str: The value of the X-Profile-Token header.
+    """
+    return _signer.sign(str(user_id))
+
+
+def profiling_requested(request) -> bool:
+    """
+    Checks whether a request should be profiled: profiling must be enabled in settings, the user
+    must be staff, and either send a valid X-Profile-Token or have profiling switched on in the admin.
+    """
+    user = request.user
+    if not settings.PHOTOS_PROFILING or not user.is_authenticated or not user.is_staff:
+        return False
+
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        try:
+            return _signer.unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE) == str(user.id)
+        except (BadSignature, SignatureExpired):
+            return False
+
+    from .models import ProfilingToggle
+    return ProfilingToggle.objects.filter(user=user, enabled=True).exists()
+
+
+def current_profile():
+    """Returns the ProfileSession of the request being processed in this context, or None."""
+    return _current.get()
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of selected threads at a fixed interval and counts them
+    in the folded format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self._threads = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_thread(self, ident: int):
+        """Adds a thread (by threading.get_ident()) to the sampled threads."""
+        self._threads.add(ident)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='photos-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in tuple(self._threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def folded(self) -> str:
+        """Returns the samples as 'frame;frame;frame count' lines."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class ForwardPassGate:
+    """
+    The torch profiler is process-wide: only one trace can be active and it records the forward
+    passes of every thread. A traced pass therefore runs alone, it waits for running passes to
+    finish and holds back new ones (of any request) until its trace is complete.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._running = 0
+        self._tracing = False
+        self._waiting_traces = 0
+
+    @contextmanager
+    def forward(self):
+        """Wraps an untraced forward pass."""
+        with self._cond:
+            while self._tracing or self._waiting_traces:
+                self._cond.wait()
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def trace(self):
+        """Wraps a traced forward pass, traces of concurrent profiled requests take turns."""
+        with self._cond:
+            self._waiting_traces += 1
+            while self._tracing or self._running:
+                self._cond.wait()
+            self._waiting_traces -= 1
+            self._tracing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._tracing = False
+                self._cond.notify_all()
+
+
+forward_pass_gate = ForwardPassGate()
+
+
+class ProfileSession:
+    """
+    Profiles one request: samples the request thread (and threads that join the session),
+    collects torch traces of forward passes and image dimensions, and writes them to
+    PROFILES_DIR/<id>/ when finished. Images themselves are never stored.
+    """
+
+    def __init__(self, user, view: str, method: str, path: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.directory = os.path.join(settings.PROFILES_DIR, self.id)
+        self.user = user
+        self.view = view
+        self.method = method
+        self.path = path
+        self.images = []
+        self.traces = []
+        self._lock = threading.Lock()
+        self._sampler = SamplingProfiler(settings.PROFILING_INTERVAL)
+        self._token = None
+        self._start = None
+
+    def start(self) -> 'ProfileSession':
+        os.makedirs(self.directory, exist_ok=True)
+        self._start = time.perf_counter()
+        self._token = _current.set(self)
+        self._sampler.add_thread(threading.get_ident())
+        self._sampler.start()
+        return self
+
+    def join_current_thread(self):
+        """Samples the calling thread too, e.g. a worker processing one page of a spread."""
+        self._sampler.add_thread(threading.get_ident())
+
+    def record_image(self, **dimensions):
+        """Records the dimensions of an image processed by the request (never its content)."""
+        with self._lock:
+            self.images.append(dimensions)
+
+    def trace_path(self, name: str) -> str:
+        """Returns a path for a trace file of this session and lists it in the session."""
+        with self._lock:
+            filename = f"{name}_{len(self.traces)}.json"
+            self.traces.append(filename)
+        return os.path.join(self.directory, filename)
+
+    def finish(self, status_code: int):
+        """Stops sampling, writes the flame graph input and metadata, and records the capture for the admin."""
+        self._sampler.stop()
+        duration = time.perf_counter() - self._start
+        _current.reset(self._token)
+
+        with open(os.path.join(self.directory, 'stacks.folded'), 'w', encoding='utf-8') as f:
+            f.write(self._sampler.folded())
+
+        metadata = {
+            'view': self.view,
+            'method': self.method,
+            'path': self.path,
+            'status_code': status_code,
+            'duration': duration,
+            'samples': sum(self._sampler.samples.values()),
+            'interval': self._sampler.interval,
+            'images': self.images,
+            'traces': self.traces,
+        }
+        with open(os.path.join(self.directory, 'profile.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, indent=2)
+
+        from .models import ProfileCapture
+        first_image = self.images[0] if self.images else {}
+        ProfileCapture.objects.create(
+            user=self.user,
+            name=self.id,
+            view=self.view,
+            path=self.path,
+            status_code=status_code,
+            duration=duration,
+            width=first_image.get('width'),
+            height=first_image.get('height'),
+            directory=self.directory,
+        )
+
+
+class ProfiledViewMixin:
+    """
+    APIView mixin that profiles requests of staff users who asked for it (see profiling_requested()).
+    The capture ID is returned in the X-Profile-Id response header.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._profile = None
+        if profiling_requested(request):
+            self._profile = ProfileSession(
+                request.user, type(self).__name__, request.method, request.path
+            ).start()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        profile = getattr(self, '_profile', None)
+        if profile is not None:
+            self._profile = None
+            profile.finish(response.status_code)
+            response['X-Profile-Id'] = profile.id
+        return response
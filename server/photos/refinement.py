@@ -0,0 +1,143 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.db.models import F
+
+from .admission import PRIORITY_BULK, AdmissionRejected, ProcessingCost, dewarp_admission
+from .dewarp_service import DewarpedPage, get_model_version
+from .executors import _dewarp_in_worker, get_dewarp_executor
+from .models import EncryptedPhoto
+from .utils import get_user_key
+
+logger = logging.getLogger(__name__)
+
+
+def replace_file(path: str, data: bytes):
+    """Atomically replaces a stored file, so readers see either the old or the new content."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def store_processed(photo: EncryptedPhoto, fernet, page: DewarpedPage, model_version: str) -> int:
+    """
+    Replaces the processed file and deformation field of an existing photo, records the
+    model version and metadata, and increments the photo's version.
+
+    Args:
+        photo (EncryptedPhoto): The photo to update.
+        fernet (Fernet): The owner's key.
+        page (DewarpedPage): The new processing result.
+        model_version (str): Version of the model that produced the result.
+
+    Returns:
+        int: Number of bytes written.
+
+    Raises:
+        EncryptedPhoto.DoesNotExist: If the photo was deleted meanwhile; the files written are removed.
+    """
+    encrypted_data = fernet.encrypt(page.image)
+    encrypted_field = fernet.encrypt(page.field)
+
+    replace_file(photo.file.path, encrypted_data)
+    if photo.deformation_file:
+        replace_file(photo.deformation_file.path, encrypted_field)
+    else:
+        photo.deformation_file.save(os.path.basename(photo.file.name), ContentFile(encrypted_field), save=False)
+
+    photo.model_version = model_version
+    photo.width, photo.height = page.width, page.height
+    photo.plain_size = len(page.image)
+    photo.encrypted_size = len(encrypted_data)
+    photo.processing_time = page.processing_time
+    photo.placeholder = page.placeholder
+    photo.is_preview = False
+    updated = EncryptedPhoto.objects.filter(id=photo.id).update(
+        model_version=photo.model_version,
+        deformation_file=photo.deformation_file.name,
+        width=photo.width,
+        height=photo.height,
+        plain_size=photo.plain_size,
+        encrypted_size=photo.encrypted_size,
+        processing_time=photo.processing_time,
+        placeholder=photo.placeholder,
+        is_preview=False,
+        version=F('version') + 1,
+    )
+    if not updated:
+        # Deleted while it was processed: its files were removed before ours were written
+        for path in (photo.file.path, photo.deformation_file.path):
+            if os.path.isfile(path):
+                os.remove(path)
+        raise EncryptedPhoto.DoesNotExist(f"Photo {photo.id} was deleted while it was processed.")
+
+    photo.refresh_from_db(fields=['version'])
+    return len(encrypted_data) + len(encrypted_field)
+
+
+@lru_cache(maxsize=None)
+def get_refine_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool that waits for admission and stores refined photos."""
+    return ThreadPoolExecutor(max_workers=settings.DEWARP_REFINE_THREADS, thread_name_prefix='photos-refine')
+
+
+def refine_photo(photo_id: int, user_id: int, cost: ProcessingCost, priority: str = PRIORITY_BULK) -> bool:
+    """
+    Runs the full dewarp of an upload stored as a preview and replaces the preview with it.
+    The upload is read back from the stored original, so waiting refinements hold no image data.
+    If admission keeps failing, the photo stays a preview and is picked up by reprocess_photos.
+
+    Args:
+        photo_id (int): The ID of the preview photo.
+        user_id (int): The owner, for fair scheduling.
+        cost (ProcessingCost): The planned processing cost.
+        priority (str): Priority class of the upload.
+
+    Returns:
+        bool: True if the photo was refined.
+    """
+    close_old_connections()
+    try:
+        try:
+            photo = EncryptedPhoto.objects.get(id=photo_id)
+            fernet = get_user_key(user_id)
+            with open(photo.original_file.path, 'rb') as f:
+                data = fernet.decrypt(f.read())
+        except (EncryptedPhoto.DoesNotExist, FileNotFoundError):
+            # Deleted before its refinement started
+            return False
+
+        for attempt in range(settings.DEWARP_REFINE_ATTEMPTS):
+            try:
+                with dewarp_admission.admit(cost, user_id, priority):
+                    page = get_dewarp_executor().submit(_dewarp_in_worker, data, cost.reduction).result()
+                break
+            except AdmissionRejected as e:
+                time.sleep(e.retry_after)
+        else:
+            logger.warning(f"Photo {photo_id} left as a preview: image processing is saturated.")
+            return False
+
+        try:
+            store_processed(photo, fernet, page, get_model_version())
+        except EncryptedPhoto.DoesNotExist:
+            # Deleted while it was being refined
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"Failed to refine photo {photo_id}: {e}", exc_info=True)
+        return False
+    finally:
+        close_old_connections()
+
+
+def submit_refinement(photo_id: int, user_id: int, cost: ProcessingCost, priority: str = PRIORITY_BULK):
+    """Schedules refine_photo() in the background and returns immediately."""
+    return get_refine_executor().submit(refine_photo, photo_id, user_id, cost, priority)
@@ -9,13 +9,14 @@ logger = logging.getLogger(__name__)
 @receiver(post_delete, sender=EncryptedPhoto)
 def delete_encrypted_photo_file(sender, instance, **kwargs):
     """
-    Deletes the encrypted photo file from the filesystem when the EncryptedPhoto instance is deleted.
+    Deletes the encrypted photo files (processed, original and deformation field) from the filesystem when the EncryptedPhoto instance is deleted.
     """
-    file_path = getattr(instance.file, 'path', None)
+    for field in (instance.file, instance.original_file, instance.deformation_file):
+        file_path = field.path if field else None
 
-    if file_path and os.path.isfile(file_path):
-        try:
-            os.remove(file_path)
-            logger.info(f"Deleted file: {file_path}")
-        except Exception as e:
-            logger.error(f"Failed to delete file {file_path}: {e}", exc_info=True)
+        if file_path and os.path.isfile(file_path):
+            try:
+                os.remove(file_path)
+                logger.info(f"Deleted file: {file_path}")
+            except Exception as e:
+                logger.error(f"Failed to delete file {file_path}: {e}", exc_info=True)
@@ -1,3 +1,890 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from .admission import (
+    AdmissionController,
+    AdmissionRejected,
+    ImageTooLarge,
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    ProcessingCost,
+    dewarp_admission,
+    plan_processing,
+)
+from .deformation import apply_field, decode_field, encode_field, expand_field
+from .dewarp_service import AI_MODEL_SRC
+from .export import iter_decrypted, stream_pdf, stream_zip
+from .image_processing import ImageProcessing
+from .inference_scale import InferenceScalePolicy, get_scale_policy
+
+
+class ImportBudgetTests(SimpleTestCase):
+    """
+    The light endpoints (URLs, views, admin, management commands) must not import the ML stack.
+    torch, scipy and cv2 are only loaded by photos.dewarp_service on first use.
+    """
+    HEAVY_MODULES = ('torch', 'scipy', 'cv2')
+    IMPORT_TIME_BUDGET = 2.0  # seconds for django.setup() plus the photos modules
+
+    IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import config.urls, photos.urls, photos.views, photos.async_views, photos.admin, photos.admission
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(m for m in sys.modules if m.split('.')[0] in %r)}))
+"""
+
+    def _run_import(self):
+        db = settings.DATABASES['default']
+        env = dict(os.environ)
+        env.update({
+            'DJANGO_SETTINGS_MODULE': 'config.settings',
+            'SECRET_KEY': settings.SECRET_KEY,
+            'MASTER_KEY': settings.MASTER_KEY,
+            'DEBUG': str(settings.DEBUG),
+            'ALLOWED_HOSTS': ','.join(settings.ALLOWED_HOSTS),
+            'CORS_ALLOWED_ORIGINS': ','.join(settings.CORS_ALLOWED_ORIGINS),
+            'DB_NAME': str(db['NAME']),
+            'DB_USER': str(db['USER']),
+            'DB_PASSWORD': str(db['PASSWORD']),
+            'DEWARP_WARM_UP': 'False',
+        })
+        result = subprocess.run(
+            [sys.executable, '-c', self.IMPORT_SCRIPT % (self.HEAVY_MODULES,)],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def test_light_endpoints_do_not_import_ml_stack(self):
+        report = self._run_import()
+        self.assertEqual(report['modules'], [], "ML modules imported by light endpoints")
+
+    def test_import_time_budget(self):
+        report = self._run_import()
+        self.assertLess(report['elapsed'], self.IMPORT_TIME_BUDGET)
+
+
+def _cost(memory_bytes: int = 1, cpu_seconds: float = 0.1) -> ProcessingCost:
+    return ProcessingCost(100, 100, 1, memory_bytes, cpu_seconds)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+
+    def _controller(self, **kwargs):
+        options = dict(memory_budget=100, max_concurrent=1, max_queue=8, queue_timeout=5)
+        options.update(kwargs)
+        return AdmissionController(**options)
+
+    def _wait_for(self, condition, timeout: float = 5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Condition not reached in time.")
+            time.sleep(0.005)
+
+    def _queue(self, controller, order, user_id, priority=PRIORITY_INTERACTIVE, cost=None):
+        """Starts a thread that waits for admission, records its grant and releases at once."""
+        cost = cost or _cost()
+
+        def run():
+            controller.acquire(cost, user_id, priority)
+            order.append((user_id, priority))
+            controller.release(cost, user_id)
+
+        waiting = controller.stats()['waiting']
+        thread = threading.Thread(target=run)
+        thread.start()
+        self._wait_for(lambda: controller.stats()['waiting'] == waiting + 1)
+        return thread
+
+    def test_acquire_and_release_track_the_budget(self):
+        controller = self._controller(max_concurrent=2)
+        controller.acquire(_cost(30), 'a')
+        controller.acquire(_cost(50), 'b')
+        stats = controller.stats()
+        self.assertEqual(stats['running'], 2)
+        self.assertEqual(stats['memory_in_use'], 80)
+
+        controller.release(_cost(30), 'a')
+        controller.release(_cost(50), 'b')
+        stats = controller.stats()
+        self.assertEqual(stats['running'], 0)
+        self.assertEqual(stats['memory_in_use'], 0)
+        self.assertEqual(stats['users_running'], 0)
+
+    def test_memory_budget_queues_requests_that_do_not_fit(self):
+        controller = self._controller(max_concurrent=4)
+        controller.acquire(_cost(80), 'a')
+        order = []
+        thread = self._queue(controller, order, 'b', cost=_cost(40))
+        self.assertEqual(order, [])
+
+        controller.release(_cost(80), 'a')
+        thread.join(5)
+        self.assertEqual(order, [('b', PRIORITY_INTERACTIVE)])
+
+    def test_full_queue_rejects_with_retry_after(self):
+        controller = self._controller(max_queue=0)
+        controller.acquire(_cost(), 'a')
+        with self.assertRaises(AdmissionRejected) as context:
+            controller.acquire(_cost(), 'b')
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+        self.assertEqual(controller.stats()['classes'][PRIORITY_INTERACTIVE]['rejected'], 1)
+        controller.release(_cost(), 'a')
+
+    def test_queue_timeout_rejects_and_dequeues(self):
+        controller = self._controller(queue_timeout=0.05)
+        controller.acquire(_cost(), 'a')
+        with self.assertRaises(AdmissionRejected):
+            controller.acquire(_cost(), 'b')
+        self.assertEqual(controller.stats()['waiting'], 0)
+        controller.release(_cost(), 'a')
+
+
+    def test_users_are_served_round_robin(self):
+        controller = self._controller()
+        controller.acquire(_cost(), 'holder')
+        order = []
+        threads = [self._queue(controller, order, user_id) for user_id in ('a', 'a', 'b')]
+
+        controller.release(_cost(), 'holder')
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([user_id for user_id, _ in order], ['a', 'b', 'a'])
+
+    def test_bulk_work_is_served_every_interactive_weight_grants(self):
+        controller = self._controller(interactive_weight=2)
+        controller.acquire(_cost(), 'holder')
+        order = []
+        threads = [self._queue(controller, order, 'bulk', PRIORITY_BULK)]
+        threads += [self._queue(controller, order, f'user{i}') for i in range(3)]
+
+        controller.release(_cost(), 'holder')
+        for thread in threads:
+            thread.join(5)
+        # The holder's grant counts towards the streak
+        self.assertEqual([priority for _, priority in order],
+                         [PRIORITY_INTERACTIVE, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_INTERACTIVE])
+
+    def test_user_cap_lets_other_users_overtake(self):
+        controller = self._controller(max_concurrent=2, user_max_concurrent=1)
+        controller.acquire(_cost(), 'a')
+        order = []
+        first = self._queue(controller, order, 'a')
+        second = threading.Thread(target=lambda: (controller.acquire(_cost(), 'b'), order.append(('b', None))))
+        second.start()
+        second.join(5)
+        self.assertEqual(order, [('b', None)])
+
+        controller.release(_cost(), 'a')
+        first.join(5)
+        self.assertEqual(order[-1][0], 'a')
+        controller.release(_cost(), 'b')
+
+    def test_assign_priority_demotes_users_with_many_requests(self):
+        controller = self._controller(max_concurrent=4, user_interactive_burst=2)
+        self.assertEqual(controller.assign_priority('a'), PRIORITY_INTERACTIVE)
+        self.assertEqual(controller.assign_priority('a', PRIORITY_BULK), PRIORITY_BULK)
+
+        controller.acquire(_cost(), 'a')
+        controller.acquire(_cost(), 'a')
+        self.assertEqual(controller.assign_priority('a'), PRIORITY_BULK)
+        self.assertEqual(controller.assign_priority('b'), PRIORITY_INTERACTIVE)
+        controller.release(_cost(), 'a')
+        self.assertEqual(controller.assign_priority('a'), PRIORITY_INTERACTIVE)
+        controller.release(_cost(), 'a')
+
+    def test_cancelled_admit_async_releases_the_budget(self):
+        controller = self._controller()
+        controller.acquire(_cost(), 'holder')
+
+        async def cancel_while_waiting():
+            task = asyncio.ensure_future(controller.admit_async(_cost(), 'a').__aenter__())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            controller.release(_cost(), 'holder')
+            # The worker thread is granted the budget after the cancellation and gives it back
+            for _ in range(500):
+                await asyncio.sleep(0.01)
+                if controller.stats()['running'] == 0 and controller.stats()['waiting'] == 0:
+                    return
+            self.fail("The budget of the cancelled request was not released.")
+
+        asyncio.run(cancel_while_waiting())
+
+    def test_admit_async_holds_the_budget_until_the_work_completes(self):
+        controller = self._controller()
+        started, finish = threading.Event(), threading.Event()
+
+        def work():
+            started.set()
+            finish.wait(5)
+            return 'done'
+
+        async def cancel_while_working(executor):
+            async def request():
+                async with controller.admit_async(_cost(), 'a') as slot:
+                    return await slot.run(executor.submit(work))
+
+            task = asyncio.ensure_future(request())
+            await asyncio.to_thread(started.wait, 5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual(controller.stats()['running'], 1)
+
+            finish.set()
+            for _ in range(500):
+                await asyncio.sleep(0.01)
+                if controller.stats()['running'] == 0:
+                    return
+            self.fail("The budget was not released when the work completed.")
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            asyncio.run(cancel_while_working(executor))
+
+
+@override_settings(DEWARP_MAX_PIXELS=25_000_000, DEWARP_DOWNSCALE_OVERSIZE=True, DEWARP_ADAPTIVE_SCALE=False)
+class PlanProcessingTests(SimpleTestCase):
+    """
+    With the default budget, reduced decoding is only used for images above DEWARP_MAX_PIXELS:
+    the fixed pixel thresholds of _find_page assume full-size photos.
+    """
+    DEFAULT_MEMORY_BUDGET = 8192 * 1024 * 1024
+
+    def setUp(self):
+        get_scale_policy.cache_clear()
+        self.addCleanup(get_scale_policy.cache_clear)
+        patcher = mock.patch.object(dewarp_admission, 'memory_budget', self.DEFAULT_MEMORY_BUDGET)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_12_mp_photo_plans_at_full_resolution(self):
+        self.assertEqual(plan_processing(4000, 3000).reduction, 1)
+        self.assertEqual(plan_processing(3000, 4000).reduction, 1)
+
+    def test_images_within_max_pixels_plan_at_full_resolution(self):
+        self.assertEqual(plan_processing(5000, 5000).reduction, 1)
+
+    def test_over_size_images_are_decoded_at_reduced_resolution(self):
+        self.assertEqual(plan_processing(8000, 6000).reduction, 2)
+
+    @override_settings(DEWARP_DOWNSCALE_OVERSIZE=False)
+    def test_over_size_images_are_rejected_without_downscaling(self):
+        with self.assertRaises(ImageTooLarge):
+            plan_processing(8000, 6000)
+
+
+class DeformationFieldTests(SimpleTestCase):
+    HEIGHT, WIDTH = 240, 180
+
+    def _identity(self, height=HEIGHT, width=WIDTH):
+        inv_y, inv_x = np.mgrid[0:height, 0:width].astype(np.float32)
+        return inv_x, inv_y
+
+    def _image(self):
+        rng = np.random.default_rng(0)
+        noise = rng.random((self.HEIGHT // 10, self.WIDTH // 10)).astype(np.float32)
+        return (cv2.resize(noise, (self.WIDTH, self.HEIGHT), interpolation=cv2.INTER_CUBIC) * 255).clip(0, 255).astype(np.uint8)
+
+    def test_decode_returns_the_encoded_shape(self):
+        field, shape = decode_field(encode_field(*self._identity()))
+        self.assertEqual(shape, (self.HEIGHT, self.WIDTH))
+        self.assertEqual(field.shape[0], 2)
+        self.assertEqual(max(field.shape[1:]), 64)
+
+    def test_identity_round_trip_at_any_resolution(self):
+        field, _ = decode_field(encode_field(*self._identity()))
+        for height, width in ((self.HEIGHT, self.WIDTH), (self.HEIGHT * 2, self.WIDTH * 2)):
+            map_x, map_y = expand_field(field, height, width)
+            expected_x, expected_y = self._identity(height, width)
+            border = max(height, width) // 32
+            inner = (slice(border, -border), slice(border, -border))
+            np.testing.assert_allclose(map_x[inner], expected_x[inner], atol=0.5)
+            np.testing.assert_allclose(map_y[inner], expected_y[inner], atol=0.5)
+
+    def test_apply_field_reproduces_the_encoded_warp(self):
+        image = self._image()
+        inv_x, inv_y = self._identity()
+        shift = 6
+        field, _ = decode_field(encode_field(inv_x + shift, inv_y))
+
+        warped = apply_field(image, field).astype(np.float32)
+        inner = (slice(10, -10), slice(10, -10 - shift))
+        expected = image[:, shift:].astype(np.float32)[10:-10, 10:-10]
+        self.assertLess(np.abs(warped[inner] - expected).mean(), 2.0)
+
+        unchanged = apply_field(image, decode_field(encode_field(inv_x, inv_y))[0]).astype(np.float32)
+        self.assertLess(np.abs(unchanged[10:-10, 10:-10] - image[10:-10, 10:-10]).mean(), 1.0)
+
+
+class FastPathTests(SimpleTestCase):
+    HEIGHT, WIDTH = 120, 90
+
+    def _processing(self, **kwargs):
+        with mock.patch('photos.image_processing.get_model_version', return_value='test'):
+            return ImageProcessing(load_model=False, **kwargs)
+
+    def _identity(self):
+        grid_y, grid_x = np.mgrid[0:self.HEIGHT, 0:self.WIDTH].astype(np.float32)
+        return grid_x, grid_y
+
+    def _homography_field(self, homography):
+        grid_x, grid_y = self._identity()
+        points = np.stack([grid_x, grid_y, np.ones_like(grid_x)])
+        projected = np.tensordot(homography, points, axes=1)
+        return (projected[:2] / projected[2]).astype(np.float32)
+
+    def test_near_identity_field_skips_the_warp(self):
+        rng = np.random.default_rng(0)
+        offsets = np.stack(self._identity()) + rng.normal(0, 0.1, (2, self.HEIGHT, self.WIDTH)).astype(np.float32)
+        path, homography = self._processing(flat_threshold=0.5)._choose_warp_path(offsets)
+        self.assertEqual(path, ImageProcessing.PATH_IDENTITY)
+        self.assertIsNone(homography)
+
+    def test_projective_field_takes_the_homography_path(self):
+        expected = np.array([[1.02, 0.01, 3.0], [0.005, 0.98, -2.0], [1e-5, 2e-5, 1.0]])
+        offsets = self._homography_field(expected)
+        path, homography = self._processing(flat_threshold=0.5, homography_threshold=0.5)._choose_warp_path(offsets)
+        self.assertEqual(path, ImageProcessing.PATH_HOMOGRAPHY)
+        np.testing.assert_allclose(homography / homography[2, 2], expected, rtol=1e-3, atol=1e-4)
+
+    def test_curved_field_takes_the_full_path(self):
+        grid_x, grid_y = self._identity()
+        offsets = np.stack([grid_x, grid_y + 5 * np.sin(2 * np.pi * grid_x / self.WIDTH)])
+        path, _ = self._processing(flat_threshold=0.5, homography_threshold=0.5)._choose_warp_path(offsets)
+        self.assertEqual(path, ImageProcessing.PATH_FULL)
+
+    def test_disabled_thresholds_always_take_the_full_path(self):
+        path, _ = self._processing()._choose_warp_path(np.stack(self._identity()))
+        self.assertEqual(path, ImageProcessing.PATH_FULL)
+
+    def test_homography_inverse_map_returns_to_the_source(self):
+        homography = np.array([[1.0, 0.02, 2.0], [0.0, 1.0, 1.0], [0.0, 0.0, 1.0]])
+        image = np.zeros((self.HEIGHT, self.WIDTH), dtype=np.uint8)
+        _, inv_x, inv_y = self._processing()._warp_homography(image, homography)
+
+        # Mapping the source pixels forward again lands on the output pixels (away from the clipped border)
+        source = np.stack([inv_x, inv_y, np.ones_like(inv_x)])
+        projected = np.tensordot(homography, source, axes=1)
+        grid_x, grid_y = self._identity()
+        inner = (slice(10, -10), slice(10, -10))
+        np.testing.assert_allclose((projected[0] / projected[2])[inner], grid_x[inner], atol=1e-3)
+        np.testing.assert_allclose((projected[1] / projected[2])[inner], grid_y[inner], atol=1e-3)
+
+
+class SpreadSplitTests(SimpleTestCase):
+    HEIGHT, WIDTH = 400, 600
+
+    def _processing(self):
+        with mock.patch('photos.image_processing.get_model_version', return_value='test'):
+            return ImageProcessing(load_model=False)
+
+    def _spread(self, gutter: int):
+        image = np.full((self.HEIGHT, self.WIDTH), 200, dtype=np.uint8)
+        image[:, gutter - 6:gutter + 6] = 80
+        return image
+
+    def test_spread_is_split_at_the_gutter(self):
+        image = self._spread(gutter=320)
+        left, right = self._processing().split_spread(image)
+        self.assertAlmostEqual(left.shape[1], 320, delta=8)
+        self.assertEqual(left.shape[1] + right.shape[1], self.WIDTH)
+        self.assertEqual(left.shape[0], self.HEIGHT)
+        self.assertEqual(right.shape[0], self.HEIGHT)
+
+    def test_single_page_is_not_split(self):
+        image = np.full((self.HEIGHT, self.WIDTH), 200, dtype=np.uint8)
+        pages = self._processing().split_spread(image)
+        self.assertEqual(len(pages), 1)
+        self.assertIs(pages[0], image)
+
+    def test_shallow_gutter_is_not_split(self):
+        image = self._spread(gutter=300)
+        image[image == 80] = 195
+        self.assertEqual(len(self._processing().split_spread(image)), 1)
+
+    def test_dark_column_outside_the_central_band_is_ignored(self):
+        self.assertEqual(len(self._processing().split_spread(self._spread(gutter=100))), 1)
+
+
+class InferenceScalePolicyTests(SimpleTestCase):
+    ENTRIES = [
+        {'pixels': 1e6, 'seconds': 1.0, 'page_width': 500, 'error_px': 2.0},
+        {'pixels': 4e6, 'seconds': 4.0, 'page_width': 1000, 'error_px': 1.9},
+        {'pixels': 9e6, 'seconds': 9.0, 'page_width': 1500, 'error_px': 1.0},
+    ]
+
+    def test_uncalibrated_policy_aims_for_the_target_page_width(self):
+        policy = InferenceScalePolicy(latency_slo=3.0, target_page_width=750)
+        self.assertAlmostEqual(policy((4000, 3000), (3000, 2000)), 0.25)
+
+    def test_latency_slo_caps_the_scale(self):
+        policy = InferenceScalePolicy(latency_slo=3.0, target_page_width=750)
+        scale = policy((4000, 3000), (1000, 800))
+        self.assertLess(scale, 750 / 1000)
+        self.assertLessEqual(policy.predict_latency(4000 * 3000 * scale ** 2), 3.0 + 1e-6)
+
+    def test_scale_stays_within_its_bounds(self):
+        policy = InferenceScalePolicy(latency_slo=3.0, target_page_width=750, min_scale=0.1, max_scale=0.8)
+        self.assertEqual(policy((400, 300), (300, 200)), 0.8)
+        self.assertEqual(policy((40000, 30000), (30000, 20000)), 0.1)
+
+    def test_calibration_interpolates_latency(self):
+        policy = InferenceScalePolicy(latency_slo=3.0, target_page_width=750, entries=self.ENTRIES)
+        self.assertAlmostEqual(policy.predict_latency(2e6), 2.0)
+        self.assertAlmostEqual(policy.predict_latency(16e6), 16.0)
+        self.assertAlmostEqual(policy.max_pixels, 3e6, delta=1)
+
+    def test_calibration_chooses_the_smallest_page_width_of_acceptable_quality(self):
+        policy = InferenceScalePolicy(latency_slo=3.0, target_page_width=750, entries=self.ENTRIES,
+                                      quality_tolerance=0.1)
+        self.assertEqual(policy.target_page_width, 1500)
+        policy = InferenceScalePolicy(latency_slo=3.0, target_page_width=750, entries=self.ENTRIES,
+                                      quality_tolerance=1.0)
+        self.assertEqual(policy.target_page_width, 500)
+
+
+class ExportTests(SimpleTestCase):
+
+    def _photo(self, photo_id: int, path: str = '', page_side: str = ''):
+        return SimpleNamespace(id=photo_id, original_filename=f'scan{photo_id}.jpg', page_side=page_side,
+                               uploaded_at=datetime(2026, 1, 2, 3, 4, 5), file=SimpleNamespace(path=path))
+
+    def _jpeg(self, height: int, width: int, channels: int = 1) -> bytes:
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        return cv2.imencode('.jpg', np.full(shape, 128, dtype=np.uint8))[1].tobytes()
+
+    def test_iter_decrypted_keeps_order_and_skips_unreadable_photos(self):
+        fernet = Fernet(Fernet.generate_key())
+        with tempfile.TemporaryDirectory() as directory:
+            photos = []
+            for photo_id in range(5):
+                path = os.path.join(directory, f'{photo_id}.enc')
+                with open(path, 'wb') as f:
+                    f.write(b'corrupted' if photo_id == 2 else fernet.encrypt(b'image %d' % photo_id))
+                photos.append(self._photo(photo_id, path))
+
+            items = list(iter_decrypted(photos, fernet, read_ahead=2))
+
+        self.assertEqual([photo.id for photo, _ in items], list(range(5)))
+        self.assertEqual([data for _, data in items],
+                         [b'image 0', b'image 1', None, b'image 3', b'image 4'])
+
+    def test_zip_contains_the_photos_in_order(self):
+        items = [(self._photo(1), b'first'), (self._photo(2), None), (self._photo(3, page_side='left'), b'third')]
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_zip(items))))
+
+        self.assertEqual(archive.namelist(), ['0001_scan1.jpg', '0003_scan3_left.jpg'])
+        self.assertEqual(archive.read('0001_scan1.jpg'), b'first')
+        self.assertEqual(archive.read('0003_scan3_left.jpg'), b'third')
+        self.assertIsNone(archive.testzip())
+
+    def test_pdf_embeds_one_page_per_jpeg(self):
+        gray, color = self._jpeg(300, 150), self._jpeg(150, 300, channels=3)
+        items = [(self._photo(1), gray), (self._photo(2), b'not a jpeg'), (self._photo(3), None),
+                 (self._photo(4), color)]
+        document = b''.join(stream_pdf(items))
+
+        self.assertTrue(document.startswith(b'%PDF-1.4'))
+        self.assertIn(b'/Count 2', document)
+        self.assertIn(b'/Width 150 /Height 300 /ColorSpace /DeviceGray', document)
+        self.assertIn(b'/Width 300 /Height 150 /ColorSpace /DeviceRGB', document)
+        self.assertIn(gray, document)
+        self.assertIn(color, document)
+
+        # Every cross-reference entry points at the start of its object
+        xref_offset = int(document.rsplit(b'startxref\n', 1)[1].split(b'\n', 1)[0])
+        entries = document[xref_offset:].split(b'\n')[3:]
+        for object_id, entry in enumerate(entries, start=1):
+            if not entry.endswith(b' n '):
+                break
+            offset = int(entry.split()[0])
+            self.assertTrue(document[offset:].startswith(b'%d 0 obj' % object_id), object_id)
+
+
+class _AIModelTestCase(SimpleTestCase):
+    """Tests of the training modules in ai_model/src, which import each other as top-level modules."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if AI_MODEL_SRC not in sys.path:
+            sys.path.append(AI_MODEL_SRC)
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+
+class ModelArtifactTests(_AIModelTestCase):
+
+    def _model(self):
+        import torch
+        from unet_light import UNetLight
+
+        torch.manual_seed(0)
+        return UNetLight(base_channels=4).eval()
+
+    def test_save_and_load_round_trip(self):
+        import torch
+        import model_artifact
+
+        model = self._model()
+        path = os.path.join(self.directory, 'model.safetensors')
+        written = model_artifact.save_artifact(model, path, input_scale=0.45, data_version='test-data')
+
+        metadata, tensors, _ = model_artifact.read_header(path)
+        self.assertEqual(metadata['architecture'], 'UNetLight')
+        self.assertEqual(metadata['config'], model.config)
+        self.assertEqual(metadata['input_scale'], 0.45)
+        self.assertEqual(metadata['data_version'], 'test-data')
+        self.assertEqual(metadata['checksum'], written['checksum'])
+        self.assertEqual(set(tensors), set(model.state_dict()))
+        self.assertTrue(model_artifact.verify_artifact(path))
+
+        loaded, _ = model_artifact.load_artifact(path, verify=True)
+        for name, tensor in model.state_dict().items():
+            self.assertTrue(torch.equal(loaded.state_dict()[name], tensor), name)
+
+        image = torch.rand(1, 1, 64, 48)
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(loaded(image), model(image)))
+
+    def test_corrupted_data_fails_verification(self):
+        import model_artifact
+
+        path = os.path.join(self.directory, 'model.safetensors')
+        model_artifact.save_artifact(self._model(), path)
+        with open(path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+
+        self.assertFalse(model_artifact.verify_artifact(path))
+        with self.assertRaises(ValueError):
+            model_artifact.load_artifact(path, verify=True)
+
+
+class InferenceModelTests(_AIModelTestCase):
+
+    def _model(self):
+        import torch
+        from unet_flexible import UNetFlexible
+
+        torch.manual_seed(0)
+        model = UNetFlexible(base_channels=4)
+        # Non-trivial BatchNorm statistics, so folding changes every convolution
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.running_mean.uniform_(-0.5, 0.5)
+                module.running_var.uniform_(0.5, 2.0)
+                module.weight.data.uniform_(0.5, 1.5)
+                module.bias.data.uniform_(-0.2, 0.2)
+        return model.eval()
+
+    def test_folded_model_matches_unet_flexible(self):
+        import torch
+        from unet_inference import InferenceUNetFlexible, optimize_for_inference
+
+        model = self._model()
+        optimized = optimize_for_inference(model)
+        self.assertIsInstance(optimized, InferenceUNetFlexible)
+
+        # Sides divisible by 8 write the skip connections in place, the others resize them
+        for height, width in ((64, 48), (61, 45)):
+            image = torch.rand(2, 1, height, width)
+            with torch.no_grad():
+                expected = model(image)
+            actual = optimized(image)
+            self.assertEqual(actual.shape, expected.shape)
+            torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+
+    def test_optimizing_leaves_the_model_unchanged(self):
+        import torch
+        from unet_inference import optimize_for_inference
+
+        model = self._model()
+        state = {name: tensor.clone() for name, tensor in model.state_dict().items()}
+        optimize_for_inference(model)
+        for name, tensor in model.state_dict().items():
+            self.assertTrue(torch.equal(tensor, state[name]), name)
+
+
+class PruneModelTests(_AIModelTestCase):
+
+    def _model(self):
+        import torch
+        from unet_flexible import UNetFlexible
+
+        torch.manual_seed(0)
+        model = UNetFlexible(base_channels=8)
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.weight.data.uniform_(0.1, 1.5)
+        return model.eval()
+
+    def test_pruned_model_has_consistent_shapes_and_finite_output(self):
+        import torch
+        from prune import PRUNABLE, bn_scores, prune_model, select_channels
+
+        model = self._model()
+        keep = select_channels(bn_scores(model), fraction=0.3, min_channels=4)
+        pruned = prune_model(model, keep).eval()
+
+        modules = dict(pruned.named_modules())
+        removed = 0
+        for name in PRUNABLE:
+            self.assertEqual(modules[name].out_channels, len(keep[name]), name)
+            self.assertGreaterEqual(len(keep[name]), 4, name)
+            removed += dict(model.named_modules())[name].out_channels - len(keep[name])
+        self.assertGreater(removed, 0)
+
+        image = torch.rand(1, 1, 64, 48)
+        with torch.no_grad():
+            output = pruned(image)
+        self.assertEqual(output.shape, (1, 2, 64, 48))
+        self.assertTrue(torch.isfinite(output).all())
+
+    def test_keeping_every_channel_reproduces_the_model(self):
+        import torch
+        from prune import PRUNABLE, prune_model
+
+        model = self._model()
+        modules = dict(model.named_modules())
+        keep = {name: torch.arange(modules[name].out_channels) for name in PRUNABLE}
+        pruned = prune_model(model, keep).eval()
+
+        image = torch.rand(1, 1, 64, 48)
+        with torch.no_grad():
+            torch.testing.assert_close(pruned(image), model(image))
+
+
+class DeformationSynthesisTests(_AIModelTestCase):
+    HEIGHT, WIDTH = 120, 90
+
+    def _params(self):
+        from deformation import DeformationParams
+
+        return [
+            DeformationParams(0.0, 0.0, 0.0, 0.5, 1.0, 0.0, 0.0, 0.0),
+            DeformationParams(40.0, 2 * np.pi / self.WIDTH, 1.3, 0.2, 0.9, 8.0, -6.0, 3.0),
+            DeformationParams(95.0, 3 * np.pi / self.WIDTH, 5.0, -0.4, 1.0, -10.0, 10.0, -5.0),
+        ]
+
+    def _mesh_reference(self, params):
+        """The generator's former formula: a homogeneous (H, W, 4) mesh, a linspace ramp and a 4x4 rotation."""
+        from deformation import rotation_matrix
+
+        x_map, y_map = np.meshgrid(np.arange(self.WIDTH, dtype=np.float64), np.arange(self.HEIGHT, dtype=np.float64))
+        flat_mesh = np.stack([x_map, y_map, np.zeros_like(x_map), np.ones_like(x_map)], axis=-1).reshape(-1, 4).T
+        ramp = np.linspace(params.low, params.high, flat_mesh.shape[1])
+        flat_mesh[1] += params.amplitude * np.sin(params.frequency * flat_mesh[0] + params.phase) * ramp
+        rotation = np.eye(4)
+        rotation[:3, :3] = rotation_matrix(params.angle_x, params.angle_y, params.angle_z)
+        transformed = rotation @ flat_mesh
+        return transformed[0].reshape(self.HEIGHT, self.WIDTH), transformed[1].reshape(self.HEIGHT, self.WIDTH)
+
+    def test_batched_maps_match_the_mesh_formula(self):
+        from deformation import deformation_maps
+
+        params = self._params()
+        x_maps, y_maps = deformation_maps(params, self.HEIGHT, self.WIDTH)
+        self.assertEqual(x_maps.shape, (len(params), self.HEIGHT, self.WIDTH))
+        self.assertEqual(x_maps.dtype, np.float32)
+        for k, deformation in enumerate(params):
+            expected_x, expected_y = self._mesh_reference(deformation)
+            np.testing.assert_allclose(x_maps[k], expected_x, atol=1e-3)
+            np.testing.assert_allclose(y_maps[k], expected_y, atol=1e-3)
+
+    def test_remap_batch_warps_with_every_map(self):
+        from deformation import deformation_maps, remap_batch
+
+        rng = np.random.default_rng(0)
+        image = (rng.random((self.HEIGHT, self.WIDTH)) * 255).astype(np.uint8)
+        x_maps, y_maps = deformation_maps(self._params(), self.HEIGHT, self.WIDTH)
+
+        warped = remap_batch(image, x_maps, y_maps, workers=2)
+        for k in range(len(x_maps)):
+            expected = cv2.remap(image, x_maps[k], y_maps[k], interpolation=cv2.INTER_LINEAR,
+                                 borderMode=cv2.BORDER_CONSTANT)
+            np.testing.assert_array_equal(warped[k], expected)
+
+
+class GridDescriptorTests(_AIModelTestCase):
+
+    def _descriptor(self):
+        from deformation import GridDescriptor
+
+        return GridDescriptor(60.0, 2.5 * np.pi / 90, 3.0, 0.3, 0.95, 7.0, -4.0, 2.0, 120, 90, 10, 0.45)
+
+    def test_native_grid_is_the_synthesized_grid(self):
+        from deformation import deformation_maps, expand_grid
+
+        descriptor = self._descriptor()
+        x_map, y_map = expand_grid(descriptor)
+        x_maps, y_maps = deformation_maps([descriptor], descriptor.height, descriptor.width)
+        np.testing.assert_array_equal(x_map, x_maps[0])
+        np.testing.assert_array_equal(y_map, y_maps[0])
+
+    def test_torch_backend_matches_numpy(self):
+        import torch
+        from deformation import expand_grid
+
+        descriptor = self._descriptor()
+        for height, width in ((None, None), (64, 48), (200, 150)):
+            expected_x, expected_y = expand_grid(descriptor, height, width)
+            x_map, y_map = expand_grid(descriptor, height, width, backend="torch")
+            self.assertIsInstance(x_map, torch.Tensor)
+            self.assertEqual(tuple(x_map.shape), expected_x.shape)
+            np.testing.assert_allclose(x_map.numpy(), expected_x, atol=1e-3)
+            np.testing.assert_allclose(y_map.numpy(), expected_y, atol=1e-3)
+
+    def test_descriptor_survives_json(self):
+        from deformation import GridDescriptor
+
+        descriptor = self._descriptor()
+        self.assertEqual(GridDescriptor(*json.loads(json.dumps(descriptor))), descriptor)
+
+    def test_unknown_backend_is_rejected(self):
+        from deformation import expand_grid
+
+        with self.assertRaises(ValueError):
+            expand_grid(self._descriptor(), backend="jax")
+
+
+class _SampleGenerator:
+    """Generator stand-in producing fixed-size random images with known deformations."""
+
+    def __init__(self, height=32, width=24, batch_size=3):
+        self._height, self._width, self._batch_size = height, width, batch_size
+        self._rng = np.random.default_rng()
+        self._images, self._descriptors = [], []
+
+    def __str__(self):
+        return "SampleGenerator"
+
+    def set_seed(self, seed):
+        self._rng = np.random.default_rng(seed)
+
+    def regenerate_data(self, image_scale=0.45):
+        from deformation import GridDescriptor
+
+        self._images = [self._rng.random((self._height, self._width), dtype=np.float32)
+                        for _ in range(self._batch_size)]
+        self._descriptors = [
+            GridDescriptor(float(self._rng.uniform(1, 3)), 0.1, 0.0, 0.5, 1.0, 0.0, 0.0, float(self._rng.uniform(-2, 2)),
+                           self._height, self._width, 2, image_scale)
+            for _ in range(self._batch_size)
+        ]
+
+    def get_images(self):
+        return self._images
+
+    def get_descriptors(self):
+        return self._descriptors
+
+    def delete_images(self):
+        self._images = []
+
+    def delete_grids(self):
+        self._descriptors = []
+
+
+class OfflineDatasetTests(_AIModelTestCase):
+
+    def test_write_and_read_params_encoding(self):
+        from deformation import GridDescriptor
+        from offline_dataset import OfflineDataset, write_dataset
+
+        generator = _SampleGenerator()
+        index = write_dataset(generator, self.directory, samples_per_scale=5, image_scales=[0.2, 0.45], seed=1,
+                              shard_bytes=2048)
+        self.assertGreater(len(index['shards']), 1)
+
+        # The same seed writes the same samples
+        expected = _SampleGenerator()
+        expected.set_seed(1)
+        expected.regenerate_data(0.2)
+
+        dataset = OfflineDataset(self.directory)
+        self.assertEqual(len(dataset), 10)
+        self.assertEqual(dataset.image_scales(), [0.2, 0.45])
+        self.assertEqual(dataset.data_version, index['data_version'])
+
+        image, descriptor = dataset[0]
+        self.assertIsInstance(descriptor, GridDescriptor)
+        self.assertEqual(descriptor, expected.get_descriptors()[0])
+        np.testing.assert_allclose(image, expected.get_images()[0], atol=0.5 / 255 + 1e-6)
+
+    def test_write_and_read_dense_grids(self):
+        from deformation import expand_grid
+        from offline_dataset import OfflineDataset, write_dataset
+
+        write_dataset(_SampleGenerator(), self.directory, samples_per_scale=4, image_scales=[0.45],
+                      grid_encoding='float32')
+        dataset = OfflineDataset(self.directory)
+
+        expected = _SampleGenerator()
+        expected.set_seed(0)
+        expected.regenerate_data(0.45)
+        _, (x_map, y_map) = dataset[1]
+        expected_x, expected_y = expand_grid(expected.get_descriptors()[1])
+        np.testing.assert_allclose(x_map, expected_x, atol=1e-4)
+        np.testing.assert_allclose(y_map, expected_y, atol=1e-4)
+
+    def test_batches_use_the_nearest_image_scale(self):
+        from offline_dataset import OfflineDataset, write_dataset
+
+        write_dataset(_SampleGenerator(), self.directory, samples_per_scale=5, image_scales=[0.2, 0.45])
+        dataset = OfflineDataset(self.directory)
+
+        self.assertEqual(dataset.indices(0.4), list(range(5, 10)))
+        batches = list(dataset.iter_batches(0.1, pages_per_batch=2, shuffle=False, endless=False))
+        self.assertEqual([len(images) for images, _ in batches], [2, 2, 1])
+        self.assertTrue(all(descriptor.image_scale == 0.2 for _, grids in batches for descriptor in grids))
+
+    def test_empty_dataset_names_path_and_scale(self):
+        from offline_dataset import OfflineDataset, ShardWriter
+
+        ShardWriter(self.directory).write_index({})
+        with self.assertRaisesRegex(ValueError, f"{re.escape(self.directory)}.*0\\.45"):
+            OfflineDataset(self.directory).indices(0.45)
+
+    def test_generator_without_samples_raises(self):
+        from offline_dataset import write_dataset
+
+        with self.assertRaisesRegex(RuntimeError, "no samples"):
+            write_dataset(_SampleGenerator(batch_size=0), self.directory, samples_per_scale=2, image_scales=[0.45])
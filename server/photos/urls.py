@@ -1,16 +1,38 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     UploadEncryptedPhotoView, 
     ViewDecryptedPhoto, 
     TemporaryDecryptedPhotoView, 
     DeletePhotoView, 
-    ListUserPhotosView
+    ListUserPhotosView,
+    RenderPhotoView,
+    DewarpStatsView,
+    ExportPhotosView,
+    PhotoStatusView,
 )
 
+if settings.PHOTOS_ASYNC_VIEWS:
+    from .async_views import (
+        AsyncUploadEncryptedPhotoView as UploadView,
+        AsyncViewDecryptedPhoto as PhotoView,
+        AsyncTemporaryDecryptedPhotoView as TemporaryPhotoView,
+        AsyncListUserPhotosView as ListPhotosView,
+    )
+else:
+    UploadView = UploadEncryptedPhotoView
+    PhotoView = ViewDecryptedPhoto
+    TemporaryPhotoView = TemporaryDecryptedPhotoView
+    ListPhotosView = ListUserPhotosView
+
 urlpatterns = [
-    path('upload-photo/', UploadEncryptedPhotoView.as_view(), name='upload-photo'),
-    path('view/<int:photo_id>/', ViewDecryptedPhoto.as_view(), name='view-photo'),
-    path('temp-view/<str:signed_value>/', TemporaryDecryptedPhotoView.as_view()),
+    path('upload-photo/', UploadView.as_view(), name='upload-photo'),
+    path('view/<int:photo_id>/', PhotoView.as_view(), name='view-photo'),
+    path('temp-view/<str:signed_value>/', TemporaryPhotoView.as_view()),
+    path('status/<int:photo_id>/', PhotoStatusView.as_view(), name='photo-status'),
+    path('render/<int:photo_id>/', RenderPhotoView.as_view(), name='render-photo'),
     path('delete-photo/<int:photo_id>/', DeletePhotoView.as_view(), name='delete-photo'),
-    path('user-photos/', ListUserPhotosView.as_view(), name='user-photos'),
-]
\ No newline at end of file
+    path('user-photos/', ListPhotosView.as_view(), name='user-photos'),
+    path('export/', ExportPhotosView.as_view(), name='export-photos'),
+    path('stats/', DewarpStatsView.as_view(), name='dewarp-stats'),
+]
@@ -1,53 +1,163 @@
+import os
+import uuid
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.core.files.base import ContentFile
-from django.http import FileResponse, Http404, HttpResponseForbidden, HttpResponseNotFound
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponseForbidden, HttpResponseNotFound, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from .models import EncryptedPhoto
 from .utils import generate_signed_url, verify_signed_url, get_user_key
-from .image_processing import ImageProcessing
+from . import dewarp_service
+from .export import iter_decrypted, stream_pdf, stream_zip
+from .profiling import ProfiledViewMixin
+from .refinement import submit_refinement
+from .timing import StageTimer
+from .admission import (
+    AdmissionRejected,
+    ImageTooLarge,
+    PRIORITIES,
+    PRIORITY_INTERACTIVE,
+    dewarp_admission,
+    estimate_render_cost,
+    plan_processing,
+    read_image_size,
+)
 
 
-class UploadEncryptedPhotoView(APIView):
+class UploadEncryptedPhotoView(ProfiledViewMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         """
         Upload a photo and store it encrypted using the user's unique key.
+
+        With the form field spread=true the photo is treated as an open book: if a
+        gutter is found, both pages are dewarped concurrently and stored as two photos
+        sharing a spread_id, with page_side 'left' and 'right'.
+
+        Clients uploading many photos at once (e.g. a whole book) send priority=bulk, so
+        their uploads are queued behind other users' interactive uploads. Users with
+        DEWARP_USER_INTERACTIVE_BURST uploads in flight are queued as bulk regardless.
+
+        With progressive=true (default: DEWARP_PROGRESSIVE) a single-page upload is answered
+        with a quick preview without inference. The full dewarp replaces it in the background
+        under the same photo ID, incrementing the photo's version.
         
         Returns:
-            - 201 Created: with signed URL and photo ID
-            - 400 Bad Request: if no file is uploaded
+            - 201 Created: with signed URL and photo ID of the (first) page and the list of pages
+            - 400 Bad Request: if no file is uploaded or the format is not supported
+            - 413 Payload Too Large: if the image exceeds the processing limits
+            - 429 Too Many Requests: if image processing is saturated (with Retry-After)
         """
+        timer = StageTimer()
         uploaded_file = request.FILES.get('photo')
         if not uploaded_file:
             return Response({"detail": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
 
+        size = read_image_size(uploaded_file)
+        if size is None:
+            return Response({"detail": "Unsupported image format."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            cost = plan_processing(*size)
+        except ImageTooLarge as e:
+            return Response({"detail": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        spread = str(request.data.get('spread', '')).lower() in ('1', 'true', 'yes')
+        priority = request.data.get('priority', PRIORITY_INTERACTIVE)
+        if priority not in PRIORITIES:
+            return Response({"detail": "Invalid priority."}, status=status.HTTP_400_BAD_REQUEST)
+        priority = dewarp_admission.assign_priority(request.user.id, priority)
+
+        progressive = str(request.data.get('progressive', settings.DEWARP_PROGRESSIVE)).lower() in ('1', 'true', 'yes')
+        progressive = progressive and not spread
+
         fernet = get_user_key(request.user.id)
         uploaded_file_name = uploaded_file.name
-        uploaded_file = ImageProcessing()(uploaded_file)
-        encrypted_data = fernet.encrypt(uploaded_file)
-        encrypted_file = ContentFile(encrypted_data)
-
-        photo = EncryptedPhoto.objects.create(
-            user=request.user,
-            file=None,
-            original_filename=uploaded_file_name,
-        )
+        original_data = uploaded_file.read()
+        uploaded_file.seek(0)
+        timer.mark('read')
+        try:
+            if progressive:
+                # The preview skips inference: it reserves the share of a render, and the refinement
+                # takes the full dewarp cost later
+                preview_cost = estimate_render_cost(*size, cost.reduction)
+                with dewarp_admission.admit(preview_cost, request.user.id, priority):
+                    timer.mark('admission')
+                    pages = [dewarp_service.preview(uploaded_file, reduction=cost.reduction)]
+                    timer.mark('preview')
+            else:
+                with dewarp_admission.admit(cost, request.user.id, priority):
+                    timer.mark('admission')
+                    if spread:
+                        pages = dewarp_service.dewarp_spread(uploaded_file, reduction=cost.reduction)
+                    else:
+                        pages = [dewarp_service.dewarp(uploaded_file, reduction=cost.reduction)]
+                    timer.mark('dewarp')
+        except AdmissionRejected as e:
+            return Response(
+                {"detail": "Server is busy processing other photos. Try again later."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(e.retry_after)},
+            )
 
-        filename = f"user_{request.user.id}_{photo.id}.enc"
-        photo.file.save(filename, encrypted_file)
-        photo.save()
+        spread_id = uuid.uuid4() if len(pages) > 1 else None
+        page_list = []
 
-        signed_url = generate_signed_url(photo.id)
-        full_url = request.build_absolute_uri(signed_url)
+        for page in pages:
+            encrypted_data = fernet.encrypt(page.image)
+            photo = EncryptedPhoto.objects.create(
+                user=request.user,
+                file=None,
+                original_filename=uploaded_file_name,
+                # A preview was not produced by the model, so reprocess_photos picks it up if refinement is lost
+                model_version='' if progressive else dewarp_service.get_model_version(),
+                is_preview=progressive,
+                spread_id=spread_id,
+                page_side=page.side,
+                width=page.width,
+                height=page.height,
+                plain_size=len(page.image),
+                encrypted_size=len(encrypted_data),
+                processing_time=page.processing_time,
+                placeholder=page.placeholder,
+            )
 
-        return Response({
-            "processed_url": full_url,
-            "photo_id": photo.id,
-        }, status=status.HTTP_201_CREATED)
+            filename = f"user_{request.user.id}_{photo.id}.enc"
+            photo.file.save(filename, ContentFile(encrypted_data), save=False)
+            # Keep the encrypted original so the photo can be reprocessed after a model upgrade
+            original = page.original if page.original is not None else original_data
+            photo.original_file.save(filename, ContentFile(fernet.encrypt(original)), save=False)
+            # Keep the deformation field so renditions can be re-rendered without inference
+            if page.field:
+                photo.deformation_file.save(filename, ContentFile(fernet.encrypt(page.field)), save=False)
+            photo.save()
+
+            if progressive:
+                submit_refinement(photo.id, request.user.id, cost, priority)
+
+            signed_url = generate_signed_url(photo.id)
+            page_list.append({
+                "processed_url": request.build_absolute_uri(signed_url),
+                "photo_id": photo.id,
+                "page_side": photo.page_side,
+                "version": photo.version,
+                "is_preview": photo.is_preview,
+            })
+
+        timer.mark('store')
+
+        return timer.apply(Response({
+            "processed_url": page_list[0]["processed_url"],
+            "photo_id": page_list[0]["photo_id"],
+            "spread_id": spread_id,
+            "version": page_list[0]["version"],
+            "is_preview": page_list[0]["is_preview"],
+            "pages": page_list,
+        }, status=status.HTTP_201_CREATED))
 
 
 class ViewDecryptedPhoto(APIView):
@@ -94,6 +204,7 @@ class TemporaryDecryptedPhotoView(APIView):
     permission_classes = []
 
     def get(self, request, signed_value):
+        timer = StageTimer()
         photo_id = verify_signed_url(signed_value)
         if photo_id is None:
             return HttpResponseForbidden("Invalid or expired link.")
@@ -104,19 +215,116 @@ class TemporaryDecryptedPhotoView(APIView):
             return HttpResponseNotFound("Photo not found.")
 
         fernet = get_user_key(photo.user.id)
+        timer.mark('query')
 
         try:
             with open(photo.file.path, 'rb') as f:
                 encrypted_data = f.read()
+                timer.mark('read')
                 decrypted_data = fernet.decrypt(encrypted_data)
+                timer.mark('decrypt')
         except Exception:
             return HttpResponseForbidden("Could not decrypt the image.")
 
-        return FileResponse(
+        return timer.apply(FileResponse(
             ContentFile(decrypted_data),
             content_type='image/jpeg',
             filename=photo.original_filename
-        )
+        ))
+
+
+class RenderPhotoView(ProfiledViewMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    RENDER_FORMATS = {
+        'jpeg': ('.jpg', 'image/jpeg'),
+        'png': ('.png', 'image/png'),
+        'webp': ('.webp', 'image/webp'),
+    }
+
+    def get(self, request, photo_id):
+        """
+        Re-render a photo from its stored original and deformation field at another size or format.
+        No neural network inference is performed.
+
+        Query params:
+            - scale: output scale relative to the original photo, in (0, 1] (default 0.4)
+            - format: jpeg, png or webp (default jpeg)
+
+        Returns:
+            - 200 OK: FileResponse with the rendered image
+            - 400 Bad Request: if the parameters are invalid
+            - 404 Not Found: if the photo has no stored original or field, or decryption fails
+            - 429 Too Many Requests: if image processing is saturated (with Retry-After)
+        """
+        photo = get_object_or_404(EncryptedPhoto, id=photo_id, user=request.user)
+        if not photo.original_file or not photo.deformation_file:
+            raise Http404("This photo has no stored deformation field.")
+
+        try:
+            scale = float(request.query_params.get('scale', 0.4))
+        except ValueError:
+            scale = 0
+        image_format = request.query_params.get('format', 'jpeg')
+        if not 0 < scale <= 1 or image_format not in self.RENDER_FORMATS:
+            return Response({"detail": "Invalid scale or format."}, status=status.HTTP_400_BAD_REQUEST)
+        ext, content_type = self.RENDER_FORMATS[image_format]
+
+        fernet = get_user_key(request.user.id)
+
+        try:
+            with open(photo.original_file.path, 'rb') as f:
+                original_data = fernet.decrypt(f.read())
+            with open(photo.deformation_file.path, 'rb') as f:
+                field_data = fernet.decrypt(f.read())
+        except Exception:
+            raise Http404("Could not decrypt the image.")
+
+        original_file = ContentFile(original_data)
+        size = read_image_size(original_file)
+        try:
+            if size is None:
+                raise ImageTooLarge("Unsupported image format.")
+            cost = plan_processing(*size)
+        except ImageTooLarge:
+            raise Http404("Could not render the image.")
+
+        # Rendering skips inference, so it reserves only its own, much smaller share of the budget
+        render_cost = estimate_render_cost(*size, cost.reduction)
+        try:
+            with dewarp_admission.admit(render_cost, request.user.id, PRIORITY_INTERACTIVE):
+                rendered_data = dewarp_service.render(
+                    original_file, field_data, scale=scale, reduction=cost.reduction, ext=ext
+                )
+        except AdmissionRejected as e:
+            return Response(
+                {"detail": "Server is busy processing other photos. Try again later."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+        filename = os.path.splitext(photo.original_filename)[0] + ext
+        return FileResponse(ContentFile(rendered_data), content_type=content_type, filename=filename)
+
+
+class PhotoStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, photo_id):
+        """
+        Report the version of a photo, so clients can poll until a preview is replaced by the full dewarp.
+
+        Returns:
+            - 200 OK: photo ID, version, whether the photo is still a preview, and a signed URL
+            - 404 Not Found: if the photo does not exist or user is unauthorized
+        """
+        photo = get_object_or_404(EncryptedPhoto, id=photo_id, user=request.user)
+        return Response({
+            "photo_id": photo.id,
+            "version": photo.version,
+            "is_preview": photo.is_preview,
+            "processed_url": request.build_absolute_uri(generate_signed_url(photo.id)),
+        }, status=status.HTTP_200_OK)
 
 
 class DeletePhotoView(APIView):
@@ -145,6 +353,7 @@ class ListUserPhotosView(APIView):
         Returns:
             - 200 OK: A list of photo metadata and signed URLs
         """
+        timer = StageTimer()
         user_photos = EncryptedPhoto.objects.filter(user=request.user)
         photo_list = []
 
@@ -155,6 +364,71 @@ class ListUserPhotosView(APIView):
                 "photo_id": photo.id,
                 "original_filename": photo.original_filename,
                 "processed_url": full_url,
+                "spread_id": photo.spread_id,
+                "page_side": photo.page_side,
+                "width": photo.width,
+                "height": photo.height,
+                "plain_size": photo.plain_size,
+                "encrypted_size": photo.encrypted_size,
+                "processing_time": photo.processing_time,
+                "model_version": photo.model_version,
+                "placeholder": photo.placeholder,
+                "version": photo.version,
+                "is_preview": photo.is_preview,
+                "uploaded_at": photo.uploaded_at,
             })
 
-        return Response(photo_list, status=status.HTTP_200_OK)
\ No newline at end of file
+        timer.mark('query')
+
+        return timer.apply(Response(photo_list, status=status.HTTP_200_OK))
+
+
+class ExportPhotosView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    EXPORT_FORMATS = {
+        'zip': (stream_zip, 'application/zip'),
+        'pdf': (stream_pdf, 'application/pdf'),
+    }
+
+    def get(self, request):
+        """
+        Export all photos of the authenticated user as one ZIP archive or multi-page PDF, in upload order.
+        Photos are decrypted one at a time while the response is streamed, so memory use
+        does not grow with the size of the library.
+
+        Query params:
+            - format: zip or pdf (default zip)
+
+        Returns:
+            - 200 OK: StreamingHttpResponse with the archive or document
+            - 400 Bad Request: if the format is invalid
+        """
+        export_format = request.query_params.get('format', 'zip')
+        if export_format not in self.EXPORT_FORMATS:
+            return Response({"detail": "Invalid format."}, status=status.HTTP_400_BAD_REQUEST)
+        stream, content_type = self.EXPORT_FORMATS[export_format]
+
+        fernet = get_user_key(request.user.id)
+        photos = EncryptedPhoto.objects.filter(user=request.user).order_by('uploaded_at', 'id').iterator()
+        items = iter_decrypted(photos, fernet, read_ahead=settings.PHOTO_EXPORT_READ_AHEAD)
+
+        response = StreamingHttpResponse(stream(items), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="photos.{export_format}"'
+        return response
+
+
+class DewarpStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        Report image processing statistics of the current worker process (staff only).
+
+        Returns:
+            - 200 OK: processing path counts and admission control usage
+        """
+        return Response({
+            "paths": dewarp_service.path_counts(),
+            "admission": dewarp_admission.stats(),
+        }, status=status.HTTP_200_OK)